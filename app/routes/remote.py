@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, make_response
 from flask_login import login_required, current_user
 from app import db, socketio
 from app.models.connection import Connection
@@ -6,7 +6,9 @@ from app.services.client_manager import ClientManager
 from app.services.remote_service import connection_manager
 from app.services.remote_management import remote_manager
 import datetime
+import hashlib
 import json
+import time
 import logging
 
 # Set up logger
@@ -185,6 +187,139 @@ def api_sessions():
         'sessions': sessions
     })
 
+@remote_bp.route('/api/recordings', methods=['GET'])
+@login_required
+def api_recordings():
+    """API endpoint to list stream recordings."""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+    
+    return jsonify({
+        'success': True,
+        'recordings': remote_manager.list_recordings()
+    })
+
+@remote_bp.route('/api/recordings/<session_id>/frames', methods=['GET'])
+@login_required
+def api_recording_frames(session_id):
+    """API endpoint to play back a stream recording from a point in time."""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+    
+    start = request.args.get('start', 0, type=float)
+    duration = min(request.args.get('duration', 10, type=float), 60)
+    frames = remote_manager.get_recording_frames(session_id, start, duration)
+    
+    if frames is None:
+        return jsonify({'success': False, 'message': 'Recording not found'}), 404
+    
+    return jsonify({
+        'success': True,
+        'session_id': session_id,
+        'start': start,
+        'frames': frames
+    })
+
+@remote_bp.route('/api/streams/telemetry', methods=['GET'])
+@remote_bp.route('/api/streams/<client_id>/telemetry', methods=['GET'])
+@login_required
+def api_stream_telemetry(client_id=None):
+    """API endpoint for the latency and rate telemetry of active streams."""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+    
+    telemetry = remote_manager.get_stream_telemetry(client_id)
+    if telemetry is None:
+        return jsonify({'success': False, 'message': 'No active stream for this client'}), 404
+    
+    return jsonify({
+        'success': True,
+        'telemetry': telemetry
+    })
+
+@remote_bp.route('/api/thumbnails', methods=['GET'])
+@login_required
+def api_thumbnails():
+    """
+    API endpoint for the fleet overview: the latest thumbnail of every
+    client, or of those listed in ?clients=, in one response.
+    
+    With ?since= set to the previous response's server_time only changed
+    thumbnails carry image data. The response has an ETag, so polling an
+    unchanged fleet costs a 304.
+    """
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+    
+    client_ids = request.args.get('clients')
+    client_ids = [client_id for client_id in client_ids.split(',') if client_id] if client_ids else None
+    since = request.args.get('since', type=float)
+    
+    # Taken before reading so thumbnails arriving meanwhile are in the next poll
+    server_time = time.time()
+    thumbnails = remote_manager.get_thumbnails(client_ids, since)
+    
+    etag = hashlib.sha1(json.dumps(
+        [[thumbnail['client_id'], thumbnail['etag'], thumbnail['status'], thumbnail['streaming']]
+         for thumbnail in thumbnails]
+    ).encode('utf-8')).hexdigest()
+    
+    response = make_response(jsonify({
+        'success': True,
+        'thumbnail_mode': remote_manager.thumbnail_settings,
+        'server_time': server_time,
+        'thumbnails': thumbnails
+    }))
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+@remote_bp.route('/api/thumbnails/<client_id>', methods=['GET'])
+@login_required
+def api_thumbnail(client_id):
+    """API endpoint for one client's latest thumbnail image, cacheable by ETag."""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+    
+    thumbnail = remote_manager.get_thumbnail(client_id)
+    if thumbnail is None:
+        return jsonify({'success': False, 'message': 'No thumbnail for this client'}), 404
+    
+    response = make_response(thumbnail['image'])
+    response.mimetype = thumbnail['mime_type']
+    response.set_etag(thumbnail['etag'])
+    response.cache_control.no_cache = True  # Always revalidate, the ETag makes that cheap
+    return response.make_conditional(request)
+
+@remote_bp.route('/api/thumbnails/mode', methods=['POST'])
+@login_required
+def api_thumbnail_mode():
+    """API endpoint to turn thumbnail mode for the fleet overview on or off."""
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    if data.get('enabled', True):
+        settings = {}
+        try:
+            if 'interval' in data:
+                settings['interval'] = float(data['interval'])
+            if 'max_width' in data:
+                settings['max_width'] = int(data['max_width'])
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Thumbnail interval and width must be numbers'}), 400
+        
+        success, message = remote_manager.start_thumbnails(**settings)
+        if not success:
+            return jsonify({'success': False, 'message': message}), 400
+    else:
+        success, message = remote_manager.stop_thumbnails()
+    
+    return jsonify({
+        'success': success,
+        'message': message,
+        'thumbnail_mode': remote_manager.thumbnail_settings
+    })
+
 # === Helper Functions ===
 
 def get_connection_stats():
@@ -0,0 +1,213 @@
+"""
+Delta sync module for updating files that already exist on a client agent.
+The client sends a rolling and a strong checksum of every block of its copy;
+the server finds those blocks anywhere in the new file and sends only the
+bytes in between plus references to blocks the client already has, as
+rsync does. The rolling checksums are computed with NumPy, a whole segment
+of the file at a time, so only candidate matches are looked at in Python.
+"""
+
+import math
+import hashlib
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DELTA_MIN_BLOCK_SIZE = 1024
+DELTA_MAX_BLOCK_SIZE = 128 * 1024
+DELTA_SEGMENT_SIZE = 1024 * 1024  # Bytes of the new file checksummed per NumPy pass
+DELTA_OP_OVERHEAD = 16  # Estimated bytes on the wire per operation, for sizing a delta
+DELTA_MAX_OPS_PER_MESSAGE = 4096
+DELTA_FILTER_BITS = 22  # Low checksum bits indexing the table that screens out offsets matching no block
+
+def delta_block_size(file_size):
+    """Block size for a file: about its square root, so blocks and block count grow together."""
+    size = int(math.sqrt(file_size)) // 1024 * 1024
+    return max(DELTA_MIN_BLOCK_SIZE, min(DELTA_MAX_BLOCK_SIZE, size))
+
+def strong_checksum(block):
+    """Checksum confirming a rolling checksum match."""
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+def _weak(a, b):
+    # rsync's checksum: two 16-bit sums packed into one 32-bit value
+    weak = b.astype(np.uint32)
+    weak <<= np.uint32(16)
+    weak |= a.astype(np.uint16)
+    return weak
+
+def block_checksums(data, block_size):
+    """
+    Rolling checksums of each whole block of data, as a uint32 array.
+    
+    A trailing partial block is left out; its bytes are sent as literals
+    if the new file needs them.
+    """
+    count = len(data) // block_size
+    rows = np.frombuffer(data, dtype=np.uint8, count=count * block_size).reshape(count, block_size)
+    a = rows.sum(axis=1, dtype=np.int64)
+    b = rows @ np.arange(block_size, 0, -1, dtype=np.int64)
+    return _weak(a, b)
+
+def rolling_checksums(data, block_size):
+    """Rolling checksums of the block starting at every offset of data, as a uint32 array."""
+    if len(data) < block_size:
+        return np.empty(0, dtype=np.uint32)
+    
+    # With prefix sums of x[i] and i * x[i], every window's sums are a subtraction apart.
+    # Only the sums modulo 2**16 are kept, so uint16 arithmetic may wrap around freely
+    size = len(data)
+    x = np.frombuffer(data, dtype=np.uint8)
+    sums = np.zeros(size + 1, dtype=np.uint16)
+    np.cumsum(x, dtype=np.uint16, out=sums[1:])
+    weighted = np.zeros(size + 1, dtype=np.uint16)
+    np.cumsum(x * np.arange(size, dtype=np.uint16), out=weighted[1:])
+    
+    a = sums[block_size:] - sums[:-block_size]
+    b = np.arange(block_size, size + 1, dtype=np.uint16)  # Window end, i.e. start + block_size
+    b *= a
+    b -= weighted[block_size:]
+    b += weighted[:-block_size]
+    return _weak(a, b)
+
+def file_signatures(f, block_size):
+    """The weak checksums (as little-endian uint32 bytes) and concatenated strong checksums of an open file's blocks."""
+    weak = []
+    strong = []
+    segment = max(DELTA_SEGMENT_SIZE // block_size, 1) * block_size
+    while True:
+        data = f.read(segment)
+        weak.append(block_checksums(data, block_size))
+        for offset in range(0, len(data) - block_size + 1, block_size):
+            strong.append(strong_checksum(data[offset:offset + block_size]))
+        if len(data) < segment:
+            break
+    return np.concatenate(weak).astype('<u4').tobytes(), b''.join(strong)
+
+def compute_delta(f, file_size, weak, strong, block_size):
+    """
+    Match the blocks of the client's copy against an open file.
+    
+    Returns a list of operations rebuilding the file: ('copy', index, count)
+    for count blocks of the client's copy starting at block index, and
+    ('literal', start, end) for bytes of this file the client doesn't have.
+    """
+    weak = np.frombuffer(weak, dtype='<u4')
+    blocks = {}
+    for index in range(len(weak)):
+        blocks.setdefault(strong[index * 16:(index + 1) * 16], index)
+    known = np.unique(weak)
+    mask = (1 << DELTA_FILTER_BITS) - 1
+    screen = np.zeros(1 << DELTA_FILTER_BITS, dtype=bool)
+    screen[known & mask] = True
+    
+    ops = []
+    literal_start = 0
+    position = 0
+    segment = max(DELTA_SEGMENT_SIZE, 4 * block_size)
+    segment_start = 0
+    while len(known) and segment_start <= file_size - block_size:
+        f.seek(segment_start)
+        data = f.read(segment + block_size - 1)
+        candidates = None
+        start = position - segment_start
+        while start < segment and start + block_size <= len(data):
+            # Runs of unchanged blocks follow one another, so the block right
+            # after a match is tried first; the rolling checksums of the rest
+            # of the segment are only worked out once that fails
+            index = blocks.get(strong_checksum(data[start:start + block_size])) if start == position - segment_start else None
+            if index is None:
+                if candidates is None:
+                    checksums = rolling_checksums(data, block_size)
+                    candidates = np.flatnonzero(screen[checksums & mask])
+                    candidates = candidates[np.isin(checksums[candidates], known)]
+                for candidate in candidates[np.searchsorted(candidates, start + (start == position - segment_start)):]:
+                    index = blocks.get(strong_checksum(data[candidate:candidate + block_size]))
+                    if index is not None:
+                        start = int(candidate)
+                        break
+                if index is None:
+                    break
+            
+            offset = segment_start + start
+            if offset > literal_start:
+                ops.append(('literal', literal_start, offset))
+            if ops and ops[-1][0] == 'copy' and ops[-1][1] + ops[-1][2] == index:
+                ops[-1] = ('copy', ops[-1][1], ops[-1][2] + 1)
+            else:
+                ops.append(('copy', index, 1))
+            position = literal_start = start = offset + block_size
+            start -= segment_start
+        
+        segment_start = max(segment_start + segment, position)
+    
+    if literal_start < file_size:
+        ops.append(('literal', literal_start, file_size))
+    return ops
+
+def delta_size(ops):
+    """Estimated bytes on the wire to send a delta."""
+    return sum(DELTA_OP_OVERHEAD + (op[2] - op[1] if op[0] == 'literal' else 0) for op in ops)
+
+def delta_messages(f, ops, block_size, chunk_size):
+    """
+    Split a delta into messages of about chunk_size literal bytes, read from
+    the open file as they are needed.
+    
+    Yields (ops, position), where ops are {'copy': index, 'count': count}
+    or {'data': bytes} entries and position is how far into the file they
+    have rebuilt.
+    """
+    batch = []
+    pending = 0
+    position = 0
+    for op in ops:
+        if op[0] == 'copy':
+            batch.append({'copy': op[1], 'count': op[2]})
+            position += op[2] * block_size
+        else:
+            for start in range(op[1], op[2], chunk_size):
+                f.seek(start)
+                data = f.read(min(chunk_size, op[2] - start))
+                batch.append({'data': data})
+                pending += len(data)
+                position = start + len(data)
+                if pending >= chunk_size:
+                    yield batch, position
+                    batch = []
+                    pending = 0
+        if len(batch) >= DELTA_MAX_OPS_PER_MESSAGE:
+            yield batch, position
+            batch = []
+            pending = 0
+    if batch:
+        yield batch, position
+
+def file_checksum(f):
+    """Checksum of a whole open file, read from its current position, checking the rebuilt file."""
+    digest = hashlib.blake2b(digest_size=16)
+    for data in iter(lambda: f.read(DELTA_SEGMENT_SIZE), b''):
+        digest.update(data)
+    return digest.hexdigest()
+
+def apply_delta(basis, messages, block_size, out):
+    """Rebuild a file into out from the client's copy (basis) and delta messages; returns the bytes written."""
+    written = 0
+    for ops in messages:
+        for op in ops:
+            if 'data' in op:
+                out.write(op['data'])
+                written += len(op['data'])
+                continue
+            basis.seek(op['copy'] * block_size)
+            remaining = op['count'] * block_size
+            while remaining:
+                data = basis.read(min(remaining, DELTA_SEGMENT_SIZE))
+                if not data:
+                    raise ValueError(f"Block {op['copy'] + op['count'] - 1} is past the end of the file")
+                out.write(data)
+                written += len(data)
+                remaining -= len(data)
+    return written
@@ -0,0 +1,397 @@
+"""
+File transfer module for transfers to and from client agents.
+Writes received chunks straight to disk at their offset, so a transfer needs
+the same small amount of memory whatever the size of the file, paces
+uploads with a sliding window sized to the link, and keeps manifests on disk
+so interrupted transfers resume where they stopped.
+"""
+
+import os
+import json
+import bisect
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = '.part'
+CHUNK_LOG_SUFFIX = '.chunks'  # Next to the part file: offset, length and hash of each chunk on disk
+
+# Upload window, in chunks
+UPLOAD_INITIAL_WINDOW = 4
+UPLOAD_MAX_WINDOW = 64
+UPLOAD_WINDOW_GAIN = 2  # Window growth per round trip while the round trip time stays at its minimum
+UPLOAD_INITIAL_TIMEOUT = 3  # Seconds before an unacknowledged chunk is sent again, until round trips are measured
+UPLOAD_MIN_TIMEOUT = 1
+UPLOAD_MAX_TIMEOUT = 60
+
+TRANSFER_CHECKPOINT_INTERVAL = 5  # Seconds between manifest checkpoints of a running transfer
+
+def chunk_hash(data):
+    """Hash identifying the content of a chunk in transfer manifests."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def stale_chunks(f, chunks, chunk_size):
+    """Offsets of the manifest's chunks whose content in the open file f no longer matches."""
+    stale = []
+    for offset, expected in sorted(chunks.items()):
+        f.seek(offset)
+        if chunk_hash(f.read(chunk_size)) != expected:
+            stale.append(offset)
+    return stale
+
+def chunk_ranges(chunks, chunk_size, file_size):
+    """The byte ranges covered by a manifest's chunks."""
+    return RangeSet((offset, min(offset + chunk_size, file_size)) for offset in chunks)
+
+def read_chunk_log(path):
+    """
+    The (offset, length, hash) entries of a chunk log, oldest first; a chunk
+    written twice appears twice. A line torn by a crash is skipped.
+    """
+    with open(path) as f:
+        for line in f:
+            try:
+                offset, length, digest = line.split()
+                yield int(offset), int(length), digest
+            except ValueError:
+                continue
+
+def chunk_log_ranges(path):
+    """The byte ranges covered by the chunks of a chunk log."""
+    return RangeSet((offset, offset + length) for offset, length, _ in read_chunk_log(path))
+
+class RangeSet:
+    """
+    Set of byte ranges, kept as sorted, merged [start, end) pairs.
+    
+    Chunks arriving in order extend a single range, so the set stays one
+    pair long however many chunks a transfer has.
+    """
+    
+    def __init__(self, ranges=()):
+        self.starts = []
+        self.ends = []
+        for start, end in ranges:
+            self.add(start, end)
+    
+    def add(self, start, end):
+        """Add [start, end), merging it with any ranges it touches."""
+        if end <= start:
+            return
+        
+        # Ranges that overlap or touch the new one are replaced by their union
+        first = bisect.bisect_left(self.ends, start)
+        last = bisect.bisect_right(self.starts, end)
+        if first < last:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last - 1])
+        self.starts[first:last] = [start]
+        self.ends[first:last] = [end]
+    
+    def covers(self, start, end):
+        """Whether [start, end) is entirely in the set."""
+        if end <= start:
+            return True
+        index = bisect.bisect_right(self.starts, start) - 1
+        return index >= 0 and self.ends[index] >= end
+    
+    def missing(self, size):
+        """The ranges of [0, size) not in the set."""
+        gaps = []
+        position = 0
+        for start, end in zip(self.starts, self.ends):
+            if start >= size:
+                break
+            if start > position:
+                gaps.append((position, start))
+            position = max(position, end)
+        if position < size:
+            gaps.append((position, size))
+        return gaps
+    
+    def total(self):
+        """Number of bytes in the set."""
+        return sum(end - start for start, end in zip(self.starts, self.ends))
+    
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends))
+    
+    def __len__(self):
+        return len(self.starts)
+
+class ChunkedFileWriter:
+    """
+    Writes a file from chunks that may arrive in any order.
+    
+    Chunks go to a sparse '.part' file next to the destination, sized up
+    front, and are written at their offset as they arrive; only the ranges
+    received so far are kept in memory. The hash of each chunk, needed to
+    resume, is appended to a chunk log next to the part file at every
+    checkpoint. The part file replaces the destination once every byte has
+    arrived.
+    """
+    
+    def __init__(self, path, file_size, resume=False):
+        """Open the part file, or with resume reopen it and its chunk log to carry on from the last checkpoint."""
+        self.path = path
+        self.part_path = path + PART_SUFFIX
+        self.log_path = self.part_path + CHUNK_LOG_SUFFIX
+        self.file_size = file_size
+        self.received = RangeSet()
+        self.unlogged = []  # (offset, length, hash) of the chunks written since the last checkpoint
+        self.lock = threading.Lock()
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        if resume and os.path.exists(self.part_path) and os.path.exists(self.log_path):
+            self.file = open(self.part_path, 'r+b')
+            self.received = chunk_log_ranges(self.log_path)
+            self.log = open(self.log_path, 'a')
+        else:
+            self.file = open(self.part_path, 'wb')
+            self.file.truncate(file_size)
+            self.log = open(self.log_path, 'w')
+    
+    def write(self, offset, data):
+        """
+        Write a chunk at its offset.
+        
+        Raises ValueError for a chunk outside the file.
+        """
+        if offset < 0 or offset + len(data) > self.file_size:
+            raise ValueError(f"Chunk at {offset} of {len(data)} bytes is outside the {self.file_size} byte file")
+        
+        digest = chunk_hash(data)
+        with self.lock:
+            self.file.seek(offset)
+            self.file.write(data)
+            self.received.add(offset, offset + len(data))
+            self.unlogged.append((offset, len(data), digest))
+    
+    @property
+    def bytes_received(self):
+        with self.lock:
+            return self.received.total()
+    
+    def is_complete(self):
+        with self.lock:
+            return self.received.covers(0, self.file_size)
+    
+    def missing(self):
+        """Ranges of the file not received yet."""
+        with self.lock:
+            return self.received.missing(self.file_size)
+    
+    def ranges(self):
+        """Ranges of the file received so far."""
+        with self.lock:
+            return list(self.received)
+    
+    def checkpoint(self):
+        """
+        Flush received chunks to disk, then append their hashes to the chunk log.
+        
+        The log only lists data that is already on disk, so resuming from it
+        never claims chunks a crash could have lost, and a checkpoint costs
+        the same however much of the file has arrived.
+        """
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            if self.unlogged:
+                self.log.writelines(f"{offset} {length} {digest}\n" for offset, length, digest in self.unlogged)
+                self.log.flush()
+                os.fsync(self.log.fileno())
+                self.unlogged = []
+    
+    def chunk_hashes(self):
+        """Hashes of the checkpointed chunks by offset, read back from the chunk log to resume."""
+        with self.lock:
+            return {offset: digest for offset, _, digest in read_chunk_log(self.log_path)}
+    
+    def finish(self):
+        """
+        Move the completed file into place.
+        
+        Raises ValueError if some of the file has not arrived yet.
+        """
+        with self.lock:
+            missing = self.received.missing(self.file_size)
+            if missing:
+                raise ValueError(f"File incomplete, {len(missing)} ranges missing starting at {missing[0][0]}")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            os.replace(self.part_path, self.path)
+            self.log.close()
+            os.remove(self.log_path)
+    
+    def close(self):
+        """Close the part file and chunk log, keeping them for a later resume."""
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+                self.log.close()
+    
+    def abort(self):
+        """Close and delete the part file and chunk log."""
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+                self.log.close()
+            for path in (self.part_path, self.log_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+class UploadWindow:
+    """
+    Sliding window of chunks in flight for one upload.
+    
+    The client acknowledges each chunk by offset, and every acknowledgement
+    frees a slot for the next chunk, so throughput is bounded by bandwidth
+    rather than by one chunk per round trip. Once per round trip the window
+    is resized to UPLOAD_WINDOW_GAIN times the chunks the link delivers in
+    its minimum round trip time: it doubles while round trips stay at their
+    minimum, and shrinks back once queueing delay inflates them.
+    
+    Unacknowledged chunks are sent again after a timeout worked out from the
+    round trip time and its variation as in TCP (RFC 6298), doubling while
+    resent chunks go unacknowledged. to_send has to be called when
+    next_timeout is reached even if no acknowledgement arrives, or an upload
+    whose whole window was lost stalls.
+    """
+    
+    def __init__(self, file_size, chunk_size, window=UPLOAD_INITIAL_WINDOW, max_window=UPLOAD_MAX_WINDOW,
+                 acked=None):
+        """acked holds the ranges the client already has, when resuming; they are not sent again."""
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.window = window
+        self.max_window = max_window
+        self.next_offset = 0
+        self.in_flight = {}  # offset -> time sent
+        self.acked = acked or RangeSet()
+        self.min_rtt = None
+        self.srtt = None
+        self.rttvar = None
+        self.timeout = UPLOAD_INITIAL_TIMEOUT
+        self.resent = set()  # Offsets in flight that were sent more than once
+        self.round_started = None
+    
+    def to_send(self, now):
+        """Offsets of the chunks to send now: timed out chunks, then new ones while the window has room."""
+        offsets = [offset for offset, sent_at in self.in_flight.items() if now - sent_at >= self.timeout]
+        if offsets:
+            # Back off until a chunk sent only once is acknowledged
+            self.timeout = min(UPLOAD_MAX_TIMEOUT, self.timeout * 2)
+            self.resent.update(offsets)
+        
+        while len(self.in_flight) < self.window and self.next_offset < self.file_size:
+            offset = self.next_offset
+            self.next_offset += self.chunk_size
+            if self.acked.covers(offset, min(offset + self.chunk_size, self.file_size)):
+                continue
+            self.in_flight[offset] = now
+            offsets.append(offset)
+        
+        for offset in offsets:
+            self.in_flight[offset] = now
+        if self.round_started is None and offsets:
+            self.round_started = now
+        return offsets
+    
+    def next_timeout(self):
+        """When the oldest chunk in flight times out, on the clock passed to to_send; None if none are in flight."""
+        return min(self.in_flight.values()) + self.timeout if self.in_flight else None
+    
+    def ack(self, offset, now):
+        """Record that the client has written the chunk at offset; returns False for unknown chunks."""
+        sent_at = self.in_flight.pop(offset, None)
+        if sent_at is None:
+            return False
+        self.acked.add(offset, min(offset + self.chunk_size, self.file_size))
+        
+        if offset in self.resent:
+            # The acknowledgement may be for any of the sends, so it says nothing about the round trip time
+            self.resent.discard(offset)
+        else:
+            rtt = now - sent_at
+            self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+            if self.srtt is None:
+                self.srtt, self.rttvar = rtt, rtt / 2
+            else:
+                self.rttvar = self.rttvar * 3 / 4 + abs(self.srtt - rtt) / 4
+                self.srtt = self.srtt * 7 / 8 + rtt / 8
+            self.timeout = max(UPLOAD_MIN_TIMEOUT, min(UPLOAD_MAX_TIMEOUT, self.srtt + 4 * self.rttvar))
+        
+        # A round trip has passed once a chunk sent after the last resize is acknowledged
+        if self.srtt is not None and sent_at > self.round_started:
+            scale = UPLOAD_WINDOW_GAIN * self.min_rtt / self.srtt if self.srtt > 0 else UPLOAD_WINDOW_GAIN
+            self.window = max(1, min(self.max_window, round(self.window * scale)))
+            self.round_started = now
+        return True
+    
+    @property
+    def bytes_acked(self):
+        return self.acked.total()
+    
+    def is_complete(self):
+        return self.acked.covers(0, self.file_size)
+
+class TransferManifestStore:
+    """
+    Keeps the manifest of each unfinished transfer as a JSON file.
+    
+    Manifests are replaced atomically, so a crash mid-save leaves the
+    previous checkpoint in place. Chunk hashes stay in the chunk log next to
+    the part file (see ChunkedFileWriter), so a manifest is small however
+    large the file.
+    """
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+    
+    def _path(self, transfer_id):
+        return os.path.join(self.directory, f"{transfer_id}.json")
+    
+    def save(self, transfer_id, manifest):
+        path = self._path(transfer_id)
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(manifest, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+    
+    def load_all(self):
+        """All saved manifests keyed by transfer ID."""
+        manifests = {}
+        if not os.path.isdir(self.directory):
+            return manifests
+        
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable transfer manifest {name}: {e}")
+                continue
+            manifests[manifest['transfer_id']] = manifest
+        return manifests
+    
+    def remove(self, transfer_id):
+        with self.lock:
+            try:
+                os.remove(self._path(transfer_id))
+            except OSError:
+                pass
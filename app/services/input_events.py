@@ -0,0 +1,93 @@
+"""
+Input event module for remote control of streamed desktops.
+Defines the compact binary format viewers send mouse and keyboard input in,
+which the server checks and relays to the client unchanged.
+"""
+
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Each event is this record: type, argument, x, y. Key events are followed
+# by their UTF-8 key name, whose length is the argument.
+INPUT_EVENT = struct.Struct('<BBHH')
+
+INPUT_MOVE = 1
+INPUT_BUTTON_DOWN = 2  # Argument is the button
+INPUT_BUTTON_UP = 3
+INPUT_SCROLL = 4  # Argument is the signed number of clicks, up is positive
+INPUT_KEY_DOWN = 5
+INPUT_KEY_UP = 6
+
+INPUT_EVENT_TYPES = {
+    INPUT_MOVE: 'move',
+    INPUT_BUTTON_DOWN: 'button_down',
+    INPUT_BUTTON_UP: 'button_up',
+    INPUT_SCROLL: 'scroll',
+    INPUT_KEY_DOWN: 'key_down',
+    INPUT_KEY_UP: 'key_up'
+}
+INPUT_BUTTONS = {1: 'left', 2: 'middle', 3: 'right'}
+
+# Positions are scaled to 0..INPUT_COORDINATE_MAX across the captured area,
+# so they don't depend on the tier or scale the viewer is showing
+INPUT_COORDINATE_MAX = 65535
+MAX_INPUT_BATCH_BYTES = 4096
+
+def pack_input_events(events):
+    """Pack a list of event dicts into a binary batch."""
+    type_codes = {name: code for code, name in INPUT_EVENT_TYPES.items()}
+    button_codes = {name: code for code, name in INPUT_BUTTONS.items()}
+    
+    chunks = []
+    for event in events:
+        code = type_codes[event['type']]
+        x, y = event.get('x', 0), event.get('y', 0)
+        if code in (INPUT_KEY_DOWN, INPUT_KEY_UP):
+            key = event['key'].encode('utf-8')
+            chunks.append(INPUT_EVENT.pack(code, len(key), 0, 0) + key)
+        elif code == INPUT_SCROLL:
+            chunks.append(INPUT_EVENT.pack(code, event['clicks'] & 0xFF, x, y))
+        elif code == INPUT_MOVE:
+            chunks.append(INPUT_EVENT.pack(code, 0, x, y))
+        else:
+            chunks.append(INPUT_EVENT.pack(code, button_codes[event.get('button', 'left')], x, y))
+    return b''.join(chunks)
+
+def unpack_input_events(data):
+    """
+    Unpack a binary batch into a list of event dicts.
+    
+    Raises ValueError for a malformed batch.
+    """
+    if len(data) > MAX_INPUT_BATCH_BYTES:
+        raise ValueError("Input batch too large")
+    
+    events = []
+    offset = 0
+    while offset < len(data):
+        if offset + INPUT_EVENT.size > len(data):
+            raise ValueError("Truncated input event")
+        code, argument, x, y = INPUT_EVENT.unpack_from(data, offset)
+        offset += INPUT_EVENT.size
+        
+        if code not in INPUT_EVENT_TYPES:
+            raise ValueError(f"Unknown input event type {code}")
+        event = {'type': INPUT_EVENT_TYPES[code]}
+        
+        if code in (INPUT_KEY_DOWN, INPUT_KEY_UP):
+            if offset + argument > len(data):
+                raise ValueError("Truncated key name")
+            event['key'] = data[offset:offset + argument].decode('utf-8')
+            offset += argument
+        else:
+            event['x'], event['y'] = x, y
+            if code == INPUT_SCROLL:
+                event['clicks'] = argument - 256 if argument > 127 else argument
+            elif code != INPUT_MOVE:
+                if argument not in INPUT_BUTTONS:
+                    raise ValueError(f"Unknown mouse button {argument}")
+                event['button'] = INPUT_BUTTONS[argument]
+        events.append(event)
+    return events
@@ -9,22 +9,64 @@ import base64
 import json
 import time
 import uuid
+import zlib
 import logging
 import threading
+from collections import OrderedDict
 from datetime import datetime
-from flask import request
-from flask_socketio import emit, join_room, leave_room
+from flask import request, has_request_context
+from flask_socketio import emit, join_room, leave_room, close_room
+from flask_login import current_user
 from app import socketio, db
+from app.services.stream_cache import StreamFrameCache
+from app.services.input_events import unpack_input_events
+from app.services.file_transfer import (ChunkedFileWriter, UploadWindow, TransferManifestStore,
+                                       TRANSFER_CHECKPOINT_INTERVAL, stale_chunks, chunk_ranges)
+from app.services.delta_sync import delta_block_size, compute_delta, delta_size, delta_messages, file_checksum
+from app.services.stream_codecs import STREAM_CODECS, DEFAULT_STREAM_CODEC, choose_stream_codec, choose_color_mode
+from app.services.stream_control import AdaptiveStreamController
+from app.services.stream_recorder import StreamRecorder
+from app.services.stream_telemetry import StreamTelemetry
+from app.services.thumbnail_cache import ThumbnailCache
 
 logger = logging.getLogger(__name__)
 
+# Screen stream flow control
+STREAM_CREDIT_WINDOW = 2  # Frames the client may have in flight to the server
+STREAM_VIEWER_WINDOW = 2  # Unacknowledged frames allowed per viewer
+STREAM_ACK_TIMEOUT = 5  # Seconds before an unacknowledged frame is written off
+STREAM_RECORDINGS_DIR = os.environ.get('STREAM_RECORDINGS_DIR', 'recordings')
+STREAM_CURSOR_SHAPES = 32  # Cursor shape images kept per session for viewers joining later
+TRANSFER_STATE_DIR = os.environ.get('TRANSFER_STATE_DIR', 'transfers')  # Manifests of unfinished file transfers
+
+# Fleet overview thumbnails
+THUMBNAIL_INTERVAL = 30  # Seconds between snapshots from each client
+THUMBNAIL_INTERVAL_RANGE = (5, 3600)  # Allowed intervals; shorter ones would have every client capturing all the time
+THUMBNAIL_MAX_WIDTH = 320
+THUMBNAIL_WIDTH_RANGE = (64, 1280)  # Allowed max_width
+THUMBNAIL_QUALITY = 50
+
+# Resolution tiers, largest first; max_width None means the captured size
+STREAM_DEFAULT_TIERS = [{'name': 'full', 'max_width': None}]
+STREAM_SIMULCAST_TIERS = [
+    {'name': 'full', 'max_width': None},
+    {'name': 'medium', 'max_width': 1280},
+    {'name': 'low', 'max_width': 640}
+]
+
 class RemoteManagementService:
     """Service for managing remote client connections and capabilities."""
     
     def __init__(self):
         self.active_clients = {}  # Dictionary of active client connections
         self.streaming_sessions = {}  # Active desktop streaming sessions
-        self.file_transfer_sessions = {}  # Active file transfer sessions
+        self.frame_cache = StreamFrameCache()  # Latest keyframe and deltas per stream
+        self.recorder = StreamRecorder(STREAM_RECORDINGS_DIR)  # Session recordings for audit
+        self.thumbnails = ThumbnailCache()  # Latest desktop snapshot per client
+        self.thumbnail_settings = None  # Snapshot settings while thumbnail mode is on
+        self.transfer_manifests = TransferManifestStore(TRANSFER_STATE_DIR)
+        self.file_transfer_sessions = self._load_interrupted_transfers()  # Active file transfer sessions
+        self.upload_lock = threading.Lock()  # Upload windows are driven by acknowledgements and retransmit timers
         self.command_responses = {}  # Store command responses from clients
         
         # Register socket event handlers
@@ -36,17 +78,34 @@ class RemoteManagementService:
         socketio.on_event('client_register', self.handle_client_register)
         socketio.on_event('client_heartbeat', self.handle_client_heartbeat)
         socketio.on_event('client_disconnect', self.handle_client_disconnect)
+        socketio.on_event('disconnect', self.handle_socket_disconnect)
         
         # Desktop streaming
         socketio.on_event('screen_frame', self.handle_screen_frame)
+        socketio.on_event('screen_frame_ack', self.handle_screen_frame_ack)
+        socketio.on_event('join_stream', self.handle_join_stream)
+        socketio.on_event('leave_stream', self.handle_leave_stream)
+        socketio.on_event('select_stream_tier', self.handle_select_stream_tier)
+        socketio.on_event('set_stream_region', self.handle_set_stream_region)
         socketio.on_event('stream_started', self.handle_stream_started)
         socketio.on_event('stream_stopped', self.handle_stream_stopped)
+        socketio.on_event('stream_stats', self.handle_stream_stats)
+        socketio.on_event('screen_keepalive', self.handle_screen_keepalive)
+        socketio.on_event('screen_thumbnail', self.handle_screen_thumbnail)
+        socketio.on_event('input_events', self.handle_input_events)
+        socketio.on_event('cursor_update', self.handle_cursor_update)
         
         # File management
         socketio.on_event('file_list', self.handle_file_list)
+        socketio.on_event('file_upload_ack', self.handle_file_upload_ack)
         socketio.on_event('file_upload_chunk', self.handle_file_upload_chunk)
-        socketio.on_event('file_download_request', self.handle_file_download_request())
+        socketio.on_event('file_upload_chunk_ack', self.handle_file_upload_chunk_ack)
+        socketio.on_event('file_upload_error', self.handle_file_upload_error)
+        socketio.on_event('file_delta_signatures', self.handle_file_delta_signatures)
+        socketio.on_event('file_delta_ack', self.handle_file_delta_ack)
+        socketio.on_event('file_delta_error', self.handle_file_delta_error)
         socketio.on_event('file_download_chunk', self.handle_file_download_chunk)
+        socketio.on_event('file_download_error', self.handle_file_download_error)
         socketio.on_event('file_operation_result', self.handle_file_operation_result)
         
         # Command execution
@@ -76,6 +135,10 @@ class RemoteManagementService:
                 'connected_at': datetime.now(),
                 'last_heartbeat': datetime.now(),
                 'capabilities': data.get('capabilities', []),
+                'codecs': data.get('codecs', {}),  # Codec name -> encode cost per megapixel
+                'capture_backend': data.get('capture_backend'),
+                'monitors': data.get('monitors', []),
+                'color_modes': data.get('color_modes', []),
                 'status': 'online'
             }
             
@@ -102,6 +165,13 @@ class RemoteManagementService:
                 'capabilities': data.get('capabilities', [])
             }, room='admin_room')
             
+            # Clients joining while thumbnail mode is on start snapshotting straight away
+            if self.thumbnail_settings and 'screen_capture' in self.active_clients[client_id]['capabilities']:
+                self._request_thumbnails(client_id)
+            
+            # Pick up transfers a dropped connection or restart interrupted
+            self._resume_transfers(client_id)
+        
         except Exception as e:
             logger.error(f"Error registering client: {e}")
             emit('registration_ack', {
@@ -128,9 +198,8 @@ class RemoteManagementService:
             if client_id in self.streaming_sessions:
                 self.stop_streaming(client_id)
             
-            # Clean up any file transfers
-            if client_id in self.file_transfer_sessions:
-                del self.file_transfer_sessions[client_id]
+            # Checkpoint file transfers; they resume when the client registers again
+            self._interrupt_transfers(client_id)
             
             # Update client status
             self.active_clients[client_id]['status'] = 'offline'
@@ -146,13 +215,42 @@ class RemoteManagementService:
             def remove_client():
                 if client_id in self.active_clients:
                     del self.active_clients[client_id]
+                    self.thumbnails.remove(client_id)
             
             threading.Timer(300, remove_client).start()  # Remove after 5 minutes
     
+    def handle_socket_disconnect(self, *args):
+        """
+        Handle a socket closing. Agents rarely get to send client_disconnect
+        before their connection drops, so a client whose socket closes is
+        disconnected the same way.
+        """
+        for client_id, client in list(self.active_clients.items()):
+            if client['socket_id'] == request.sid and client['status'] == 'online':
+                self.handle_client_disconnect({'client_id': client_id})
+    
     # === Desktop Streaming Methods ===
     
-    def start_streaming(self, client_id, quality=75, fps=10):
-        """Request a client to start streaming its desktop."""
+    def start_streaming(self, client_id, quality=75, fps=10, mode='delta', adaptive=True, bounds=None,
+                        simulcast=False, codec=None, workload=None, monitor=None, region=None,
+                        record=False, color_mode=None):
+        """
+        Request a client to start streaming its desktop.
+        
+        In 'delta' mode the client sends periodic keyframes and otherwise only
+        the tiles that changed; 'full' mode sends every frame as a keyframe.
+        With adaptive=True quality, fps and scale are retuned during the
+        session within bounds (see DEFAULT_STREAM_BOUNDS). With simulcast=True
+        the client also sends downscaled tiers (see STREAM_SIMULCAST_TIERS)
+        and each viewer receives the tier that fits its viewport. The frame
+        codec is either given, or chosen from the codecs the client advertised
+        as the cheapest for workload ('text', 'video' or 'auto'). Only the
+        given monitor index or [left, top, right, bottom] region is captured;
+        by default the whole desktop is. With record=True the session is
+        recorded to disk (see start_recording). color_mode reduces colour
+        depth for slow links ('grayscale', 'rgb565' or 'palette', see
+        STREAM_COLOR_MODES); it may restrict the codec.
+        """
         if client_id not in self.active_clients:
             return False, "Client not found"
         
@@ -163,6 +261,35 @@ class RemoteManagementService:
         if client_id in self.streaming_sessions:
             return False, "Streaming already active for this client"
         
+        # Frames travel as binary attachments unless the client can only send base64
+        if 'binary_frames' in self.active_clients[client_id]['capabilities']:
+            transport = 'binary'
+        else:
+            transport = 'base64'
+        
+        # The colour mode may pin the codec before one is chosen by workload
+        color_mode, codec, error = choose_color_mode(self.active_clients[client_id].get('color_modes'),
+                                                     color_mode, codec)
+        if error:
+            return False, error
+        
+        codec, error = choose_stream_codec(self.active_clients[client_id].get('codecs'), codec, workload)
+        if error:
+            return False, error
+        
+        capture_area, error = self._parse_capture_area(client_id, monitor, region)
+        if error:
+            return False, error
+        
+        # The controller starts from the requested settings, clamped to its bounds
+        controller = None
+        scale = 1.0
+        if adaptive:
+            controller = AdaptiveStreamController(quality, fps, scale, bounds)
+            quality, fps, scale = controller.quality, controller.fps, controller.scale
+        
+        tiers = STREAM_SIMULCAST_TIERS if simulcast else STREAM_DEFAULT_TIERS
+        
         # Create streaming session
         session_id = str(uuid.uuid4())
         self.streaming_sessions[client_id] = {
@@ -170,20 +297,172 @@ class RemoteManagementService:
             'started_at': datetime.now(),
             'quality': quality,
             'fps': fps,
+            'scale': scale,
+            'controller': controller,
+            'mode': mode,
+            'codec': codec,
+            'color_mode': color_mode,
+            'transport': transport,
+            'tiers': tiers,
+            'capture_area': capture_area,  # {'monitor', 'region'}; both None for the whole desktop
+            'recording': None,  # Tier being recorded
             'frames_received': 0,
-            'viewers': set()
+            'frames_dropped': 0,
+            'frames_unchanged': 0,  # Captures the client skipped as identical
+            'idle': False,  # Client is polling an unchanged screen at its idle rate
+            'last_keepalive': None,
+            'viewers': set(),
+            'base64_viewers': set(),  # Viewers that cannot receive binary frames
+            'viewer_state': {},  # Per-viewer unacknowledged frames
+            'client_credit': STREAM_CREDIT_WINDOW,  # Credit granted but not yet used
+            'keyframe_pending': set(),  # Tiers a keyframe was requested for
+            'pipeline_stats': {},  # Latest per-stage timings reported by the client
+            'telemetry': StreamTelemetry(),  # Per-stage latency from capture to render
+            'input_seq': 0,  # Input batches relayed to the client
+            'cursor': None,  # Latest pointer position and shape hash
+            'cursor_shapes': OrderedDict()  # Shape hash -> image, hotspot and size
         }
         
-        # Request client to start streaming
+        # Request client to start streaming; it only captures while it has credit
         socketio.emit('start_streaming', {
             'session_id': session_id,
             'quality': quality,
-            'fps': fps
+            'fps': fps,
+            'scale': scale,
+            'mode': mode,
+            'codec': codec,
+            'color_mode': color_mode,
+            'transport': transport,
+            'tiers': tiers,
+            'monitor': capture_area['monitor'],
+            'region': capture_area['region'],
+            'credit_window': STREAM_CREDIT_WINDOW
         }, room=client_id)
         
+        if record:
+            self.start_recording(client_id)
+        
         logger.info(f"Requested screen streaming from {client_id} with session {session_id}")
         return True, session_id
     
+    def start_recording(self, client_id):
+        """
+        Start recording a client's stream to disk.
+        
+        The largest tier is recorded, starting from the cached keyframe when
+        there is one and otherwise from a freshly requested keyframe. Frames
+        are written by a background thread, so relaying never waits on disk.
+        """
+        if client_id not in self.streaming_sessions:
+            return False, "No active streaming session"
+        
+        session = self.streaming_sessions[client_id]
+        if session['recording']:
+            return False, "Stream is already being recorded"
+        
+        tier = session['tiers'][0]['name']
+        session['recording'] = tier
+        self.recorder.start(session['session_id'], {
+            'client_id': client_id,
+            'hostname': self.active_clients[client_id].get('hostname'),
+            'tier': tier,
+            'codec': session['codec'],
+            'mode': session['mode'],
+            'capture_area': session['capture_area']
+        })
+        
+        cached_frames = self.frame_cache.get_frames(session['session_id'], tier)
+        for frame in cached_frames:
+            self.recorder.write(session['session_id'], frame)
+        if not cached_frames:
+            self._request_keyframe(client_id, tier)
+        
+        logger.info(f"Recording stream {session['session_id']} of {client_id}")
+        return True, session['session_id']
+    
+    def stop_recording(self, client_id):
+        """Stop recording a client's stream."""
+        if client_id not in self.streaming_sessions:
+            return False, "No active streaming session"
+        
+        session = self.streaming_sessions[client_id]
+        if not session['recording']:
+            return False, "Stream is not being recorded"
+        
+        session['recording'] = None
+        self.recorder.stop(session['session_id'])
+        return True, "Recording stopped"
+    
+    def list_recordings(self):
+        """Get the manifests of all stored stream recordings."""
+        return self.recorder.list_recordings()
+    
+    def get_recording_frames(self, session_id, start=0, duration=10):
+        """
+        Get recorded frames for playback, with base64 image data.
+        
+        Returns None if there is no such recording.
+        """
+        try:
+            session_id = str(uuid.UUID(session_id))
+        except ValueError:
+            return None
+        
+        frames = self.recorder.read_frames(session_id, start, duration)
+        if frames is None:
+            return None
+        return [self._frame_to_base64(frame) for frame in frames]
+    
+    def set_stream_region(self, client_id, monitor=None, region=None):
+        """
+        Move the captured area of a running stream to another monitor or region.
+        
+        The session, its viewers and their tiers are kept; the client sends a
+        keyframe by itself when the captured size changes.
+        """
+        if client_id not in self.streaming_sessions:
+            return False, "No active streaming session"
+        
+        capture_area, error = self._parse_capture_area(client_id, monitor, region)
+        if error:
+            return False, error
+        
+        session = self.streaming_sessions[client_id]
+        session['capture_area'] = capture_area
+        
+        socketio.emit('stream_region', {
+            'session_id': session['session_id'],
+            'monitor': capture_area['monitor'],
+            'region': capture_area['region']
+        }, room=client_id)
+        
+        self._emit_to_stream_viewers(session, 'stream_region_changed', {
+            'client_id': client_id,
+            'session_id': session['session_id'],
+            'monitor': capture_area['monitor'],
+            'region': capture_area['region']
+        })
+        return True, "Stream region changed"
+    
+    def _parse_capture_area(self, client_id, monitor=None, region=None):
+        """Validate a requested monitor index or region; returns (capture area, error)."""
+        if region is not None:
+            try:
+                left, top, right, bottom = (int(value) for value in region)
+            except (TypeError, ValueError):
+                return None, "Region must be [left, top, right, bottom]"
+            if right <= left or bottom <= top:
+                return None, "Region is empty"
+            return {'monitor': None, 'region': [left, top, right, bottom]}, None
+        
+        if monitor is not None:
+            # Clients that predate monitor reporting resolve the index themselves
+            monitors = self.active_clients[client_id].get('monitors') or []
+            if not isinstance(monitor, int) or monitor < 0 or (monitors and monitor >= len(monitors)):
+                return None, f"Unknown monitor {monitor}"
+        
+        return {'monitor': monitor, 'region': None}, None
+    
     def stop_streaming(self, client_id):
         """Request a client to stop streaming its desktop."""
         if client_id not in self.active_clients:
@@ -200,26 +479,103 @@ class RemoteManagementService:
         }, room=client_id)
         
         # Clean up streaming session
-        del self.streaming_sessions[client_id]
+        self._end_stream_session(client_id, 'Streaming stopped by server')
         
         logger.info(f"Stopped screen streaming from {client_id}")
         return True, "Streaming stopped"
     
-    def add_stream_viewer(self, client_id, user_id):
-        """Add a user as a viewer of a client's stream."""
+    def add_stream_viewer(self, client_id, user_id, binary=True, sid=None, tier=None, viewport_width=None):
+        """
+        Add a user as a viewer of a client's stream.
+        
+        The viewer's socket joins the stream's room, so each frame is emitted
+        to all viewers at once. sid defaults to the socket of the current
+        Socket.IO event. Viewers that cannot handle binary attachments pass
+        binary=False and receive frame data as base64 strings instead. On
+        simulcast streams the viewer gets the named tier, or else the smallest
+        tier at least as wide as viewport_width.
+        """
         if client_id not in self.streaming_sessions:
             return False, "No active streaming session"
         
-        self.streaming_sessions[client_id]['viewers'].add(user_id)
+        if sid is None and has_request_context():
+            sid = getattr(request, 'sid', None)
+        if sid is None:
+            return False, "Viewer has no socket connection"
+        
+        session = self.streaming_sessions[client_id]
+        
+        # A returning viewer may have switched socket, transport or tier
+        previous = session['viewer_state'].get(user_id)
+        if previous:
+            self._leave_stream_rooms(session, previous['sid'], previous['tier'])
+        
+        session['viewers'].add(user_id)
+        if binary:
+            session['base64_viewers'].discard(user_id)
+        else:
+            session['base64_viewers'].add(user_id)
+        
+        viewer = {
+            'sid': sid,
+            'tier': self._choose_stream_tier(session, tier, viewport_width),
+            'outstanding': {},  # seq -> time sent
+            'needs_keyframe': False
+        }
+        session['viewer_state'][user_id] = viewer
+        self._subscribe_viewer(client_id, user_id)
+        
+        # Let the viewer know what it is about to receive
+        socketio.emit('stream_settings_changed', {
+            'client_id': client_id,
+            'session_id': session['session_id'],
+            'quality': session['quality'],
+            'fps': session['fps'],
+            'scale': session['scale'],
+            'codec': session['codec'],
+            'mime_type': STREAM_CODECS[session['codec']]['mime_type'],
+            'color_mode': session['color_mode'],
+            'monitor': session['capture_area']['monitor'],
+            'region': session['capture_area']['region'],
+            'tier': viewer['tier'],
+            'tiers': [tier['name'] for tier in session['tiers']]
+        }, room=sid)
+        
+        self._replenish_stream_credit(client_id)
         return True, "Viewer added"
     
+    def set_viewer_tier(self, client_id, user_id, tier=None, viewport_width=None):
+        """Move a viewer to another resolution tier mid-stream."""
+        if client_id not in self.streaming_sessions:
+            return False, "No active streaming session"
+        
+        session = self.streaming_sessions[client_id]
+        viewer = session['viewer_state'].get(user_id)
+        if viewer is None:
+            return False, "Not a viewer of this stream"
+        
+        new_tier = self._choose_stream_tier(session, tier, viewport_width)
+        if new_tier != viewer['tier']:
+            self._leave_stream_rooms(session, viewer['sid'], viewer['tier'])
+            viewer['tier'] = new_tier
+            viewer['outstanding'].clear()
+            self._subscribe_viewer(client_id, user_id)
+        
+        return True, new_tier
+    
     def remove_stream_viewer(self, client_id, user_id):
         """Remove a user as a viewer of a client's stream."""
         if client_id not in self.streaming_sessions:
             return False, "No active streaming session"
         
-        if user_id in self.streaming_sessions[client_id]['viewers']:
-            self.streaming_sessions[client_id]['viewers'].remove(user_id)
+        session = self.streaming_sessions[client_id]
+        if user_id in session['viewers']:
+            session['viewers'].remove(user_id)
+        session['base64_viewers'].discard(user_id)
+        
+        viewer = session['viewer_state'].pop(user_id, None)
+        if viewer:
+            self._leave_stream_rooms(session, viewer['sid'], viewer['tier'])
         
         # If no more viewers, stop the stream
         if not self.streaming_sessions[client_id]['viewers']:
@@ -227,11 +583,163 @@ class RemoteManagementService:
         
         return True, "Viewer removed"
     
+    def handle_join_stream(self, data):
+        """Handle a viewer's socket asking to watch a client's stream; only admins may."""
+        user_id = self._socket_admin_id()
+        if user_id is None:
+            success, message = False, "Not authorized"
+        else:
+            success, message = self.add_stream_viewer(data.get('client_id'), user_id,
+                                                      binary=data.get('binary', True),
+                                                      tier=data.get('tier'),
+                                                      viewport_width=data.get('viewport_width'))
+        emit('join_stream_result', {
+            'client_id': data.get('client_id'),
+            'success': success,
+            'message': message
+        })
+    
+    def handle_leave_stream(self, data):
+        """Handle a viewer's socket no longer watching a client's stream."""
+        user_id = self._socket_admin_id()
+        if user_id is not None:
+            self.remove_stream_viewer(data.get('client_id'), user_id)
+    
+    def _socket_admin_id(self):
+        """
+        The ID of the admin user logged in on the socket sending the current
+        event, or None.
+        
+        Viewers are always identified this way, never by a user ID in the
+        event's payload.
+        """
+        if not (current_user.is_authenticated and current_user.is_admin):
+            return None
+        return current_user.id
+    
+    def _socket_viewer(self, session):
+        """The viewer state of the admin on the current socket, or None unless it watches from this socket."""
+        user_id = self._socket_admin_id()
+        viewer = session['viewer_state'].get(user_id) if user_id is not None else None
+        if viewer is None or viewer['sid'] != request.sid:
+            return None
+        return viewer
+    
+    def handle_select_stream_tier(self, data):
+        """Handle a viewer asking for another tier, e.g. after its viewport was resized."""
+        session = self.streaming_sessions.get(data.get('client_id'))
+        if session is None or self._socket_viewer(session) is None:
+            success, result = False, "Not a viewer of this stream"
+        else:
+            success, result = self.set_viewer_tier(data.get('client_id'), self._socket_admin_id(),
+                                                   tier=data.get('tier'),
+                                                   viewport_width=data.get('viewport_width'))
+        emit('stream_tier_selected', {
+            'client_id': data.get('client_id'),
+            'success': success,
+            'tier': result if success else None,
+            'message': None if success else result
+        })
+    
+    def handle_set_stream_region(self, data):
+        """Handle a viewer asking to watch another monitor or region of the stream."""
+        client_id = data.get('client_id')
+        session = self.streaming_sessions.get(client_id)
+        
+        if session is None or self._socket_viewer(session) is None:
+            success, message = False, "Not a viewer of this stream"
+        else:
+            success, message = self.set_stream_region(client_id, data.get('monitor'), data.get('region'))
+        
+        emit('stream_region_result', {
+            'client_id': client_id,
+            'success': success,
+            'message': message
+        })
+    
+    def _choose_stream_tier(self, session, tier=None, viewport_width=None):
+        """Pick a viewer's tier by name, or the smallest one that fills its viewport."""
+        names = [candidate['name'] for candidate in session['tiers']]
+        if tier in names:
+            return tier
+        
+        chosen = session['tiers'][0]
+        if viewport_width:
+            for candidate in session['tiers']:
+                if candidate['max_width'] is None or candidate['max_width'] >= viewport_width:
+                    chosen = candidate
+        return chosen['name']
+    
+    def _subscribe_viewer(self, client_id, user_id):
+        """Join a viewer to its tier's room and bring it up to the current screen."""
+        session = self.streaming_sessions[client_id]
+        viewer = session['viewer_state'][user_id]
+        binary = user_id not in session['base64_viewers']
+        join_room(self._stream_room(session, viewer['tier'], base64_frames=not binary),
+                  sid=viewer['sid'], namespace='/')
+        
+        # Replay the cached keyframe and deltas so the viewer shows the current
+        # screen at once; without them a delta stream needs a new keyframe
+        cached_frames = self.frame_cache.get_frames(session['session_id'], viewer['tier'])
+        for frame in cached_frames:
+            if not binary and frame['encoding'] == 'binary':
+                frame = self._frame_to_base64(frame)
+            socketio.emit('screen_frame', frame, room=viewer['sid'])
+        
+        if cached_frames:
+            viewer['needs_keyframe'] = False
+            viewer['outstanding'][cached_frames[-1]['seq']] = time.monotonic()
+        elif session['mode'] == 'delta':
+            viewer['needs_keyframe'] = True
+            self._request_keyframe(client_id, viewer['tier'])
+        
+        # The pointer is drawn by the viewer, so it needs the current one too
+        if session['cursor']:
+            message = self._cursor_message(client_id, session, session['cursor'], base64_image=not binary)
+            socketio.emit('cursor_update', message, room=viewer['sid'])
+    
+    def _stream_room(self, session, tier, base64_frames=False):
+        """Room that the viewers of one tier of a streaming session join."""
+        if base64_frames:
+            return f"stream_{session['session_id']}_{tier}_base64"
+        return f"stream_{session['session_id']}_{tier}"
+    
+    def _stream_rooms(self, session):
+        """All viewer rooms of a streaming session."""
+        return [self._stream_room(session, tier['name'], base64_frames)
+                for tier in session['tiers'] for base64_frames in (False, True)]
+    
+    def _leave_stream_rooms(self, session, sid, tier):
+        leave_room(self._stream_room(session, tier), sid=sid, namespace='/')
+        leave_room(self._stream_room(session, tier, base64_frames=True), sid=sid, namespace='/')
+    
+    def _end_stream_session(self, client_id, reason):
+        """Tell viewers a stream has ended and tear down its session."""
+        session = self.streaming_sessions.pop(client_id)
+        self.frame_cache.evict(session['session_id'])
+        if session['recording']:
+            self.recorder.stop(session['session_id'])
+        
+        for room in self._stream_rooms(session):
+            socketio.emit('stream_stopped', {
+                'client_id': client_id,
+                'session_id': session['session_id'],
+                'reason': reason
+            }, room=room)
+            close_room(room, namespace='/')
+    
     def handle_screen_frame(self, data):
-        """Handle incoming screen frame from client."""
+        """
+        Handle incoming screen frame from client.
+        
+        Simulcast clients send one message per capture with a frame for each
+        tier that changed under 'tiers'; other clients send a single frame.
+        The client stamps each capture with captured_at and sent_at (its
+        wall clock), capture_ms and encode_ms for the session's telemetry.
+        """
+        received_at = time.time()
         client_id = data.get('client_id')
         session_id = data.get('session_id')
-        frame_data = data.get('frame')
         
         if client_id not in self.streaming_sessions:
             # Streaming was stopped on server side
@@ -242,16 +750,358 @@ class RemoteManagementService:
             # Session ID mismatch
             return
         
-        # Update frame counter
-        self.streaming_sessions[client_id]['frames_received'] += 1
+        session = self.streaming_sessions[client_id]
         
-        # Forward frame to all viewers
-        for user_id in self.streaming_sessions[client_id]['viewers']:
-            socketio.emit('screen_frame', {
-                'client_id': client_id,
-                'frame': frame_data,
-                'timestamp': datetime.now().isoformat()
-            }, room=f"user_{user_id}")
+        # Update frame counter; every capture received uses up one credit
+        session['frames_received'] += 1
+        session['client_credit'] = max(0, session['client_credit'] - 1)
+        session['idle'] = False
+        
+        tier_frames = data.get('tiers') or [data]
+        timestamp = datetime.now().isoformat()
+        
+        total_size = 0
+        for tier_frame in tier_frames:
+            total_size += self._relay_tier_frame(client_id, session, tier_frame, data.get('seq'), timestamp,
+                                                 data.get('captured_at'))
+        
+        session['telemetry'].record_frame(
+            data.get('seq'), total_size,
+            captured_at=data.get('captured_at'),
+            sent_at=data.get('sent_at'),
+            received_at=received_at,
+            capture_ms=data.get('capture_ms'),
+            encode_ms=data.get('encode_ms'),
+            relay_ms=(time.time() - received_at) * 1000,
+            input_seq=data.get('input_seq')
+        )
+        if session['controller']:
+            session['controller'].record_frame(data.get('seq'), total_size, data.get('encode_ms'))
+        
+        self._replenish_stream_credit(client_id)
+        self._adapt_stream(client_id)
+    
+    def _relay_tier_frame(self, client_id, session, data, seq, timestamp, captured_at=None):
+        """Cache one tier's frame and send it to that tier's viewers; returns its size."""
+        tier = data.get('tier') or session['tiers'][0]['name']
+        
+        # Keyframes carry 'frame', or 'tiles' covering the whole screen when
+        # the client encoded them in parallel bands; delta frames carry
+        # 'tiles' with their coordinates, painted over the last frame drawn
+        payload = {
+            'client_id': client_id,
+            'seq': seq,
+            'tier': tier,
+            'type': data.get('type', 'key'),
+            'codec': data.get('codec', DEFAULT_STREAM_CODEC),
+            'region': data.get('region'),  # Desktop coordinates of a captured region
+            'width': data.get('width'),
+            'height': data.get('height'),
+            'timestamp': timestamp,
+            'captured_at': captured_at  # Client wall clock, seconds since the epoch
+        }
+        if 'tiles' in data or payload['type'] == 'delta':
+            payload['tiles'] = data.get('tiles', [])
+        else:
+            payload['frame'] = data.get('frame')
+        if payload['type'] == 'key':
+            session['keyframe_pending'].discard(tier)
+        payload['encoding'] = 'binary' if self._frame_is_binary(payload) else 'base64'
+        
+        # If the cache overflows it stays empty until the next keyframe, which
+        # is only requested once a viewer actually joins
+        frame_size = self._frame_size(payload)
+        self.frame_cache.add_frame(session['session_id'], payload, frame_size, tier)
+        
+        # The recorder only queues the frame; after a drop it needs a keyframe
+        if session['recording'] == tier and not self.recorder.write(session['session_id'], payload):
+            self._request_keyframe(client_id, tier)
+        
+        now = time.monotonic()
+        controller = session['controller']
+        skipped_sids = []
+        binary_viewers = base64_viewers = False
+        needs_keyframe = False
+        
+        # Work out which of the tier's viewers have room for the frame
+        for user_id in session['viewers']:
+            viewer = session['viewer_state'][user_id]
+            if viewer['tier'] != tier:
+                continue
+            self._expire_unacked_frames(viewer, now)
+            
+            if not self._viewer_can_take_frame(session, viewer, payload['type']):
+                # Drop rather than queue so a slow viewer's latency stays bounded
+                session['frames_dropped'] += 1
+                session['telemetry'].record_drop()
+                if controller and len(viewer['outstanding']) >= STREAM_VIEWER_WINDOW:
+                    controller.record_drop()
+                if session['mode'] == 'delta':
+                    viewer['needs_keyframe'] = True
+                    needs_keyframe = True
+                skipped_sids.append(viewer['sid'])
+                continue
+            
+            if payload['type'] == 'key':
+                viewer['needs_keyframe'] = False
+            viewer['outstanding'][seq] = now
+            if user_id in session['base64_viewers']:
+                base64_viewers = True
+            else:
+                binary_viewers = True
+        
+        # One emit per room: the packet is serialized once and the same bytes
+        # go to every viewer that isn't being skipped
+        if binary_viewers:
+            socketio.emit('screen_frame', payload, room=self._stream_room(session, tier),
+                          skip_sid=skipped_sids)
+        
+        # Binary frames are relayed as-is; a base64 copy is only built once
+        # per frame, and only if some viewer negotiated the fallback
+        if base64_viewers:
+            base64_payload = payload
+            if payload['encoding'] == 'binary':
+                base64_payload = self._frame_to_base64(payload)
+            socketio.emit('screen_frame', base64_payload, room=self._stream_room(session, tier, base64_frames=True),
+                          skip_sid=skipped_sids)
+        
+        # Viewers that skipped a delta can only resume from a keyframe
+        if needs_keyframe:
+            self._request_keyframe(client_id, tier)
+        
+        return frame_size
+    
+    def handle_screen_frame_ack(self, data):
+        """
+        Handle a viewer acknowledging that it has drawn a frame.
+        
+        Viewers may report how long the frame took them to decode and render
+        as decode_ms and render_ms, completing its end-to-end latency.
+        """
+        client_id = data.get('client_id')
+        seq = data.get('seq')
+        
+        if client_id not in self.streaming_sessions or seq is None:
+            return
+        
+        # Only the viewer's own socket may acknowledge its frames
+        session = self.streaming_sessions[client_id]
+        viewer = self._socket_viewer(session)
+        if viewer is None:
+            return
+        
+        # Round trip from relaying the frame to the viewer having drawn it
+        sent_at = viewer['outstanding'].get(seq)
+        if sent_at is not None:
+            round_trip = time.monotonic() - sent_at
+            session['telemetry'].record_ack(seq, round_trip, data.get('decode_ms'), data.get('render_ms'))
+            if session['controller']:
+                session['controller'].record_ack(seq, round_trip)
+        
+        # Acks are cumulative, frames are drawn in order
+        for acked_seq in [s for s in viewer['outstanding'] if s <= seq]:
+            del viewer['outstanding'][acked_seq]
+        
+        self._replenish_stream_credit(client_id)
+        self._adapt_stream(client_id)
+    
+    def handle_input_events(self, data):
+        """
+        Handle a batch of mouse and keyboard input from a viewer.
+        
+        Viewers send input as compact binary batches (see
+        app.services.input_events), coalescing pointer moves to the latest
+        position per animation frame. Batches are checked and relayed to the
+        client unchanged, straight away, numbered per session so the first
+        frame showing them gives the input-to-frame latency.
+        """
+        client_id = data.get('client_id')
+        session = self.streaming_sessions.get(client_id)
+        if session is None:
+            return
+        
+        # Only a logged-in admin viewing the stream, from its own socket, may control the desktop
+        if self._socket_viewer(session) is None:
+            return
+        if 'remote_input' not in self.active_clients[client_id]['capabilities']:
+            return
+        
+        events = data.get('events') or b''
+        try:
+            if isinstance(events, str):
+                events = base64.b64decode(events)
+            unpack_input_events(events)
+        except ValueError as e:
+            logger.warning(f"Dropped malformed input batch for {client_id}: {e}")
+            return
+        
+        session['input_seq'] += 1
+        socketio.emit('input_events', {
+            'session_id': session['session_id'],
+            'seq': session['input_seq'],
+            'events': events
+        }, room=client_id)
+        session['telemetry'].record_input(session['input_seq'])
+    
+    def handle_cursor_update(self, data):
+        """
+        Handle a pointer update from a streaming client.
+        
+        The pointer isn't part of the frames; clients send its position,
+        scaled to 0..65535 across the captured area like remote input, and
+        the hash of its shape whenever it moves or changes, and viewers draw
+        it over the stream. A shape's image is only sent the first time it is
+        seen, so viewers and the server cache shapes by hash.
+        """
+        client_id = data.get('client_id')
+        session = self.streaming_sessions.get(client_id)
+        if session is None or session['session_id'] != data.get('session_id'):
+            return
+        
+        shape = data.get('shape')
+        if shape and data.get('image'):
+            image = data['image']
+            if isinstance(image, str):
+                image = base64.b64decode(image)
+            session['cursor_shapes'][shape] = {
+                'image': image,
+                'hotspot': data.get('hotspot'),
+                'width': data.get('width'),
+                'height': data.get('height')
+            }
+            while len(session['cursor_shapes']) > STREAM_CURSOR_SHAPES:
+                session['cursor_shapes'].popitem(last=False)
+        
+        cursor = {
+            'x': data.get('x'),
+            'y': data.get('y'),
+            'visible': bool(data.get('visible', True)),
+            'shape': shape
+        }
+        session['cursor'] = cursor
+        
+        if shape and data.get('image'):
+            # A new shape's image goes out in each viewer's transport
+            binary_message = self._cursor_message(client_id, session, cursor)
+            base64_message = self._cursor_message(client_id, session, cursor, base64_image=True)
+            for tier in session['tiers']:
+                socketio.emit('cursor_update', binary_message, room=self._stream_room(session, tier['name']))
+                socketio.emit('cursor_update', base64_message,
+                              room=self._stream_room(session, tier['name'], base64_frames=True))
+        else:
+            self._emit_to_stream_viewers(session, 'cursor_update',
+                                         dict(cursor, client_id=client_id, session_id=session['session_id']))
+    
+    def _cursor_message(self, client_id, session, cursor, base64_image=False):
+        """Build a cursor update for viewers, with its shape's image when the server has it."""
+        message = dict(cursor, client_id=client_id, session_id=session['session_id'])
+        shape = session['cursor_shapes'].get(cursor['shape'])
+        if shape is not None:
+            message.update({
+                'image': base64.b64encode(shape['image']).decode('utf-8') if base64_image else shape['image'],
+                'hotspot': shape['hotspot'],
+                'width': shape['width'],
+                'height': shape['height']
+            })
+        return message
+    
+    def _adapt_stream(self, client_id):
+        """Apply new settings from the session's controller, if it chose any."""
+        session = self.streaming_sessions[client_id]
+        if not session['controller']:
+            return
+        
+        settings = session['controller'].update()
+        if not settings:
+            return
+        
+        session.update(settings)
+        
+        # Push the decision to the client mid-stream and tell the viewers
+        socketio.emit('stream_settings', dict(settings, session_id=session['session_id']),
+                      room=client_id)
+        self._emit_to_stream_viewers(session, 'stream_settings_changed',
+                                     dict(settings, client_id=client_id, session_id=session['session_id']))
+        
+        logger.info(f"Adapted stream settings for {client_id}: {settings}")
+    
+    def _emit_to_stream_viewers(self, session, event, data):
+        """Emit a control message to every viewer of a stream."""
+        for room in self._stream_rooms(session):
+            socketio.emit(event, data, room=room)
+    
+    def _viewer_can_take_frame(self, session, viewer, frame_type):
+        """Check whether a viewer has room for another frame of this type."""
+        if len(viewer['outstanding']) >= STREAM_VIEWER_WINDOW:
+            return False
+        return frame_type == 'key' or not viewer['needs_keyframe']
+    
+    def _expire_unacked_frames(self, viewer, now):
+        """Write off frames whose acks never arrived so the viewer isn't stuck."""
+        for seq, sent_at in list(viewer['outstanding'].items()):
+            if now - sent_at > STREAM_ACK_TIMEOUT:
+                del viewer['outstanding'][seq]
+    
+    def _replenish_stream_credit(self, client_id):
+        """Top the client's frame credit back up while any viewer can take a frame."""
+        session = self.streaming_sessions.get(client_id)
+        if session is None:
+            return
+        
+        now = time.monotonic()
+        for viewer in session['viewer_state'].values():
+            self._expire_unacked_frames(viewer, now)
+        
+        # The fastest viewer sets the pace; slower viewers skip frames
+        if not any(len(viewer['outstanding']) < STREAM_VIEWER_WINDOW
+                   for viewer in session['viewer_state'].values()):
+            return
+        
+        credits = STREAM_CREDIT_WINDOW - session['client_credit']
+        if credits <= 0:
+            return
+        
+        session['client_credit'] += credits
+        socketio.emit('stream_credit', {
+            'session_id': session['session_id'],
+            'credits': credits
+        }, room=client_id)
+    
+    def _request_keyframe(self, client_id, tier):
+        """Ask the client for a keyframe of a tier unless one is already on its way."""
+        session = self.streaming_sessions[client_id]
+        if tier in session['keyframe_pending']:
+            return
+        
+        session['keyframe_pending'].add(tier)
+        socketio.emit('request_keyframe', {
+            'session_id': session['session_id'],
+            'tier': tier
+        }, room=client_id)
+    
+    def _frame_is_binary(self, frame):
+        """Check whether a frame payload carries raw bytes."""
+        if 'tiles' in frame:
+            return any(isinstance(tile.get('data'), bytes) for tile in frame['tiles'])
+        return isinstance(frame.get('frame'), bytes)
+    
+    def _frame_size(self, frame):
+        """Size in bytes of a frame payload's image data."""
+        if 'tiles' in frame:
+            return sum(len(tile.get('data') or '') for tile in frame['tiles'])
+        return len(frame.get('frame') or '')
+    
+    def _frame_to_base64(self, frame):
+        """Build a copy of a binary frame payload with base64 image data."""
+        converted = dict(frame, encoding='base64')
+        if 'frame' in frame:
+            converted['frame'] = base64.b64encode(frame['frame']).decode('utf-8')
+        if 'tiles' in frame:
+            converted['tiles'] = [
+                dict(tile, data=base64.b64encode(tile['data']).decode('utf-8'))
+                for tile in frame['tiles']
+            ]
+        return converted
     
     def handle_stream_started(self, data):
         """Handle notification that streaming has started."""
@@ -260,13 +1110,101 @@ class RemoteManagementService:
         
         if client_id in self.streaming_sessions and self.streaming_sessions[client_id]['session_id'] == session_id:
             # Notify all viewers that streaming has started
-            for user_id in self.streaming_sessions[client_id]['viewers']:
-                socketio.emit('stream_started', {
-                    'client_id': client_id,
-                    'session_id': session_id,
-                    'resolution': data.get('resolution'),
-                    'fps': data.get('fps')
-                }, room=f"user_{user_id}")
+            self._emit_to_stream_viewers(self.streaming_sessions[client_id], 'stream_started', {
+                'client_id': client_id,
+                'session_id': session_id,
+                'resolution': data.get('resolution'),
+                'fps': data.get('fps')
+            })
+    
+    def handle_stream_stats(self, data):
+        """Handle per-stage pipeline statistics reported by a streaming client."""
+        client_id = data.get('client_id')
+        session_id = data.get('session_id')
+        
+        if client_id in self.streaming_sessions and self.streaming_sessions[client_id]['session_id'] == session_id:
+            session = self.streaming_sessions[client_id]
+            session['pipeline_stats'] = {
+                'timings': data.get('timings', {}),
+                'fps': data.get('fps'),
+                'dropped': data.get('dropped', 0),
+                'reported_at': datetime.now().isoformat()
+            }
+            session['telemetry'].set_agent_dropped(data.get('dropped', 0))
+    
+    def handle_screen_keepalive(self, data):
+        """
+        Handle a keepalive sent in place of frames while the client's screen is unchanged.
+        
+        Viewers are told the stream is still live, so they can tell a still
+        screen from a stalled one.
+        """
+        client_id = data.get('client_id')
+        session_id = data.get('session_id')
+        
+        if client_id not in self.streaming_sessions or self.streaming_sessions[client_id]['session_id'] != session_id:
+            return
+        
+        session = self.streaming_sessions[client_id]
+        session['frames_unchanged'] += data.get('unchanged', 0)
+        session['idle'] = bool(data.get('idle'))
+        session['last_keepalive'] = datetime.now()
+        
+        self._emit_to_stream_viewers(session, 'stream_keepalive', {
+            'client_id': client_id,
+            'session_id': session_id,
+            'seq': data.get('seq'),
+            'idle': session['idle'],
+            'timestamp': session['last_keepalive'].isoformat()
+        })
+    
+    def get_stream_stats(self, client_id):
+        """Get statistics about a client's active streaming session."""
+        if client_id not in self.streaming_sessions:
+            return None
+        
+        session = self.streaming_sessions[client_id]
+        return {
+            'session_id': session['session_id'],
+            'started_at': session['started_at'].isoformat(),
+            'quality': session['quality'],
+            'fps': session['fps'],
+            'scale': session['scale'],
+            'codec': session['codec'],
+            'color_mode': session['color_mode'],
+            'capture_area': session['capture_area'],
+            'recording': session['recording'] is not None,
+            'frames_received': session['frames_received'],
+            'frames_dropped': session['frames_dropped'],
+            'frames_unchanged': session['frames_unchanged'],
+            'idle': session['idle'],
+            'last_keepalive': session['last_keepalive'].isoformat() if session['last_keepalive'] else None,
+            'viewers': len(session['viewers']),
+            'tiers': {tier['name']: sum(1 for viewer in session['viewer_state'].values()
+                                        if viewer['tier'] == tier['name'])
+                      for tier in session['tiers']},
+            'cached_bytes': self.frame_cache.memory_usage()['streams'].get(session['session_id'], 0),
+            'pipeline': session['pipeline_stats'],
+            'controller': session['controller'].stats() if session['controller'] else None
+        }
+    
+    def get_stream_telemetry(self, client_id=None):
+        """
+        Latency histograms and per-second rates of one streaming session, or
+        of every active session keyed by client ID.
+        """
+        if client_id is not None:
+            if client_id not in self.streaming_sessions:
+                return None
+            session = self.streaming_sessions[client_id]
+            return dict(session['telemetry'].snapshot(), session_id=session['session_id'],
+                        codec=session['codec'], color_mode=session['color_mode'])
+        
+        return {client_id: self.get_stream_telemetry(client_id) for client_id in list(self.streaming_sessions)}
+    
+    def get_frame_cache_usage(self):
+        """Get memory used by cached stream frames, in total and per stream."""
+        return self.frame_cache.memory_usage()
     
     def handle_stream_stopped(self, data):
         """Handle notification that streaming has stopped."""
@@ -274,16 +1212,116 @@ class RemoteManagementService:
         session_id = data.get('session_id')
         
         if client_id in self.streaming_sessions and self.streaming_sessions[client_id]['session_id'] == session_id:
-            # Notify all viewers that streaming has stopped
-            for user_id in self.streaming_sessions[client_id]['viewers']:
-                socketio.emit('stream_stopped', {
-                    'client_id': client_id,
-                    'session_id': session_id,
-                    'reason': data.get('reason', 'Client stopped streaming')
-                }, room=f"user_{user_id}")
-            
-            # Clean up streaming session
-            del self.streaming_sessions[client_id]
+            # Notify all viewers that streaming has stopped and clean up
+            self._end_stream_session(client_id, data.get('reason', 'Client stopped streaming'))
+    
+    # === Desktop Thumbnail Methods ===
+    
+    def start_thumbnails(self, interval=THUMBNAIL_INTERVAL, max_width=THUMBNAIL_MAX_WIDTH,
+                         quality=THUMBNAIL_QUALITY):
+        """
+        Turn on thumbnail mode: every client sends a small desktop snapshot
+        every interval seconds for the fleet overview.
+        
+        Clients start at staggered offsets within the interval so their
+        snapshots don't arrive in bursts. Full streams are only started when
+        a viewer opens a client's desktop (see start_streaming).
+        """
+        min_interval, max_interval = THUMBNAIL_INTERVAL_RANGE
+        if not min_interval <= interval <= max_interval:
+            return False, f"Thumbnail interval must be {min_interval} to {max_interval} seconds"
+        min_width, max_width_limit = THUMBNAIL_WIDTH_RANGE
+        if not min_width <= max_width <= max_width_limit:
+            return False, f"Thumbnail width must be {min_width} to {max_width_limit} pixels"
+        
+        self.thumbnail_settings = {
+            'interval': interval,
+            'max_width': max_width,
+            'quality': quality
+        }
+        
+        clients = [client_id for client_id, client in self.active_clients.items()
+                   if client['status'] == 'online' and 'screen_capture' in client['capabilities']]
+        for client_id in clients:
+            self._request_thumbnails(client_id)
+        
+        logger.info(f"Thumbnail mode started for {len(clients)} clients: {self.thumbnail_settings}")
+        return True, "Thumbnail mode started"
+    
+    def stop_thumbnails(self):
+        """Turn off thumbnail mode; cached thumbnails stay available."""
+        if self.thumbnail_settings is None:
+            return False, "Thumbnail mode is not active"
+        
+        self.thumbnail_settings = None
+        for client_id, client in self.active_clients.items():
+            if client['status'] == 'online':
+                socketio.emit('stop_thumbnails', {}, room=client_id)
+        
+        logger.info("Thumbnail mode stopped")
+        return True, "Thumbnail mode stopped"
+    
+    def _request_thumbnails(self, client_id):
+        """Ask a client to start sending thumbnails at its staggered offset."""
+        settings = self.thumbnail_settings
+        
+        # A hash of the client ID spreads clients evenly over the interval
+        # and keeps each client's slot when it reconnects
+        offset = zlib.crc32(client_id.encode('utf-8')) % 1000 / 1000 * settings['interval']
+        socketio.emit('start_thumbnails', dict(settings, offset=round(offset, 3)), room=client_id)
+    
+    def handle_screen_thumbnail(self, data):
+        """Handle a desktop snapshot sent by a client in thumbnail mode."""
+        client_id = data.get('client_id')
+        image = data.get('image')
+        
+        if client_id not in self.active_clients or not image:
+            return
+        
+        if isinstance(image, str):
+            image = base64.b64decode(image)
+        
+        etag = self.thumbnails.put(client_id, image, data.get('width'), data.get('height'),
+                                   data.get('captured_at'))
+        
+        # Dashboards can refresh just this tile
+        socketio.emit('thumbnail_updated', {
+            'client_id': client_id,
+            'etag': etag
+        }, room='admin_room')
+    
+    def get_thumbnail(self, client_id):
+        """A client's latest thumbnail with its image bytes, or None."""
+        return self.thumbnails.get(client_id)
+    
+    def get_thumbnails(self, client_ids=None, since=None):
+        """
+        Thumbnails of the given clients, or all known clients, for the fleet overview.
+        
+        Image data is base64 encoded and left out for thumbnails that haven't
+        changed since the given time (seconds since the epoch), so a
+        dashboard polling with the previous response's 'server_time' only
+        downloads the tiles that changed.
+        """
+        thumbnails = []
+        for client_id, thumbnail in self.thumbnails.get_many(client_ids).items():
+            client = self.active_clients.get(client_id, {})
+            entry = {
+                'client_id': client_id,
+                'hostname': client.get('hostname'),
+                'status': client.get('status', 'offline'),
+                'streaming': client_id in self.streaming_sessions,
+                'etag': thumbnail['etag'],
+                'mime_type': thumbnail['mime_type'],
+                'width': thumbnail['width'],
+                'height': thumbnail['height'],
+                'captured_at': thumbnail['captured_at'],
+                'updated_at': thumbnail['updated_at']
+            }
+            if since is None or thumbnail['updated_at'] > since:
+                entry['image'] = base64.b64encode(thumbnail['image']).decode('utf-8')
+            thumbnails.append(entry)
+        return thumbnails
     
     # === File Management Methods ===
     
@@ -324,8 +1362,18 @@ class RemoteManagementService:
             'timestamp': datetime.now().isoformat()
         }, room=f"request_{request_id}")
     
-    def start_file_upload(self, client_id, source_path, dest_path):
-        """Start uploading a file to a client."""
+    def start_file_upload(self, client_id, source_path, dest_path, delta=True):
+        """
+        Start uploading a file to a client.
+        
+        Clients advertising 'windowed_uploads' are sent a window of chunks at
+        once and acknowledge each by offset (see UploadWindow); older clients
+        ask for one chunk at a time.
+        
+        With delta set, clients advertising 'delta_sync' that already have a
+        file at dest_path are first asked for its block checksums, and sent
+        only what changed (see app/services/delta_sync.py).
+        """
         if client_id not in self.active_clients:
             return False, "Client not found"
         
@@ -338,33 +1386,96 @@ class RemoteManagementService:
         # Create file transfer session
         transfer_id = str(uuid.uuid4())
         file_size = os.path.getsize(source_path)
+        chunk_size = 1024 * 1024  # 1MB chunks
         
         self.file_transfer_sessions[transfer_id] = {
             'client_id': client_id,
             'type': 'upload',
             'source_path': source_path,
+            'source_mtime': os.path.getmtime(source_path),  # A changed source can't be resumed
             'dest_path': dest_path,
             'file_size': file_size,
             'bytes_transferred': 0,
-            'chunk_size': 1024 * 1024,  # 1MB chunks
+            'chunk_size': chunk_size,
             'status': 'starting',
-            'started_at': datetime.now()
+            'started_at': datetime.now(),
+            'checkpointed_at': 0,
+            'windowed': 'windowed_uploads' in self.active_clients[client_id]['capabilities'],
+            'source': None,  # Open while chunks are being sent
+            'window': None,  # Created once the client says which chunks it already has
+            'retransmit_timer': None,  # Resends timed out chunks when no acknowledgement arrives
+            'delta': None  # Delta being sent instead of the whole file
         }
+        self._checkpoint_transfer(transfer_id, force=True)
         
-        # Notify client about upcoming file
-        socketio.emit('file_upload_start', {
-            'transfer_id': transfer_id,
-            'filename': os.path.basename(source_path),
-            'dest_path': dest_path,
-            'file_size': file_size,
-            'chunk_size': self.file_transfer_sessions[transfer_id]['chunk_size']
-        }, room=client_id)
+        if delta and 'delta_sync' in self.active_clients[client_id]['capabilities']:
+            # Ask for the checksums of the client's copy; without one the file is sent in full
+            self.file_transfer_sessions[transfer_id]['status'] = 'signatures'
+            socketio.emit('file_delta_signature_request', {
+                'transfer_id': transfer_id,
+                'path': dest_path,
+                'block_size': delta_block_size(file_size)
+            }, room=client_id)
+        else:
+            # Notify client about upcoming file
+            self._emit_upload_start(transfer_id)
         
         logger.info(f"Starting file upload to {client_id}: {source_path} -> {dest_path}")
         return True, transfer_id
     
+    def _emit_upload_start(self, transfer_id, resume=False):
+        """Announce an upload to its client; on resume the client reports the chunks it already has."""
+        transfer = self.file_transfer_sessions[transfer_id]
+        transfer['status'] = 'starting'
+        socketio.emit('file_upload_start', {
+            'transfer_id': transfer_id,
+            'filename': os.path.basename(transfer['source_path']),
+            'dest_path': transfer['dest_path'],
+            'file_size': transfer['file_size'],
+            'chunk_size': transfer['chunk_size'],
+            'windowed': transfer['windowed'],
+            'resume': resume
+        }, room=transfer['client_id'])
+    
+    def handle_file_upload_ack(self, data):
+        """
+        Handle a client accepting an upload; it is then sent the first chunk,
+        or window of chunks.
+        
+        A resuming client lists the hashes of the chunks it already has by
+        offset. Those that still match the source are not sent again.
+        """
+        transfer_id = data.get('transfer_id')
+        if transfer_id not in self.file_transfer_sessions or not self.file_transfer_sessions[transfer_id]['windowed']:
+            self.handle_file_upload_chunk(data)
+            return
+        
+        transfer = self.file_transfer_sessions[transfer_id]
+        chunks = {int(offset): digest for offset, digest in (data.get('chunks') or {}).items()}
+        try:
+            if chunks:
+                self._open_upload_source(transfer)
+                for offset in stale_chunks(transfer['source'], chunks, transfer['chunk_size']):
+                    del chunks[offset]
+        except Exception as e:
+            logger.error(f"Error resuming file upload: {e}")
+            self._fail_upload(transfer_id, str(e))
+            return
+        
+        acked = chunk_ranges(chunks, transfer['chunk_size'], transfer['file_size'])
+        transfer['window'] = UploadWindow(transfer['file_size'], transfer['chunk_size'], acked=acked)
+        transfer['bytes_transferred'] = transfer['window'].bytes_acked
+        if chunks:
+            logger.info(f"Resuming file upload {transfer_id} with {transfer['bytes_transferred']} bytes already sent")
+        self._send_upload_window(transfer_id)
+    
     def handle_file_upload_chunk(self, data):
-        """Handle file upload chunk request from client."""
+        """
+        Handle file upload chunk request from client.
+        
+        Chunks go as binary attachments to clients advertising
+        'binary_transfers', and base64 encoded to older clients.
+        """
         transfer_id = data.get('transfer_id')
         offset = data.get('offset', 0)
         
@@ -377,54 +1488,253 @@ class RemoteManagementService:
         
         transfer = self.file_transfer_sessions[transfer_id]
         
-        # Read chunk from file
         try:
-            with open(transfer['source_path'], 'rb') as f:
-                f.seek(offset)
-                chunk = f.read(transfer['chunk_size'])
-            
-            # Encode chunk as base64
-            chunk_b64 = base64.b64encode(chunk).decode('utf-8')
-            
-            # Update transfer status
-            transfer['bytes_transferred'] = offset + len(chunk)
+            transfer['bytes_transferred'] = offset + self._send_upload_chunk(transfer_id, offset)
             transfer['status'] = 'in_progress'
             
-            # Check if this is the last chunk
-            is_last = transfer['bytes_transferred'] >= transfer['file_size']
-            
-            # Send chunk to client
-            socketio.emit('file_upload_chunk', {
-                'transfer_id': transfer_id,
-                'offset': offset,
-                'chunk': chunk_b64,
-                'is_last': is_last
-            }, room=transfer['client_id'])
-            
             # If this was the last chunk, update status
-            if is_last:
-                transfer['status'] = 'completed'
-                transfer['completed_at'] = datetime.now()
-                
-                # Clean up after a delay
-                def cleanup_transfer():
-                    if transfer_id in self.file_transfer_sessions:
-                        del self.file_transfer_sessions[transfer_id]
-                
-                threading.Timer(300, cleanup_transfer).start()  # Clean up after 5 minutes
-                
-                logger.info(f"File upload completed: {transfer['source_path']} -> {transfer['dest_path']}")
+            if transfer['bytes_transferred'] >= transfer['file_size']:
+                self._finish_upload(transfer_id)
             
         except Exception as e:
             logger.error(f"Error during file upload: {e}")
-            socketio.emit('file_upload_error', {
-                'transfer_id': transfer_id,
-                'error': str(e)
-            }, room=transfer['client_id'])
+            self._fail_upload(transfer_id, str(e))
+    
+    def handle_file_upload_chunk_ack(self, data):
+        """
+        Handle a client acknowledging a chunk it has written.
+        
+        Each acknowledgement frees a slot in the transfer's window, which is
+        refilled straight away.
+        """
+        transfer_id = data.get('transfer_id')
+        if transfer_id not in self.file_transfer_sessions:
+            return
+        
+        transfer = self.file_transfer_sessions[transfer_id]
+        window = transfer['window']
+        if window is None or transfer['status'] in ('completed', 'failed'):
+            return
+        
+        with self.upload_lock:
+            if not window.ack(data.get('offset'), time.monotonic()):
+                return
+        transfer['bytes_transferred'] = window.bytes_acked
+        
+        if window.is_complete():
+            self._finish_upload(transfer_id)
+        else:
+            self._send_upload_window(transfer_id)
+            self._checkpoint_transfer(transfer_id)
+    
+    def handle_file_upload_error(self, data):
+        """Handle a client reporting that it could not write an upload."""
+        transfer_id = data.get('transfer_id')
+        if transfer_id not in self.file_transfer_sessions:
+            return
+        
+        logger.error(f"File upload {transfer_id} failed on client: {data.get('error')}")
+        transfer = self.file_transfer_sessions[transfer_id]
+        transfer['status'] = 'failed'
+        transfer['error'] = data.get('error')
+        self._close_upload_source(transfer)
+        self._cleanup_transfer_later(transfer_id)
+    
+    def _send_upload_window(self, transfer_id):
+        """Send the chunks the upload's window has room for, and any that timed out."""
+        transfer = self.file_transfer_sessions[transfer_id]
+        try:
+            with self.upload_lock:
+                window = transfer['window']
+                if window is None:
+                    return
+                for offset in window.to_send(time.monotonic()):
+                    self._send_upload_chunk(transfer_id, offset)
+                self._schedule_upload_retransmit(transfer_id, window)
+            transfer['status'] = 'in_progress'
+        except Exception as e:
+            logger.error(f"Error during file upload: {e}")
+            self._fail_upload(transfer_id, str(e))
+    
+    def _schedule_upload_retransmit(self, transfer_id, window):
+        """
+        Start a timer resending the upload's chunks once they time out, unless
+        one is running; acknowledgements alone can't, as an upload whose whole
+        window is lost gets none.
+        """
+        transfer = self.file_transfer_sessions[transfer_id]
+        deadline = window.next_timeout()
+        if deadline is None or transfer['retransmit_timer'] is not None:
+            return
+        
+        def retransmit():
+            if transfer['retransmit_timer'] is not timer:
+                return  # Cancelled when the upload stopped
+            transfer['retransmit_timer'] = None
+            if transfer['status'] == 'in_progress':
+                self._send_upload_window(transfer_id)
+        
+        timer = threading.Timer(max(0, deadline - time.monotonic()), retransmit)
+        timer.daemon = True
+        transfer['retransmit_timer'] = timer
+        timer.start()
+    
+    def _send_upload_chunk(self, transfer_id, offset):
+        """Read the chunk at offset from the open source file and send it; returns its length."""
+        transfer = self.file_transfer_sessions[transfer_id]
+        
+        self._open_upload_source(transfer)
+        transfer['source'].seek(offset)
+        chunk = transfer['source'].read(transfer['chunk_size'])
+        length = len(chunk)
+        
+        client = self.active_clients.get(transfer['client_id'], {})
+        if 'binary_transfers' not in client.get('capabilities', []):
+            chunk = base64.b64encode(chunk).decode('utf-8')
+        
+        socketio.emit('file_upload_chunk', {
+            'transfer_id': transfer_id,
+            'offset': offset,
+            'chunk': chunk,
+            'is_last': offset + length >= transfer['file_size']
+        }, room=transfer['client_id'])
+        return length
+    
+    def _open_upload_source(self, transfer):
+        # The source stays open for the whole transfer rather than being reopened per chunk
+        if transfer['source'] is None:
+            transfer['source'] = open(transfer['source_path'], 'rb')
+    
+    def _finish_upload(self, transfer_id):
+        transfer = self.file_transfer_sessions[transfer_id]
+        transfer['status'] = 'completed'
+        transfer['completed_at'] = datetime.now()
+        self._close_upload_source(transfer)
+        self._cleanup_transfer_later(transfer_id)
+        
+        logger.info(f"File upload completed: {transfer['source_path']} -> {transfer['dest_path']}")
+    
+    def _fail_upload(self, transfer_id, error):
+        """Mark an upload failed and tell the client to discard it."""
+        transfer = self.file_transfer_sessions[transfer_id]
+        socketio.emit('file_upload_error', {
+            'transfer_id': transfer_id,
+            'error': error
+        }, room=transfer['client_id'])
+        
+        # Mark transfer as failed
+        transfer['status'] = 'failed'
+        transfer['error'] = error
+        self._close_upload_source(transfer)
+        self._cleanup_transfer_later(transfer_id)
+    
+    def _close_upload_source(self, transfer):
+        transfer['delta'] = None  # Reads from the source
+        if transfer['retransmit_timer'] is not None:
+            transfer['retransmit_timer'].cancel()
+            transfer['retransmit_timer'] = None
+        if transfer['source'] is not None:
+            transfer['source'].close()
+            transfer['source'] = None
+    
+    def handle_file_delta_signatures(self, data):
+        """
+        Handle the block checksums of the client's copy of an upload.
+        
+        The source is matched against them, and the delta sent if it is
+        smaller than the file; otherwise, or when the client has no copy, the
+        file is sent in full.
+        """
+        transfer_id = data.get('transfer_id')
+        transfer = self.file_transfer_sessions.get(transfer_id)
+        if transfer is None or transfer['status'] != 'signatures':
+            return
+        
+        if data.get('error'):
+            logger.info(f"Sending file upload {transfer_id} in full: {data.get('error')}")
+            self._emit_upload_start(transfer_id)
+            return
+        
+        block_size = data.get('block_size')
+        try:
+            self._open_upload_source(transfer)
+            ops = compute_delta(transfer['source'], transfer['file_size'], data.get('weak'), data.get('strong'),
+                                block_size)
+            size = delta_size(ops)
+            if size >= transfer['file_size']:
+                logger.info(f"Sending file upload {transfer_id} in full, its delta is {size} bytes")
+                self._emit_upload_start(transfer_id)
+                return
             
-            # Mark transfer as failed
-            transfer['status'] = 'failed'
-            transfer['error'] = str(e)
+            transfer['source'].seek(0)
+            file_hash = file_checksum(transfer['source'])
+        except Exception as e:
+            logger.error(f"Error computing file delta, sending file in full: {e}")
+            self._emit_upload_start(transfer_id)
+            return
+        
+        logger.info(f"Sending file upload {transfer_id} as a {size} byte delta of {len(ops)} operations")
+        transfer['delta'] = {
+            'messages': delta_messages(transfer['source'], ops, block_size, transfer['chunk_size']),
+            'block_size': block_size,
+            'file_hash': file_hash,
+            'seq': 0
+        }
+        self._send_delta_message(transfer_id)
+    
+    def handle_file_delta_ack(self, data):
+        """Handle a client applying a delta message; it is sent the next, until it reports the file rebuilt."""
+        transfer_id = data.get('transfer_id')
+        transfer = self.file_transfer_sessions.get(transfer_id)
+        if transfer is None or transfer['delta'] is None or data.get('seq') != transfer['delta']['seq'] - 1:
+            return
+        
+        if data.get('complete'):
+            transfer['bytes_transferred'] = transfer['file_size']
+            self._finish_upload(transfer_id)
+        else:
+            self._send_delta_message(transfer_id)
+    
+    def handle_file_delta_error(self, data):
+        """Handle a client failing to apply a delta, e.g. because its copy changed; the file is sent in full."""
+        transfer_id = data.get('transfer_id')
+        transfer = self.file_transfer_sessions.get(transfer_id)
+        if transfer is None or transfer['status'] in ('completed', 'failed'):
+            return
+        
+        logger.warning(f"Delta of file upload {transfer_id} failed on client, sending file in full: {data.get('error')}")
+        transfer['delta'] = None
+        transfer['bytes_transferred'] = 0
+        self._emit_upload_start(transfer_id)
+    
+    def _send_delta_message(self, transfer_id):
+        """Send the next message of an upload's delta; the last one carries the checksum of the whole file."""
+        transfer = self.file_transfer_sessions[transfer_id]
+        delta = transfer['delta']
+        try:
+            message = next(delta['messages'], None)
+        except Exception as e:
+            logger.error(f"Error during file upload: {e}")
+            self._fail_upload(transfer_id, str(e))
+            return
+        
+        payload = {
+            'transfer_id': transfer_id,
+            'seq': delta['seq'],
+            'ops': message[0] if message else [],
+            'is_last': message is None
+        }
+        if delta['seq'] == 0:
+            payload.update(dest_path=transfer['dest_path'], file_size=transfer['file_size'],
+                           block_size=delta['block_size'])
+        if message is None:
+            payload['file_hash'] = delta['file_hash']
+        else:
+            transfer['bytes_transferred'] = message[1]
+        
+        socketio.emit('file_delta_chunk', payload, room=transfer['client_id'])
+        delta['seq'] += 1
+        transfer['status'] = 'in_progress'
     
     def request_file_download(self, client_id, remote_path, local_path):
         """Request to download a file from a client."""
@@ -447,8 +1757,12 @@ class RemoteManagementService:
             'chunk_size': 1024 * 1024,  # 1MB chunks
             'status': 'starting',
             'started_at': datetime.now(),
-            'chunks': []  # Store chunks until complete
+            'checkpointed_at': 0,
+            'writer': None,  # Opened when the first chunk gives the file size
+            'chunk_log': None,  # Chunk log of an interrupted download, until its writer is reopened
+            'last_received': False
         }
+        self._checkpoint_transfer(transfer_id, force=True)
         
         # Request file from client
         socketio.emit('file_download_request', {
@@ -461,9 +1775,16 @@ class RemoteManagementService:
         return True, transfer_id
     
     def handle_file_download_chunk(self, data):
-        """Handle file chunk sent by client during download."""
+        """
+        Handle file chunk sent by client during download.
+        
+        Chunks are written to disk at their offset as they arrive, so memory
+        use doesn't grow with the file; the file is moved into place once
+        the last chunk has been seen and every byte has arrived. Chunks are
+        binary attachments, or base64 from older clients.
+        """
         transfer_id = data.get('transfer_id')
-        chunk_b64 = data.get('chunk')
+        chunk = data.get('chunk')
         offset = data.get('offset', 0)
         is_last = data.get('is_last', False)
         file_size = data.get('file_size', 0)
@@ -472,74 +1793,100 @@ class RemoteManagementService:
             return
         
         transfer = self.file_transfer_sessions[transfer_id]
+        if transfer['status'] in ('completed', 'failed'):
+            return
         
-        # Update file size if this is the first chunk
-        if offset == 0:
-            transfer['file_size'] = file_size
+        try:
+            # Every chunk carries the file size; the first one to arrive opens the file
+            if transfer['writer'] is None:
+                transfer['file_size'] = file_size
+                transfer['writer'] = ChunkedFileWriter(transfer['local_path'], file_size)
+            
+            writer = transfer['writer']
+            if isinstance(chunk, str):
+                chunk = base64.b64decode(chunk)
+            if chunk:
+                writer.write(offset, chunk)
+            
+            transfer['bytes_transferred'] = writer.bytes_received
+            transfer['status'] = 'in_progress'
+            if is_last:
+                transfer['last_received'] = True
+            
+            # Notify admin about progress
+            file_size = transfer['file_size']
+            progress = transfer['bytes_transferred'] / file_size * 100 if file_size > 0 else 0
+            socketio.emit('file_download_progress', {
+                'transfer_id': transfer_id,
+                'client_id': transfer['client_id'],
+                'bytes_transferred': transfer['bytes_transferred'],
+                'file_size': transfer['file_size'],
+                'progress': progress
+            }, room=f"user_{data.get('user_id')}")
+            
+            # Chunks may be handled out of order, so the last one can arrive before others
+            if not transfer['last_received'] or not writer.is_complete():
+                self._checkpoint_transfer(transfer_id)
+                return
+            
+            writer.finish()
+            
+            # Update transfer status
+            transfer['status'] = 'completed'
+            transfer['completed_at'] = datetime.now()
+            transfer['writer'] = None
+            
+            # Notify admin
+            socketio.emit('file_download_complete', {
+                'transfer_id': transfer_id,
+                'client_id': transfer['client_id'],
+                'local_path': transfer['local_path'],
+                'file_size': transfer['file_size']
+            }, room=f"user_{data.get('user_id')}")
+            
+            logger.info(f"File download completed: {transfer['remote_path']} -> {transfer['local_path']}")
+            
+            self._cleanup_transfer_later(transfer_id)
         
-        # Decode chunk
-        chunk = base64.b64decode(chunk_b64)
+        except Exception as e:
+            logger.error(f"Error saving downloaded file: {e}")
+            self._fail_download(transfer_id, str(e), data.get('user_id'))
+    
+    def handle_file_download_error(self, data):
+        """Handle a client reporting that it could not send a file."""
+        transfer_id = data.get('transfer_id')
+        if transfer_id not in self.file_transfer_sessions:
+            return
         
-        # Store chunk
-        transfer['chunks'].append((offset, chunk))
-        transfer['bytes_transferred'] += len(chunk)
-        transfer['status'] = 'in_progress'
+        logger.error(f"File download {transfer_id} failed on client: {data.get('error')}")
+        self._fail_download(transfer_id, data.get('error'), data.get('user_id'))
+    
+    def _fail_download(self, transfer_id, error, user_id=None):
+        """Mark a download failed, delete its partial file and tell the admin."""
+        transfer = self.file_transfer_sessions[transfer_id]
+        transfer['status'] = 'failed'
+        transfer['error'] = error
+        if transfer['writer'] is not None:
+            transfer['writer'].abort()
+            transfer['writer'] = None
         
-        # Notify admin about progress
-        progress = (transfer['bytes_transferred'] / transfer['file_size']) * 100 if transfer['file_size'] > 0 else 0
-        socketio.emit('file_download_progress', {
+        socketio.emit('file_download_error', {
             'transfer_id': transfer_id,
             'client_id': transfer['client_id'],
-            'bytes_transferred': transfer['bytes_transferred'],
-            'file_size': transfer['file_size'],
-            'progress': progress
-        }, room=f"user_{data.get('user_id')}")
+            'error': error
+        }, room=f"user_{user_id}")
         
-        # If this is the last chunk, save the complete file
-        if is_last:
-            try:
-                # Sort chunks by offset
-                transfer['chunks'].sort(key=lambda x: x[0])
-                
-                # Create directory if it doesn't exist
-                os.makedirs(os.path.dirname(transfer['local_path']), exist_ok=True)
-                
-                # Write file
-                with open(transfer['local_path'], 'wb') as f:
-                    for _, chunk_data in transfer['chunks']:
-                        f.write(chunk_data)
-                
-                # Update transfer status
-                transfer['status'] = 'completed'
-                transfer['completed_at'] = datetime.now()
-                
-                # Notify admin
-                socketio.emit('file_download_complete', {
-                    'transfer_id': transfer_id,
-                    'client_id': transfer['client_id'],
-                    'local_path': transfer['local_path'],
-                    'file_size': transfer['file_size']
-                }, room=f"user_{data.get('user_id')}")
-                
-                logger.info(f"File download completed: {transfer['remote_path']} -> {transfer['local_path']}")
-                
-                # Clean up after a delay
-                def cleanup_transfer():
-                    if transfer_id in self.file_transfer_sessions:
-                        del self.file_transfer_sessions[transfer_id]
-                
-                threading.Timer(300, cleanup_transfer).start()  # Clean up after 5 minutes
-                
-            except Exception as e:
-                logger.error(f"Error saving downloaded file: {e}")
-                transfer['status'] = 'failed'
-                transfer['error'] = str(e)
-                
-                socketio.emit('file_download_error', {
-                    'transfer_id': transfer_id,
-                    'client_id': transfer['client_id'],
-                    'error': str(e)
-                }, room=f"user_{data.get('user_id')}")
+        self._cleanup_transfer_later(transfer_id)
+    
+    def _cleanup_transfer_later(self, transfer_id):
+        """Forget a finished transfer after a delay, so its status can still be read."""
+        self.transfer_manifests.remove(transfer_id)
+        
+        def cleanup_transfer():
+            if transfer_id in self.file_transfer_sessions:
+                del self.file_transfer_sessions[transfer_id]
+        
+        threading.Timer(300, cleanup_transfer).start()  # Clean up after 5 minutes
     
     def handle_file_operation_result(self, data):
         """Handle result of file operations (delete, rename, etc.)."""
@@ -559,6 +1906,161 @@ class RemoteManagementService:
             'timestamp': datetime.now().isoformat()
         }, room=f"user_{data.get('user_id')}")
     
+    # === Transfer Resumption Methods ===
+    
+    def _transfer_manifest(self, transfer_id):
+        """
+        The persistent state of a transfer: what it moves where, and for
+        downloads the chunk log listing the chunks already on disk.
+        """
+        transfer = self.file_transfer_sessions[transfer_id]
+        manifest = {
+            'transfer_id': transfer_id,
+            'client_id': transfer['client_id'],
+            'type': transfer['type'],
+            'file_size': transfer['file_size'],
+            'chunk_size': transfer['chunk_size'],
+            'started_at': transfer['started_at'].isoformat()
+        }
+        
+        if transfer['type'] == 'upload':
+            manifest.update(source_path=transfer['source_path'], source_mtime=transfer['source_mtime'],
+                            dest_path=transfer['dest_path'], windowed=transfer['windowed'])
+            # The client's own manifest decides what is resent; this is for progress only
+            manifest['ranges'] = list(transfer['window'].acked) if transfer['window'] else []
+        else:
+            manifest.update(remote_path=transfer['remote_path'], local_path=transfer['local_path'])
+            if transfer['writer'] is not None:
+                transfer['writer'].checkpoint()
+                transfer['chunk_log'] = transfer['writer'].log_path
+            manifest['chunk_log'] = transfer['chunk_log']
+            manifest['ranges'] = transfer['writer'].ranges() if transfer['writer'] is not None else []
+        return manifest
+    
+    def _checkpoint_transfer(self, transfer_id, force=False):
+        """Save a transfer's manifest, at most every TRANSFER_CHECKPOINT_INTERVAL seconds unless forced."""
+        transfer = self.file_transfer_sessions[transfer_id]
+        now = time.monotonic()
+        if not force and now - transfer['checkpointed_at'] < TRANSFER_CHECKPOINT_INTERVAL:
+            return
+        
+        try:
+            self.transfer_manifests.save(transfer_id, self._transfer_manifest(transfer_id))
+            transfer['checkpointed_at'] = now
+        except Exception as e:
+            logger.error(f"Error checkpointing file transfer {transfer_id}: {e}")
+    
+    def _load_interrupted_transfers(self):
+        """Rebuild the sessions of transfers left unfinished by a previous run from their manifests."""
+        transfers = {}
+        for transfer_id, manifest in self.transfer_manifests.load_all().items():
+            transfer = {
+                'client_id': manifest['client_id'],
+                'type': manifest['type'],
+                'file_size': manifest['file_size'],
+                'chunk_size': manifest['chunk_size'],
+                'bytes_transferred': 0,
+                'status': 'interrupted',
+                'started_at': datetime.fromisoformat(manifest['started_at']),
+                'checkpointed_at': 0
+            }
+            if manifest['type'] == 'upload':
+                transfer.update(source_path=manifest['source_path'], source_mtime=manifest['source_mtime'],
+                                dest_path=manifest['dest_path'], windowed=manifest['windowed'],
+                                source=None, window=None, retransmit_timer=None, delta=None)
+            else:
+                transfer.update(remote_path=manifest['remote_path'], local_path=manifest['local_path'],
+                                writer=None, chunk_log=manifest.get('chunk_log'), last_received=False)
+            transfers[transfer_id] = transfer
+        
+        if transfers:
+            logger.info(f"Loaded {len(transfers)} interrupted file transfers")
+        return transfers
+    
+    def _interrupt_transfers(self, client_id):
+        """Checkpoint a disconnected client's transfers and release their files."""
+        for transfer_id, transfer in list(self.file_transfer_sessions.items()):
+            if transfer['client_id'] != client_id or transfer['status'] in ('completed', 'failed'):
+                continue
+            
+            self._checkpoint_transfer(transfer_id, force=True)
+            transfer['status'] = 'interrupted'
+            if transfer['type'] == 'upload':
+                self._close_upload_source(transfer)
+                transfer['window'] = None
+            elif transfer['writer'] is not None:
+                transfer['writer'].close()
+                transfer['writer'] = None
+    
+    def _resume_transfers(self, client_id):
+        """
+        Resume a client's unfinished transfers after it registers.
+        
+        Only the ranges the receiving side is missing are sent again, and
+        chunks whose content no longer matches the source. Clients that can't
+        resume transfers have theirs failed.
+        """
+        resumable = 'resumable_transfers' in self.active_clients[client_id]['capabilities']
+        for transfer_id, transfer in list(self.file_transfer_sessions.items()):
+            if transfer['client_id'] != client_id or transfer['status'] in ('completed', 'failed'):
+                continue
+            
+            if not resumable:
+                error = 'Client reconnected and cannot resume transfers'
+                if transfer['type'] == 'upload':
+                    self._fail_upload(transfer_id, error)
+                else:
+                    self._fail_download(transfer_id, error)
+                continue
+            
+            logger.info(f"Resuming file {transfer['type']} {transfer_id} for {client_id}")
+            if transfer['type'] == 'upload':
+                self._resume_upload(transfer_id)
+            else:
+                self._resume_download(transfer_id)
+    
+    def _resume_upload(self, transfer_id):
+        transfer = self.file_transfer_sessions[transfer_id]
+        try:
+            changed = (os.path.getsize(transfer['source_path']) != transfer['file_size']
+                       or os.path.getmtime(transfer['source_path']) != transfer['source_mtime'])
+        except OSError:
+            changed = True
+        if changed:
+            self._fail_upload(transfer_id, 'Source file changed since the upload started')
+            return
+        
+        self._close_upload_source(transfer)
+        transfer['window'] = None
+        self._emit_upload_start(transfer_id, resume=True)
+    
+    def _resume_download(self, transfer_id):
+        transfer = self.file_transfer_sessions[transfer_id]
+        request = {
+            'transfer_id': transfer_id,
+            'path': transfer['remote_path'],
+            'chunk_size': transfer['chunk_size']
+        }
+        
+        try:
+            # Without any chunk on disk the download simply starts over
+            if transfer['writer'] is None and transfer['chunk_log'] and os.path.exists(transfer['chunk_log']):
+                transfer['writer'] = ChunkedFileWriter(transfer['local_path'], transfer['file_size'], resume=True)
+            if transfer['writer'] is not None:
+                transfer['writer'].checkpoint()
+                # The client checks the hashes against its file; they are only read back from the log for this
+                request.update(file_size=transfer['file_size'], ranges=transfer['writer'].missing(),
+                               chunks=transfer['writer'].chunk_hashes())
+                transfer['bytes_transferred'] = transfer['writer'].bytes_received
+        except Exception as e:
+            logger.error(f"Error resuming file download: {e}")
+            self._fail_download(transfer_id, str(e))
+            return
+        
+        transfer['last_received'] = False
+        transfer['status'] = 'starting'
+        socketio.emit('file_download_request', request, room=transfer['client_id'])
+    
     # === Command Execution Methods ===
     
     def execute_command(self, client_id, command, user_id):
@@ -0,0 +1,83 @@
+"""
+Frame cache module for desktop streaming sessions.
+Keeps the latest keyframe of each stream and the deltas sent since, so a
+viewer joining mid-stream can draw the current screen straight away.
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class StreamFrameCache:
+    """
+    Bounded cache of the latest keyframe and subsequent deltas, kept per
+    session and resolution tier.
+    
+    When a stream's deltas outgrow the per-stream limits the entry is dropped
+    rather than trimmed, since a keyframe with missing deltas no longer shows
+    the current screen; the caller should ask the client for a new keyframe.
+    Entries are evicted when their streaming session ends.
+    """
+    
+    def __init__(self, max_deltas=120, max_stream_bytes=8 * 1024 * 1024):
+        self.max_deltas = max_deltas
+        self.max_stream_bytes = max_stream_bytes
+        self.streams = {}  # (session_id, tier) -> {'keyframe', 'deltas', 'bytes'}
+        self.lock = threading.Lock()
+    
+    def add_frame(self, session_id, frame, size, tier='full'):
+        """
+        Cache a frame payload of the given size in bytes.
+        
+        Returns False when the frame could not be cached because the stream
+        has no usable keyframe, meaning a new keyframe is needed.
+        """
+        key = (session_id, tier)
+        with self.lock:
+            if frame['type'] != 'delta':
+                self.streams[key] = {
+                    'keyframe': frame,
+                    'deltas': [],
+                    'bytes': size
+                }
+                return True
+            
+            entry = self.streams.get(key)
+            if entry is None:
+                return False
+            
+            if (len(entry['deltas']) >= self.max_deltas
+                    or entry['bytes'] + size > self.max_stream_bytes):
+                logger.debug(f"Frame cache for stream {session_id} ({tier}) is full, dropping it")
+                del self.streams[key]
+                return False
+            
+            entry['deltas'].append(frame)
+            entry['bytes'] += size
+            return True
+    
+    def get_frames(self, session_id, tier='full'):
+        """Frames that rebuild the current screen, keyframe first; empty if unknown."""
+        with self.lock:
+            entry = self.streams.get((session_id, tier))
+            if entry is None:
+                return []
+            return [entry['keyframe']] + list(entry['deltas'])
+    
+    def evict(self, session_id):
+        """Drop the cached frames of all tiers of a stream that has ended."""
+        with self.lock:
+            for key in [key for key in self.streams if key[0] == session_id]:
+                del self.streams[key]
+    
+    def memory_usage(self):
+        """Bytes of image data held, in total and per stream."""
+        streams = {}
+        with self.lock:
+            for (session_id, _), entry in self.streams.items():
+                streams[session_id] = streams.get(session_id, 0) + entry['bytes']
+        return {
+            'total_bytes': sum(streams.values()),
+            'streams': streams
+        }
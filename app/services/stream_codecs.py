@@ -0,0 +1,113 @@
+"""
+Codec registry for desktop streaming sessions.
+Describes the frame codecs client agents may use and picks, per session, the
+cheapest codec a client supports for the expected workload.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Codecs a client may advertise at registration, and the workloads they suit;
+# lossy codecs smear text, lossless ones bloat photographic content
+STREAM_CODECS = {
+    'jpeg': {'mime_type': 'image/jpeg', 'workloads': ('video',)},
+    'webp': {'mime_type': 'image/webp', 'workloads': ('video',)},
+    'png': {'mime_type': 'image/png', 'workloads': ('text',)},
+    # Raw RGB pixels compressed with zlib; the frame or tile gives the size
+    'zlib': {'mime_type': 'application/x-rgb-zlib', 'workloads': ('text',)},
+    # Palette PNG for low-colour tiles and JPEG for the rest; each tile names its codec
+    'mixed': {'mime_type': None, 'workloads': ('text', 'video')}
+}
+
+DEFAULT_STREAM_CODEC = 'jpeg'
+
+# Colour depth reductions a session can request, and the codecs that can
+# carry the reduced frames; None means any codec. Zlib frames are raw RGB and
+# JPEG cannot store palette images, so palette frames need PNG. Lossy codecs
+# would blur rgb565's quantisation away again, so it takes lossless ones only
+STREAM_COLOR_MODES = {
+    'full': {'codecs': None},
+    'grayscale': {'codecs': ('jpeg', 'webp', 'png', 'mixed')},
+    'rgb565': {'codecs': ('png', 'zlib')},
+    'palette': {'codecs': ('png',)}
+}
+
+DEFAULT_COLOR_MODE = 'full'
+
+# Workloads a session can be tuned for; 'auto' weighs every codec the client supports
+STREAM_WORKLOADS = ('text', 'video', 'auto')
+
+# Link rate, in bytes per second, used to weigh frame size against encode time
+NOMINAL_LINK_RATE = 10 * 1000 * 1000 / 8
+
+def codec_cost(cost, link_rate=NOMINAL_LINK_RATE):
+    """Seconds to encode and send one megapixel, from a client's advertised cost."""
+    return cost.get('encode_ms', 0) / 1000 + cost.get('bytes', 0) / link_rate
+
+def choose_stream_codec(advertised, codec=None, workload=None, link_rate=NOMINAL_LINK_RATE):
+    """
+    Pick the codec for a streaming session.
+    
+    Args:
+        advertised: Codec name -> {'encode_ms', 'bytes'} per megapixel, as
+            reported by the client; empty for clients that predate codecs
+        codec: Codec explicitly requested for the session
+        workload: Key of STREAM_WORKLOADS, or None for the default codec
+        link_rate: Expected link rate in bytes per second
+    
+    Returns:
+        tuple: (codec name, None) or (None, error message)
+    """
+    supported = {name: cost for name, cost in (advertised or {}).items() if name in STREAM_CODECS}
+    
+    if codec is not None:
+        if codec not in supported and not (codec == DEFAULT_STREAM_CODEC and not advertised):
+            return None, f"Client does not support codec {codec}"
+        return codec, None
+    
+    if workload is None or not supported:
+        return DEFAULT_STREAM_CODEC, None
+    
+    if workload not in STREAM_WORKLOADS:
+        return None, f"Unknown workload {workload}"
+    
+    candidates = {name: cost for name, cost in supported.items()
+                  if workload == 'auto' or workload in STREAM_CODECS[name]['workloads']}
+    if not candidates:
+        return DEFAULT_STREAM_CODEC, None
+    
+    chosen = min(candidates, key=lambda name: codec_cost(candidates[name], link_rate))
+    logger.debug(f"Chose codec {chosen} for {workload} workload from {sorted(candidates)}")
+    return chosen, None
+
+def choose_color_mode(advertised, color_mode=None, codec=None):
+    """
+    Check a session's colour mode against its codec and the client.
+    
+    Args:
+        advertised: Colour modes reported by the client; empty for clients
+            that predate colour reduction
+        color_mode: Key of STREAM_COLOR_MODES, or None for full colour
+        codec: Codec requested for the session, or None to let the colour
+            mode pick one it can be carried by
+    
+    Returns:
+        tuple: (color mode, codec or None, None) or (None, None, error message)
+    """
+    if color_mode is None or color_mode == DEFAULT_COLOR_MODE:
+        return DEFAULT_COLOR_MODE, codec, None
+    
+    if color_mode not in STREAM_COLOR_MODES:
+        return None, None, f"Unknown colour mode {color_mode}"
+    
+    if color_mode not in (advertised or ()):
+        return None, None, f"Client does not support colour mode {color_mode}"
+    
+    codecs = STREAM_COLOR_MODES[color_mode]['codecs']
+    if codecs is not None:
+        if codec is None:
+            codec = codecs[0]
+        elif codec not in codecs:
+            return None, None, f"Colour mode {color_mode} cannot be sent as {codec}"
+    return color_mode, codec, None
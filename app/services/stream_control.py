@@ -0,0 +1,196 @@
+"""
+Stream control module for desktop streaming sessions.
+Adapts JPEG quality, frame rate and scale to what the client, the network
+and the viewers can sustain.
+"""
+
+import time
+import logging
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Bounds the controller may move each setting within
+DEFAULT_STREAM_BOUNDS = {
+    'min_quality': 30,
+    'max_quality': 85,
+    'min_fps': 2,
+    'max_fps': 20,
+    'min_scale': 0.25,
+    'max_scale': 1.0
+}
+
+class AdaptiveStreamController:
+    """
+    Retunes the settings of one streaming session from observed statistics.
+    
+    Settings are lowered multiplicatively when the client can't encode in
+    time or the link shows congestion (rising ack round trips, dropped frames
+    or more bytes offered than delivered), and raised additively while there
+    is headroom.
+    """
+    
+    UPDATE_INTERVAL = 1.0  # Seconds between retuning decisions
+    SAMPLE_WINDOW = 30  # Frames/acks kept for averages
+    
+    def __init__(self, quality=75, fps=10, scale=1.0, bounds=None):
+        self.bounds = dict(DEFAULT_STREAM_BOUNDS, **(bounds or {}))
+        self.quality = self._clamp(quality, 'quality')
+        self.fps = self._clamp(fps, 'fps')
+        self.scale = self._clamp(scale, 'scale')
+        
+        self.encode_times = deque(maxlen=self.SAMPLE_WINDOW)
+        self.frame_sizes = deque(maxlen=self.SAMPLE_WINDOW)
+        self.round_trips = deque(maxlen=self.SAMPLE_WINDOW)
+        self.delivered = deque(maxlen=self.SAMPLE_WINDOW)  # (time acked, bytes)
+        self.pending_sizes = OrderedDict()  # seq -> frame size, awaiting first ack
+        self.min_round_trip = None
+        self.drops_since_update = 0
+        self.last_update = time.monotonic()
+    
+    @property
+    def settings(self):
+        """Current stream settings."""
+        return {
+            'quality': self.quality,
+            'fps': self.fps,
+            'scale': self.scale
+        }
+    
+    def record_frame(self, seq, size, encode_ms=None):
+        """Record a frame received from the client."""
+        self.frame_sizes.append(size)
+        if encode_ms is not None:
+            self.encode_times.append(encode_ms / 1000)
+        
+        self.pending_sizes[seq] = size
+        while len(self.pending_sizes) > self.SAMPLE_WINDOW:
+            self.pending_sizes.popitem(last=False)
+    
+    def record_ack(self, seq, round_trip, now=None):
+        """Record the first viewer acknowledgement of a frame."""
+        size = self.pending_sizes.pop(seq, None)
+        if size is None:
+            return
+        
+        now = time.monotonic() if now is None else now
+        self.round_trips.append(round_trip)
+        self.delivered.append((now, size))
+        if self.min_round_trip is None or round_trip < self.min_round_trip:
+            self.min_round_trip = round_trip
+    
+    def record_drop(self):
+        """Record a frame that a viewer had to skip."""
+        self.drops_since_update += 1
+    
+    def bandwidth(self):
+        """Estimate delivered bytes per second from recent acks."""
+        if len(self.delivered) < 2:
+            return None
+        
+        elapsed = self.delivered[-1][0] - self.delivered[0][0]
+        if elapsed <= 0:
+            return None
+        return sum(size for _, size in list(self.delivered)[1:]) / elapsed
+    
+    def update(self, now=None):
+        """
+        Retune the settings if the update interval has passed.
+        
+        Returns the new settings when they changed, otherwise None.
+        """
+        now = time.monotonic() if now is None else now
+        if now - self.last_update < self.UPDATE_INTERVAL or not self.frame_sizes:
+            return None
+        
+        previous = self.settings
+        if self._encoder_overloaded():
+            # The client can't keep up, so ship fewer pixels or fewer frames
+            if not self._lower('scale', 0.75):
+                self._lower('fps', 0.75)
+        elif self._link_congested():
+            if not self._lower('quality', 0.85):
+                if not self._lower('fps', 0.75):
+                    self._lower('scale', 0.75)
+        elif self._has_headroom():
+            if not self._raise('fps', 1):
+                if not self._raise('quality', 5):
+                    self._raise('scale', 0.1)
+        
+        self.drops_since_update = 0
+        self.last_update = now
+        
+        if self.settings != previous:
+            logger.debug(f"Stream settings adapted: {previous} -> {self.settings}")
+            return self.settings
+        return None
+    
+    def stats(self):
+        """Statistics the controller is currently acting on."""
+        return {
+            'settings': self.settings,
+            'bounds': self.bounds,
+            'encode_ms': self._average(self.encode_times, 1000),
+            'frame_bytes': self._average(self.frame_sizes),
+            'round_trip_ms': self._average(self.round_trips, 1000),
+            'bandwidth': self.bandwidth()
+        }
+    
+    def _encoder_overloaded(self):
+        encode_time = self._average(self.encode_times)
+        return encode_time is not None and encode_time > 0.8 / self.fps
+    
+    def _link_congested(self):
+        if self.drops_since_update:
+            return True
+        
+        # Queueing delay shows up as round trips well above the best seen
+        round_trip = self._average(self.round_trips)
+        if round_trip is not None and round_trip > self.min_round_trip * 2 + 0.05:
+            return True
+        
+        bandwidth = self.bandwidth()
+        return bandwidth is not None and self._offered_rate() > bandwidth * 1.1
+    
+    def _has_headroom(self):
+        encode_time = self._average(self.encode_times)
+        if encode_time is not None and encode_time > 0.5 / self.fps:
+            return False
+        
+        # Delivered bandwidth only tops out at what is offered, so headroom
+        # is judged from round trips staying near the best seen
+        round_trip = self._average(self.round_trips)
+        return round_trip is None or round_trip <= self.min_round_trip * 1.25 + 0.02
+    
+    def _offered_rate(self):
+        return self._average(self.frame_sizes) * self.fps
+    
+    def _lower(self, name, factor):
+        """Lower a setting multiplicatively; returns False if already at its bound."""
+        current = getattr(self, name)
+        lowered = self._clamp(current * factor, name)
+        if lowered >= current:
+            return False
+        setattr(self, name, lowered)
+        return True
+    
+    def _raise(self, name, step):
+        """Raise a setting additively; returns False if already at its bound."""
+        current = getattr(self, name)
+        raised = self._clamp(current + step, name)
+        if raised <= current:
+            return False
+        setattr(self, name, raised)
+        return True
+    
+    def _clamp(self, value, name):
+        value = max(self.bounds[f'min_{name}'], min(self.bounds[f'max_{name}'], value))
+        if name == 'scale':
+            return round(value, 2)
+        return int(round(value))
+    
+    @staticmethod
+    def _average(values, multiplier=1):
+        if not values:
+            return None
+        return sum(values) / len(values) * multiplier
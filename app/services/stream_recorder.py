@@ -0,0 +1,346 @@
+"""
+Recording module for desktop streaming sessions.
+Writes relayed frames to append-only segment files with a keyframe index, on
+a background thread, and reads them back for playback.
+"""
+
+import os
+import json
+import mmap
+import queue
+import time
+import base64
+import bisect
+import struct
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Each record is this header, the frame metadata as JSON, then the image data
+RECORD_HEADER = struct.Struct('<dII')  # time, metadata length, data length
+# Index entries point at the keyframes playback can start from
+INDEX_ENTRY = struct.Struct('<dIQ')  # time, segment number, offset in segment
+
+class StreamRecorder:
+    """
+    Records streaming sessions to disk without blocking the relay path.
+    
+    Frames are handed to a background writer through a queue holding at
+    most queue_size of them. When it is full the frame is dropped and the
+    recording skips ahead to the next keyframe, so a slow disk costs
+    recorded frames but never adds relay latency. A recording is a
+    directory holding a manifest, numbered segment files that each start
+    with a keyframe, and an index of all keyframes for seeking.
+    """
+    
+    def __init__(self, base_dir, queue_size=256, segment_max_bytes=64 * 1024 * 1024,
+                 segment_max_seconds=300):
+        self.base_dir = base_dir
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_seconds = segment_max_seconds
+        self.queue_size = queue_size
+        # Unbounded so start and stop never block the caller; write() keeps
+        # the frames in it to queue_size through queued_frames instead
+        self.queue = queue.Queue()
+        self.queued_frames = 0
+        self.lock = threading.Lock()
+        self.recordings = {}  # session_id -> {'needs_keyframe', 'dropped'}
+        self.writer = None
+        
+        # Only touched by the writer thread
+        self.open_recordings = {}  # session_id -> open files and segment state
+    
+    def start(self, session_id, metadata=None):
+        """Start recording a session; frames are kept from its next keyframe on."""
+        with self.lock:
+            if session_id in self.recordings:
+                return
+            self.recordings[session_id] = {'needs_keyframe': True, 'dropped': 0}
+            if self.writer is None or not self.writer.is_alive():
+                self.writer = threading.Thread(target=self._write_loop, daemon=True)
+                self.writer.start()
+        
+        # Control messages share the queue with frames to keep their order, but
+        # never wait for room; only frames are ever dropped
+        self.queue.put_nowait(('start', session_id, dict(metadata or {}, started_at=time.time())))
+    
+    def write(self, session_id, frame):
+        """
+        Queue a relayed frame payload for recording.
+        
+        Returns False when the recording needs a keyframe to continue, after a
+        frame was dropped or before the first keyframe arrived.
+        """
+        with self.lock:
+            recording = self.recordings.get(session_id)
+            if recording is None:
+                return True
+            
+            if recording['needs_keyframe'] and frame['type'] != 'key':
+                return False
+            
+            if self.queued_frames >= self.queue_size:
+                recording['needs_keyframe'] = True
+                recording['dropped'] += 1
+                logger.warning(f"Recording queue full, dropped frame of session {session_id}")
+                return False
+            
+            self.queued_frames += 1
+            self.queue.put_nowait(('frame', session_id, frame, time.time()))
+            recording['needs_keyframe'] = False
+            return True
+    
+    def stop(self, session_id):
+        """Stop recording a session and close its files."""
+        with self.lock:
+            recording = self.recordings.pop(session_id, None)
+        if recording is not None:
+            self.queue.put_nowait(('stop', session_id, recording['dropped']))
+    
+    def is_recording(self, session_id):
+        with self.lock:
+            return session_id in self.recordings
+    
+    def flush(self):
+        """Wait until every queued frame has been written."""
+        self.queue.join()
+    
+    # === Writer thread ===
+    
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item[0] == 'frame':
+                with self.lock:
+                    self.queued_frames -= 1
+            try:
+                if item[0] == 'frame':
+                    self._write_frame(*item[1:])
+                elif item[0] == 'start':
+                    self._open_recording(*item[1:])
+                elif item[0] == 'stop':
+                    self._close_recording(*item[1:])
+                
+                # Make written frames visible to playback whenever the queue drains
+                if self.queue.empty():
+                    for recording in self.open_recordings.values():
+                        self._flush_files(recording)
+            except Exception as e:
+                logger.error(f"Error writing stream recording: {e}")
+            finally:
+                self.queue.task_done()
+    
+    def _open_recording(self, session_id, metadata):
+        directory = self._recording_dir(session_id)
+        os.makedirs(directory, exist_ok=True)
+        
+        # Recording a session again continues its recording in new segments
+        previous = self.read_manifest(session_id) or {}
+        if previous:
+            metadata = dict(metadata, started_at=previous['started_at'])
+        self._write_manifest(directory, metadata)
+        
+        self.open_recordings[session_id] = {
+            'directory': directory,
+            'metadata': metadata,
+            'index': open(os.path.join(directory, 'index.bin'), 'ab'),
+            'segment': None,
+            'segment_number': previous.get('segments', 0) - 1,
+            'segment_started': 0,
+            'frames': previous.get('frames', 0)
+        }
+        logger.info(f"Recording session {session_id} to {directory}")
+    
+    def _write_frame(self, session_id, frame, timestamp):
+        recording = self.open_recordings.get(session_id)
+        if recording is None:
+            return
+        
+        if frame['type'] == 'key':
+            if (recording['segment'] is None
+                    or recording['segment'].tell() >= self.segment_max_bytes
+                    or timestamp - recording['segment_started'] >= self.segment_max_seconds):
+                self._next_segment(recording, timestamp)
+            recording['index'].write(INDEX_ENTRY.pack(timestamp, recording['segment_number'],
+                                                      recording['segment'].tell()))
+        elif recording['segment'] is None:
+            return
+        
+        metadata, data = self._split_frame(frame)
+        metadata = json.dumps(metadata, separators=(',', ':')).encode('utf-8')
+        segment = recording['segment']
+        segment.write(RECORD_HEADER.pack(timestamp, len(metadata), len(data)))
+        segment.write(metadata)
+        segment.write(data)
+        recording['frames'] += 1
+    
+    def _next_segment(self, recording, timestamp):
+        if recording['segment'] is not None:
+            recording['segment'].close()
+        recording['segment_number'] += 1
+        recording['segment_started'] = timestamp
+        recording['segment'] = open(self._segment_path(recording['directory'], recording['segment_number']), 'ab')
+    
+    def _close_recording(self, session_id, dropped):
+        recording = self.open_recordings.pop(session_id, None)
+        if recording is None:
+            return
+        
+        self._flush_files(recording)
+        recording['index'].close()
+        if recording['segment'] is not None:
+            recording['segment'].close()
+        
+        self._write_manifest(recording['directory'], dict(
+            recording['metadata'],
+            ended_at=time.time(),
+            frames=recording['frames'],
+            segments=recording['segment_number'] + 1,
+            dropped=dropped
+        ))
+        logger.info(f"Recording of session {session_id} finished with {recording['frames']} frames")
+    
+    def _flush_files(self, recording):
+        if recording['segment'] is not None:
+            recording['segment'].flush()
+        recording['index'].flush()
+    
+    def _write_manifest(self, directory, metadata):
+        # Written to a temporary file first so readers never see half a manifest
+        path = os.path.join(directory, 'manifest.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(metadata, f)
+        os.replace(path + '.tmp', path)
+    
+    @staticmethod
+    def _split_frame(frame):
+        """Split a frame payload into JSON-safe metadata and its concatenated image data."""
+        base64_frame = frame.get('encoding') == 'base64'
+        
+        def raw(data):
+            return base64.b64decode(data) if base64_frame else data
+        
+        metadata = {key: frame.get(key) for key in ('seq', 'tier', 'type', 'codec', 'width', 'height', 'region')}
+        if 'tiles' in frame:
+            chunks = [raw(tile['data']) for tile in frame['tiles']]
+            metadata['tiles'] = [
+                dict({key: value for key, value in tile.items() if key != 'data'}, size=len(chunk))
+                for tile, chunk in zip(frame['tiles'], chunks)
+            ]
+            return metadata, b''.join(chunks)
+        return metadata, raw(frame['frame'])
+    
+    # === Playback ===
+    
+    def list_recordings(self):
+        """Manifests of all recordings on disk, newest first."""
+        if not os.path.isdir(self.base_dir):
+            return []
+        
+        recordings = []
+        for session_id in os.listdir(self.base_dir):
+            manifest = self.read_manifest(session_id)
+            if manifest is not None:
+                recordings.append(dict(manifest, session_id=session_id))
+        return sorted(recordings, key=lambda manifest: manifest.get('started_at', 0), reverse=True)
+    
+    def read_manifest(self, session_id):
+        try:
+            with open(os.path.join(self._recording_dir(session_id), 'manifest.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def read_frames(self, session_id, start=0, duration=10, limit=1000):
+        """
+        Read recorded frames for playback from start seconds into the recording.
+        
+        Reading begins at the last keyframe at or before the start time, so
+        the first frames returned may precede it; each frame's 'time' is its
+        offset into the recording. Returns None for an unknown recording.
+        """
+        manifest = self.read_manifest(session_id)
+        if manifest is None:
+            return None
+        
+        directory = self._recording_dir(session_id)
+        start_time = manifest['started_at'] + start
+        end_time = start_time + duration
+        
+        position = self._seek(directory, start_time)
+        if position is None:
+            return []
+        
+        frames = []
+        segment_number, offset = position
+        while len(frames) < limit:
+            path = self._segment_path(directory, segment_number)
+            if not os.path.exists(path):
+                break
+            
+            done = self._read_segment(path, offset, manifest['started_at'], end_time, frames, limit)
+            if done:
+                break
+            segment_number, offset = segment_number + 1, 0
+        return frames
+    
+    def _seek(self, directory, start_time):
+        """Find the (segment, offset) of the last keyframe at or before start_time."""
+        path = os.path.join(directory, 'index.bin')
+        if not os.path.exists(path) or os.path.getsize(path) < INDEX_ENTRY.size:
+            return None
+        
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as index:
+            # A trailing partial entry may still be being written
+            entries = [INDEX_ENTRY.unpack_from(index, position)
+                       for position in range(0, len(index) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size)]
+        
+        position = bisect.bisect_right([entry[0] for entry in entries], start_time) - 1
+        _, segment_number, offset = entries[max(position, 0)]
+        return segment_number, offset
+    
+    def _read_segment(self, path, offset, started_at, end_time, frames, limit):
+        """Append frames from one segment; returns True once end_time or limit is reached."""
+        if os.path.getsize(path) == 0:
+            return False
+        
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as segment:
+            while offset + RECORD_HEADER.size <= len(segment):
+                timestamp, metadata_length, data_length = RECORD_HEADER.unpack_from(segment, offset)
+                record_end = offset + RECORD_HEADER.size + metadata_length + data_length
+                if record_end > len(segment):
+                    break  # Record still being written
+                if timestamp > end_time or len(frames) >= limit:
+                    return True
+                
+                data_start = offset + RECORD_HEADER.size + metadata_length
+                metadata = json.loads(segment[offset + RECORD_HEADER.size:data_start])
+                frames.append(self._join_frame(metadata, segment[data_start:record_end], timestamp - started_at))
+                offset = record_end
+        return False
+    
+    @staticmethod
+    def _join_frame(metadata, data, offset_time):
+        """Rebuild a frame payload from its recorded metadata and image data."""
+        frame = dict(metadata, time=round(offset_time, 3))
+        if 'tiles' not in metadata:
+            frame['frame'] = data
+            return frame
+        
+        tiles = []
+        position = 0
+        for tile in metadata['tiles']:
+            size = tile['size']
+            tiles.append(dict({key: value for key, value in tile.items() if key != 'size'},
+                              data=data[position:position + size]))
+            position += size
+        frame['tiles'] = tiles
+        return frame
+    
+    def _recording_dir(self, session_id):
+        return os.path.join(self.base_dir, session_id)
+    
+    @staticmethod
+    def _segment_path(directory, number):
+        return os.path.join(directory, f'{number:06d}.seg')
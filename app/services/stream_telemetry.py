@@ -0,0 +1,225 @@
+"""
+Telemetry module for desktop streaming sessions.
+Breaks frame latency down by pipeline stage, from capture on the client to
+render in the viewer, and tracks frame rate, throughput and drops.
+"""
+
+import time
+import bisect
+import logging
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# Stages a frame passes through, in order; end_to_end runs from capture to render and
+# input_to_frame from relaying viewer input to receiving the first frame captured after it
+LATENCY_STAGES = ('capture', 'encode', 'agent_queue', 'uplink', 'relay', 'downlink', 'decode', 'render',
+                  'end_to_end', 'input_to_frame')
+
+class LatencyHistogram:
+    """Counts latency samples in fixed, roughly logarithmic buckets."""
+    
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last bucket holds everything above the bounds
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def record(self, value):
+        """Record a sample in milliseconds; None is ignored."""
+        if value is None:
+            return
+        
+        value = max(0.0, value)
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+    
+    def percentile(self, percent):
+        """Estimate a percentile by interpolating within its bucket."""
+        if not self.count:
+            return None
+        
+        rank = percent / 100 * self.count
+        cumulative = 0
+        for bucket, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.bounds[bucket - 1] if bucket else 0
+                upper = self.bounds[bucket] if bucket < len(self.bounds) else self.max
+                value = lower + (upper - lower) * (rank - cumulative) / count
+                return round(min(value, self.max), 2)
+            cumulative += count
+        return round(self.max, 2)
+    
+    def snapshot(self):
+        labels = [f'le_{bound}' for bound in self.bounds] + ['overflow']
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count, 2) if self.count else None,
+            'p50_ms': self.percentile(50),
+            'p99_ms': self.percentile(99),
+            'max_ms': round(self.max, 2) if self.count else None,
+            'buckets': dict(zip(labels, self.counts))
+        }
+
+class RateWindow:
+    """Per-second frame, byte and drop counts over a sliding window."""
+    
+    def __init__(self, seconds=60):
+        self.seconds = seconds
+        self.buckets = deque()  # [second, frames, bytes, dropped]
+    
+    def add(self, now, frames=0, size=0, dropped=0):
+        second = int(now)
+        if not self.buckets or self.buckets[-1][0] != second:
+            self.buckets.append([second, 0, 0, 0])
+        bucket = self.buckets[-1]
+        bucket[1] += frames
+        bucket[2] += size
+        bucket[3] += dropped
+        self._expire(second)
+    
+    def snapshot(self, now):
+        """Summaries and per-second series over the completed seconds in the window."""
+        current = int(now)
+        self._expire(current)
+        
+        # Seconds without traffic count as zero
+        counts = {bucket[0]: bucket for bucket in self.buckets}
+        seconds = range(current - self.seconds, current)
+        series = {
+            'fps': [counts[second][1] if second in counts else 0 for second in seconds],
+            'bytes_per_second': [counts[second][2] if second in counts else 0 for second in seconds],
+            'dropped_per_second': [counts[second][3] if second in counts else 0 for second in seconds]
+        }
+        
+        # Leading seconds before the stream started aren't counted
+        first = min(counts) if counts else current
+        active = max(0, min(self.seconds, current - first))
+        
+        summary = {}
+        for name, values in series.items():
+            values = values[len(values) - active:] if active else []
+            ordered = sorted(values)
+            summary[name] = {
+                'mean': round(sum(values) / len(values), 2) if values else None,
+                'min': ordered[0] if ordered else None,
+                'p50': ordered[len(ordered) // 2] if ordered else None,
+                'max': ordered[-1] if ordered else None,
+                'series': values
+            }
+        return summary
+    
+    def _expire(self, second):
+        while self.buckets and self.buckets[0][0] <= second - self.seconds:
+            self.buckets.popleft()
+
+class StreamTelemetry:
+    """
+    Latency and rate statistics of one streaming session.
+    
+    Client-side stages are measured on the client's clock and viewer-side
+    stages on the viewer's, so only durations are compared between them.
+    The uplink is the one exception: it spans the client's and the server's
+    clocks and is only as accurate as their synchronisation. The downlink is
+    half the ack round trip once the viewer's decode and render time is
+    taken out.
+    """
+    
+    PENDING_LIMIT = 120  # Frames awaiting a first ack before their latency is dropped
+    INPUT_TIMEOUT = 2.0  # Seconds after which input without a frame showing it is written off
+    
+    def __init__(self, window=60):
+        self.latency = {stage: LatencyHistogram() for stage in LATENCY_STAGES}
+        self.rates = RateWindow(window)
+        self.pending = OrderedDict()  # seq -> milliseconds from capture to relay
+        self.pending_input = OrderedDict()  # input seq -> time relayed to the client
+        self.frames = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.agent_dropped = 0
+    
+    def record_frame(self, seq, size, captured_at=None, sent_at=None, received_at=None,
+                     capture_ms=None, encode_ms=None, relay_ms=None, input_seq=None, now=None):
+        """
+        Record a frame relayed to viewers, with the timestamps the client put on it.
+        
+        input_seq is the last input batch the client had applied before
+        capturing the frame; it is only set on the first frame after it.
+        """
+        now = time.time() if now is None else now
+        self.frames += 1
+        self.bytes += size
+        self.rates.add(now, frames=1, size=size)
+        
+        if input_seq is not None:
+            arrived_at = now if received_at is None else received_at
+            # Earlier batches were applied before this frame was captured, too
+            for pending_seq in [s for s in self.pending_input if s <= input_seq]:
+                input_at = self.pending_input.pop(pending_seq)
+                if pending_seq == input_seq and arrived_at - input_at <= self.INPUT_TIMEOUT:
+                    self.latency['input_to_frame'].record((arrived_at - input_at) * 1000)
+        
+        self.latency['capture'].record(capture_ms)
+        self.latency['encode'].record(encode_ms)
+        self.latency['relay'].record(relay_ms)
+        
+        if captured_at is None or sent_at is None or received_at is None:
+            return
+        
+        agent_ms = (sent_at - captured_at) * 1000
+        self.latency['agent_queue'].record(agent_ms - (capture_ms or 0) - (encode_ms or 0))
+        uplink_ms = max(0.0, (received_at - sent_at) * 1000)
+        self.latency['uplink'].record(uplink_ms)
+        
+        self.pending[seq] = agent_ms + uplink_ms + (relay_ms or 0)
+        while len(self.pending) > self.PENDING_LIMIT:
+            self.pending.popitem(last=False)
+    
+    def record_ack(self, seq, round_trip, decode_ms=None, render_ms=None):
+        """Record a viewer's ack of a frame, with the round trip in seconds."""
+        viewer_ms = (decode_ms or 0) + (render_ms or 0)
+        downlink_ms = max(0.0, (round_trip * 1000 - viewer_ms) / 2)
+        
+        self.latency['decode'].record(decode_ms)
+        self.latency['render'].record(render_ms)
+        self.latency['downlink'].record(downlink_ms)
+        
+        # End to end is measured once per frame, by its first viewer
+        upstream_ms = self.pending.pop(seq, None)
+        if upstream_ms is not None:
+            self.latency['end_to_end'].record(upstream_ms + downlink_ms + viewer_ms)
+    
+    def record_input(self, seq, now=None):
+        """Record an input batch relayed to the client."""
+        now = time.time() if now is None else now
+        self.pending_input[seq] = now
+        
+        # Input that never changed the screen has no frame to measure against
+        while self.pending_input and now - next(iter(self.pending_input.values())) > self.INPUT_TIMEOUT:
+            self.pending_input.popitem(last=False)
+    
+    def record_drop(self, now=None):
+        """Record a frame a viewer had to skip."""
+        self.dropped += 1
+        self.rates.add(time.time() if now is None else now, dropped=1)
+    
+    def set_agent_dropped(self, dropped):
+        """Record the client's count of frames dropped inside its own pipeline."""
+        self.agent_dropped = dropped
+    
+    def snapshot(self, now=None):
+        now = time.time() if now is None else now
+        return {
+            'frames': self.frames,
+            'bytes': self.bytes,
+            'dropped': self.dropped,
+            'agent_dropped': self.agent_dropped,
+            'latency': {stage: histogram.snapshot() for stage, histogram in self.latency.items()},
+            'rates': self.rates.snapshot(now)
+        }
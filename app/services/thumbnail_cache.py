@@ -0,0 +1,91 @@
+"""
+Thumbnail cache module for the fleet desktop overview.
+Keeps the latest low-resolution snapshot of each client's desktop, so a
+dashboard can show many desktops without opening a stream to any of them.
+"""
+
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class ThumbnailCache:
+    """
+    LRU cache of the latest desktop thumbnail of each client.
+    
+    Bounded by both the number of thumbnails and their total size; the least
+    recently updated or read thumbnails are evicted first. Each thumbnail
+    gets an ETag derived from its content, so an unchanged desktop keeps its
+    ETag across updates.
+    """
+    
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.thumbnails = OrderedDict()  # client_id -> thumbnail, most recently used last
+        self.bytes = 0
+        self.lock = threading.Lock()
+    
+    def put(self, client_id, image, width, height, captured_at=None, mime_type='image/jpeg'):
+        """Store a client's latest thumbnail; returns its ETag."""
+        etag = hashlib.sha1(image).hexdigest()[:16]
+        with self.lock:
+            previous = self.thumbnails.pop(client_id, None)
+            if previous is not None:
+                self.bytes -= len(previous['image'])
+            
+            self.thumbnails[client_id] = {
+                'image': image,
+                'mime_type': mime_type,
+                'width': width,
+                'height': height,
+                'etag': etag,
+                'captured_at': captured_at,
+                # Only a changed image counts as an update for incremental reads
+                'updated_at': previous['updated_at'] if previous and previous['etag'] == etag else time.time()
+            }
+            self.bytes += len(image)
+            
+            while self.thumbnails and (len(self.thumbnails) > self.max_entries or self.bytes > self.max_bytes):
+                evicted_id, evicted = self.thumbnails.popitem(last=False)
+                self.bytes -= len(evicted['image'])
+                logger.debug(f"Thumbnail cache full, evicted thumbnail of {evicted_id}")
+        return etag
+    
+    def get(self, client_id):
+        """A client's thumbnail, or None if there is none."""
+        with self.lock:
+            thumbnail = self.thumbnails.get(client_id)
+            if thumbnail is not None:
+                self.thumbnails.move_to_end(client_id)
+            return thumbnail
+    
+    def get_many(self, client_ids=None):
+        """Thumbnails of the given clients, or of all clients, keyed by client ID."""
+        with self.lock:
+            if client_ids is None:
+                client_ids = list(self.thumbnails)
+            
+            thumbnails = {}
+            for client_id in client_ids:
+                if client_id in self.thumbnails:
+                    self.thumbnails.move_to_end(client_id)
+                    thumbnails[client_id] = self.thumbnails[client_id]
+            return thumbnails
+    
+    def remove(self, client_id):
+        with self.lock:
+            thumbnail = self.thumbnails.pop(client_id, None)
+            if thumbnail is not None:
+                self.bytes -= len(thumbnail['image'])
+    
+    def memory_usage(self):
+        """Number of thumbnails held and their total size in bytes."""
+        with self.lock:
+            return {
+                'thumbnails': len(self.thumbnails),
+                'total_bytes': self.bytes
+            }
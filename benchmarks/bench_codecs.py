@@ -0,0 +1,55 @@
+"""
+Screen Codec Benchmark
+Compares the client agent's frame codecs on a synthetic or captured desktop
+frame: encode rate, frame size and the combined cost the server uses to pick
+a codec per session.
+
+Usage: python benchmarks/bench_codecs.py [--capture] [--link-mbit 10]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PIL.ImageGrab
+from client_agent import ParallelFrameEncoder, available_codecs, encoded_size
+from app.services.stream_codecs import codec_cost
+from bench_encoder import make_frame
+
+def measure(codec, frame, quality, seconds):
+    """Encode the frame as keyframes for the given time and return (fps, bytes per frame)."""
+    encoder = ParallelFrameEncoder(workers=1, codec=codec)
+    frames = 0
+    size = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        size = encoded_size(encoder.encode_keyframe(frame, quality))
+        frames += 1
+    return frames / (time.perf_counter() - start), size
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark screen frame codecs')
+    parser.add_argument('--width', type=int, default=1920, help='Synthetic frame width')
+    parser.add_argument('--height', type=int, default=1080, help='Synthetic frame height')
+    parser.add_argument('--capture', action='store_true', help='Encode a real screenshot instead')
+    parser.add_argument('--quality', type=int, default=75, help='Quality for lossy codecs')
+    parser.add_argument('--seconds', type=float, default=3, help='Duration of each run')
+    parser.add_argument('--link-mbit', type=float, default=10, help='Link rate used for the combined cost')
+    parser.add_argument('--codecs', nargs='+', default=available_codecs(), help='Codecs to compare')
+    args = parser.parse_args()
+    
+    frame = PIL.ImageGrab.grab().convert('RGB') if args.capture else make_frame(args.width, args.height)
+    megapixels = frame.width * frame.height / 1e6
+    link_rate = args.link_mbit * 1000 * 1000 / 8
+    print(f"Frame: {frame.width}x{frame.height}, quality {args.quality}, link {args.link_mbit} Mbit/s")
+    
+    for codec in args.codecs:
+        fps, size = measure(codec, frame, args.quality, args.seconds)
+        cost = codec_cost({'encode_ms': 1000 / fps / megapixels, 'bytes': size / megapixels}, link_rate)
+        print(f"{codec:>6}: {fps:6.1f} fps  {size / 1024:8.1f} KiB/frame  {cost * megapixels * 1000:7.1f} ms/frame total")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Colour Mode Benchmark
+Compares the bytes per frame each colour depth reduction costs, replaying a
+recorded streaming session or a synthetic desktop session through the client
+agent's delta encoder with every codec the mode can be sent as.
+
+Usage: python benchmarks/bench_color_modes.py [--recordings recordings --session <id>] [--frames 200]
+"""
+
+import io
+import os
+import sys
+import time
+import base64
+import zlib
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PIL.Image
+import PIL.ImageDraw
+from client_agent import ParallelFrameEncoder, TileDeltaEncoder, ColorReducer, available_codecs, encoded_size
+from app.services.stream_codecs import STREAM_COLOR_MODES
+from app.services.stream_recorder import StreamRecorder
+from bench_encoder import make_frame
+
+def decode_image(data, codec, width, height):
+    """Decode one recorded frame or tile to an RGB image."""
+    if isinstance(data, str):
+        data = base64.b64decode(data)
+    if codec == 'zlib':
+        return PIL.Image.frombytes('RGB', (width, height), zlib.decompress(data))
+    return PIL.Image.open(io.BytesIO(data)).convert('RGB')
+
+def recorded_frames(recordings, session_id, limit):
+    """Rebuild the full screen of every recorded frame, painting delta tiles over the last one."""
+    frames = StreamRecorder(recordings).read_frames(session_id, 0, 365 * 24 * 3600, limit)
+    if frames is None:
+        raise SystemExit(f"No recording {session_id} in {recordings}")
+    
+    screen = None
+    for frame in frames:
+        if frame['type'] == 'key' or screen is None or screen.size != (frame['width'], frame['height']):
+            screen = PIL.Image.new('RGB', (frame['width'], frame['height']))
+        if 'frame' in frame:
+            screen = decode_image(frame['frame'], frame['codec'], frame['width'], frame['height'])
+        for tile in frame.get('tiles', []):
+            codec = tile.get('codec', frame['codec'])
+            screen.paste(decode_image(tile['data'], codec, tile['w'], tile['h']), (tile['x'], tile['y']))
+        yield screen.copy()
+
+def synthetic_frames(width, height, count):
+    """A desktop session: typing into a window, with an occasional scroll."""
+    screen = make_frame(width, height)
+    draw = PIL.ImageDraw.Draw(screen)
+    for number in range(count):
+        if number % 50 == 49:
+            screen.paste(screen.crop((0, 22, width, height)), (0, 0))
+        line = number % 20
+        draw.text((20 + (number % 40) * 7, 20 + line * 22), chr(65 + number % 26), fill=(20, 20, 20))
+        yield screen.copy()
+
+def measure(frames, mode, codec, quality):
+    """Encode the session and return (bytes per frame, ms per frame)."""
+    encoder = TileDeltaEncoder(encoder=ParallelFrameEncoder(workers=1, codec=codec), reducer=ColorReducer(mode))
+    total_size = 0
+    start = time.perf_counter()
+    for frame in frames:
+        encoded = encoder.encode(frame, quality)
+        if encoded is not None:
+            total_size += encoded_size(encoded)
+    elapsed = time.perf_counter() - start
+    return total_size / len(frames), elapsed * 1000 / len(frames)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark colour depth reduction modes')
+    parser.add_argument('--recordings', help='Recordings directory to read the corpus from')
+    parser.add_argument('--session', help='Recorded session ID to replay')
+    parser.add_argument('--frames', type=int, default=200, help='Frames to encode')
+    parser.add_argument('--width', type=int, default=1920, help='Synthetic frame width')
+    parser.add_argument('--height', type=int, default=1080, help='Synthetic frame height')
+    parser.add_argument('--quality', type=int, default=75, help='Quality for lossy codecs')
+    parser.add_argument('--codecs', nargs='+', default=available_codecs(), help='Codecs to compare')
+    args = parser.parse_args()
+    
+    if args.recordings and args.session:
+        frames = list(recorded_frames(args.recordings, args.session, args.frames))
+        source = f"recording {args.session}"
+    else:
+        frames = list(synthetic_frames(args.width, args.height, args.frames))
+        source = "synthetic session"
+    if not frames:
+        raise SystemExit("No frames to encode")
+    print(f"Corpus: {source}, {len(frames)} frames of {frames[0].width}x{frames[0].height}, quality {args.quality}")
+    
+    for mode, spec in STREAM_COLOR_MODES.items():
+        for codec in args.codecs:
+            if spec['codecs'] is not None and codec not in spec['codecs']:
+                continue
+            size, elapsed = measure(frames, mode, codec, args.quality)
+            print(f"{mode:>9} {codec:>6}: {size / 1024:8.1f} KiB/frame  {elapsed:6.1f} ms/frame")
+
+if __name__ == '__main__':
+    main()
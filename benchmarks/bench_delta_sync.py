@@ -0,0 +1,98 @@
+"""
+Delta Sync Benchmark
+Measures checksumming and matching throughput of delta sync, and the bytes a
+delta costs against sending the whole file, for a new build of a file that
+changed in a few places, and for an unrelated file of the same size.
+
+Usage: python benchmarks/bench_delta_sync.py [--size-mb 256] [--edits 20]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.delta_sync import (delta_block_size, file_signatures, compute_delta, delta_size, delta_messages,
+                                     apply_delta)
+
+def edit(path, out_path, edits, seed=1):
+    """Copy a file, inserting, deleting and overwriting a few hundred bytes at random places."""
+    rng = random.Random(seed)
+    file_size = os.path.getsize(path)
+    offsets = sorted(rng.randrange(file_size) for _ in range(edits))
+    with open(path, 'rb') as f, open(out_path, 'wb') as out:
+        position = 0
+        for offset in offsets:
+            out.write(f.read(offset - position))
+            kind = rng.choice(('insert', 'delete', 'overwrite'))
+            if kind != 'delete':
+                out.write(rng.randbytes(rng.randint(1, 500)))
+            if kind != 'insert':
+                f.seek(rng.randint(1, 500), os.SEEK_CUR)
+            position = f.tell()
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                break
+            out.write(data)
+
+def measure(old_path, new_path, rebuilt_path):
+    """Sync old_path to new_path; returns the timings, delta size and whether the rebuilt file matches."""
+    file_size = os.path.getsize(new_path)
+    block_size = delta_block_size(file_size)
+    
+    start = time.perf_counter()
+    with open(old_path, 'rb') as f:
+        weak, strong = file_signatures(f, block_size)
+    signatures = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    with open(new_path, 'rb') as f:
+        ops = compute_delta(f, file_size, weak, strong, block_size)
+    matching = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    with open(old_path, 'rb') as basis, open(new_path, 'rb') as f, open(rebuilt_path, 'wb') as out:
+        apply_delta(basis, (message for message, _ in delta_messages(f, ops, block_size, 1024 * 1024)),
+                    block_size, out)
+    rebuilding = time.perf_counter() - start
+    
+    with open(new_path, 'rb') as a, open(rebuilt_path, 'rb') as b:
+        matches = file_size == os.path.getsize(rebuilt_path) and all(
+            x == y for x, y in zip(iter(lambda: a.read(1 << 20), b''), iter(lambda: b.read(1 << 20), b'')))
+    return signatures, matching, rebuilding, delta_size(ops) + len(weak) + len(strong), block_size, matches
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark delta sync')
+    parser.add_argument('--size-mb', type=int, default=256, help='Size of the synced file')
+    parser.add_argument('--edits', type=int, default=20, help='Places the new file differs from the old one')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as directory:
+        old_path = os.path.join(directory, 'old.bin')
+        with open(old_path, 'wb') as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        edited_path = os.path.join(directory, 'edited.bin')
+        edit(old_path, edited_path, args.edits)
+        unrelated_path = os.path.join(directory, 'unrelated.bin')
+        with open(unrelated_path, 'wb') as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        
+        print(f"File: {args.size_mb} MB")
+        for name, new_path in (('edited', edited_path), ('unrelated', unrelated_path)):
+            signatures, matching, rebuilding, size, block_size, matches = measure(
+                old_path, new_path, os.path.join(directory, 'rebuilt.bin'))
+            file_size = os.path.getsize(new_path)
+            print(f"{name:>9}: {block_size // 1024} KiB blocks, "
+                  f"checksums {args.size_mb / signatures:6.1f} MB/s, matching {args.size_mb / matching:6.1f} MB/s, "
+                  f"rebuild {args.size_mb / rebuilding:6.1f} MB/s, "
+                  f"sent {size / 1024:10.1f} KiB ({size / file_size:6.2%} of the file){'' if matches else ' MISMATCH'}")
+
+if __name__ == '__main__':
+    main()
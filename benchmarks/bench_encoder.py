@@ -0,0 +1,78 @@
+"""
+Screen Encoder Benchmark
+Compares serial and parallel JPEG encoding throughput of the client agent's
+frame encoder on a synthetic or captured desktop frame.
+
+Usage: python benchmarks/bench_encoder.py [--width 3840 --height 2160] [--capture]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PIL.Image
+import PIL.ImageDraw
+import PIL.ImageGrab
+from client_agent import ParallelFrameEncoder
+
+def make_frame(width, height):
+    """Draw a desktop-like frame: flat background, windows, text and a gradient."""
+    frame = PIL.Image.new('RGB', (width, height), (32, 40, 56))
+    draw = PIL.ImageDraw.Draw(frame)
+    
+    for x in range(width // 2, width):
+        shade = 255 * (x - width // 2) // (width // 2)
+        draw.line((x, height // 2, x, height), fill=(shade, 128, 255 - shade))
+    
+    for i in range(12):
+        left, top = (i * 311) % (width - 800), (i * 197) % (height - 500)
+        draw.rectangle((left, top, left + 800, top + 500), fill=(240, 240, 240), outline=(90, 90, 90))
+        for line in range(20):
+            draw.text((left + 10, top + 10 + line * 22), f"drwxr-xr-x  user  {i * 20 + line:06d} config.yaml",
+                      fill=(20, 20, 20))
+    return frame
+
+def measure(encoder, frame, quality, seconds):
+    """Encode keyframes for the given time and return (fps, bytes per frame)."""
+    frames = 0
+    size = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        encoded = encoder.encode_keyframe(frame, quality)
+        if 'tiles' in encoded:
+            size = sum(len(tile['data']) for tile in encoded['tiles'])
+        else:
+            size = len(encoded['frame'])
+        frames += 1
+    return frames / (time.perf_counter() - start), size
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark serial vs parallel frame encoding')
+    parser.add_argument('--width', type=int, default=3840, help='Synthetic frame width')
+    parser.add_argument('--height', type=int, default=2160, help='Synthetic frame height')
+    parser.add_argument('--capture', action='store_true', help='Encode a real screenshot instead')
+    parser.add_argument('--quality', type=int, default=75, help='JPEG quality')
+    parser.add_argument('--seconds', type=float, default=5, help='Duration of each run')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Worker counts to compare')
+    args = parser.parse_args()
+    
+    frame = PIL.ImageGrab.grab().convert('RGB') if args.capture else make_frame(args.width, args.height)
+    print(f"Frame: {frame.width}x{frame.height}, quality {args.quality}, {os.cpu_count()} CPUs")
+    
+    baseline = None
+    for workers in args.workers:
+        encoder = ParallelFrameEncoder(workers)
+        try:
+            fps, size = measure(encoder, frame, args.quality, args.seconds)
+        finally:
+            encoder.shutdown()
+        
+        baseline = baseline or fps
+        label = 'serial' if workers == 1 else f'{workers} workers'
+        print(f"{label:>10}: {fps:6.1f} fps  {size / 1024:8.1f} KiB/frame  {fps / baseline:4.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+File Transfer Benchmark
+Measures file transfer throughput between a Socket.IO server and a loopback
+agent, sending chunks base64 encoded as before and as binary attachments.
+Downloads stream chunks from the agent; uploads send one chunk per request,
+as the agent asks for them.
+
+Usage: python benchmarks/bench_file_transfer.py [--size-mb 64] [--chunk-kb 1024]
+"""
+
+import os
+import sys
+import time
+import base64
+import logging
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socketio
+from werkzeug.serving import make_server
+from app.services.file_transfer import ChunkedFileWriter
+
+def start_server(directory):
+    """Run a Socket.IO server on a free loopback port; returns (server, url, state)."""
+    sio = socketio.Server(async_mode='threading', max_http_buffer_size=64 * 1024 * 1024)
+    state = {'done': threading.Event(), 'lock': threading.Lock(), 'writer': None, 'last_received': False,
+             'source': None, 'chunk_size': 0, 'binary': True}
+    
+    @sio.on('file_download_chunk')
+    def download_chunk(sid, data):
+        with state['lock']:
+            if state['writer'] is None:
+                state['writer'] = ChunkedFileWriter(os.path.join(directory, 'download.bin'), data['file_size'])
+            writer = state['writer']
+        chunk = data['chunk']
+        if isinstance(chunk, str):
+            chunk = base64.b64decode(chunk)
+        if chunk:
+            writer.write(data['offset'], chunk)
+        
+        # Events are handled on concurrent threads, so the last chunk may not be handled last
+        with state['lock']:
+            state['last_received'] = state['last_received'] or data['is_last']
+            if state['last_received'] and writer.is_complete() and not state['done'].is_set():
+                writer.finish()
+                state['done'].set()
+    
+    @sio.on('file_upload_chunk')
+    def upload_chunk(sid, data):
+        offset = data['offset']
+        state['source'].seek(offset)
+        chunk = state['source'].read(state['chunk_size'])
+        if not state['binary']:
+            chunk = base64.b64encode(chunk).decode('utf-8')
+        sio.emit('file_upload_chunk', {'offset': offset, 'chunk': chunk}, to=sid)
+    
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, socketio.WSGIApp(sio), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}", state
+
+def download(client, state, path, chunk_size, binary):
+    """Send a file to the server the way the agent does; returns MB/s."""
+    state.update(writer=None, last_received=False)
+    state['done'].clear()
+    file_size = os.path.getsize(path)
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        offset = 0
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            if not binary:
+                chunk = base64.b64encode(chunk).decode('utf-8')
+            client.emit('file_download_chunk', {'offset': offset, 'chunk': chunk, 'is_last': False,
+                                                'file_size': file_size})
+            offset += chunk_size
+    client.emit('file_download_chunk', {'offset': file_size, 'chunk': b'', 'is_last': True,
+                                        'file_size': file_size})
+    state['done'].wait()
+    return file_size / (time.perf_counter() - start) / 1e6
+
+def upload(client, state, path, chunk_size, binary, directory):
+    """Fetch a file from the server one chunk per request; returns MB/s."""
+    file_size = os.path.getsize(path)
+    finished = threading.Event()
+    state.update(source=open(path, 'rb'), chunk_size=chunk_size, binary=binary)
+    target = open(os.path.join(directory, 'upload.bin'), 'wb')
+    
+    def on_chunk(data):
+        chunk = data['chunk']
+        if isinstance(chunk, str):
+            chunk = base64.b64decode(chunk)
+        target.write(chunk)
+        received = data['offset'] + len(chunk)
+        if received >= file_size:
+            finished.set()
+        else:
+            client.emit('file_upload_chunk', {'offset': received})
+    
+    client.handlers['/']['file_upload_chunk'] = on_chunk
+    start = time.perf_counter()
+    client.emit('file_upload_chunk', {'offset': 0})
+    finished.wait()
+    elapsed = time.perf_counter() - start
+    target.close()
+    state['source'].close()
+    return file_size / elapsed / 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark file transfer chunk framing')
+    parser.add_argument('--size-mb', type=int, default=64, help='Size of the transferred file')
+    parser.add_argument('--chunk-kb', type=int, default=1024, help='Chunk size')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'source.bin')
+        with open(path, 'wb') as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        
+        server, url, state = start_server(directory)
+        client = socketio.Client()
+        client.on('file_upload_chunk', lambda data: None)
+        client.connect(url)
+        print(f"File: {args.size_mb} MB in {args.chunk_kb} KB chunks over loopback")
+        
+        chunk_size = args.chunk_kb * 1024
+        try:
+            for binary in (False, True):
+                framing = 'binary' if binary else 'base64'
+                download_rate = download(client, state, path, chunk_size, binary)
+                upload_rate = upload(client, state, path, chunk_size, binary, directory)
+                print(f"{framing:>7}: download {download_rate:7.1f} MB/s  upload {upload_rate:7.1f} MB/s")
+        finally:
+            client.disconnect()
+            server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -14,7 +14,10 @@ import ssl
 import json
 import time
 import base64
+import hashlib
 import uuid
+import zlib
+import bisect
 import socket
 import logging
 import argparse
@@ -22,6 +25,11 @@ import platform
 import subprocess
 import threading
 import tempfile
+import struct
+import ctypes
+import ctypes.util
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
@@ -30,7 +38,11 @@ import socketio
 import psutil
 import pyautogui
 import PIL.Image
+import PIL.ImageChops
+import PIL.ImageDraw
 import PIL.ImageGrab
+import PIL.features
+import numpy as np
 
 # Configure logging
 logging.basicConfig(level=logging.INFO,
@@ -39,36 +51,1290 @@ logger = logging.getLogger('RemoteClient')
 
 VERSION = "1.0.0"
 
+# Desktop streaming defaults
+STREAM_TILE_SIZE = 64  # Edge length of delta tiles in pixels
+STREAM_KEYFRAME_INTERVAL = 300  # Force a full keyframe after this many delta frames
+STREAM_KEYFRAME_DIRTY_RATIO = 0.5  # Send a keyframe instead when this share of tiles changed
+STREAM_CREDIT_PROBE_INTERVAL = 5  # Seconds without credit before sending a probe frame
+STREAM_QUEUE_SIZE = 2  # Frames buffered between pipeline stages before the oldest is dropped
+STREAM_STATS_INTERVAL = 5  # Seconds between pipeline statistics reports
+STREAM_BAND_MIN_PIXELS = 1920 * 1080  # Keyframes at least this large are encoded in parallel bands
+STREAM_CHANGE_SAMPLE = 4  # Captures are box-downsampled by this factor before hashing
+STREAM_IDLE_AFTER = 2  # Seconds without screen changes before capturing at the idle rate
+STREAM_IDLE_FPS = 1  # Capture rate while the screen is unchanged
+STREAM_KEEPALIVE_INTERVAL = 1  # Seconds between keepalives while captures are skipped
+STREAM_DEFAULT_TIERS = [{'name': 'full', 'max_width': None}]  # Single tier at the captured size
+STREAM_DEFAULT_CODEC = 'jpeg'  # Codec used unless the server picks another
+STREAM_MIXED_CODEC = 'mixed'  # Per-tile choice between lossless PNG and JPEG
+STREAM_PALETTE_MAX_COLORS = 128  # In mixed mode, tiles with at most this many colours are sent lossless
+STREAM_COLOR_MODES = ('full', 'grayscale', 'rgb565', 'palette')  # Colour depth reductions for slow links
+STREAM_DEFAULT_COLOR_MODE = 'full'
+THUMBNAIL_DEFAULT_INTERVAL = 30  # Seconds between fleet overview snapshots
+THUMBNAIL_DEFAULT_WIDTH = 320
+THUMBNAIL_DEFAULT_QUALITY = 50
+
+# Remote input batches: records of type, argument, x, y, with key events
+# followed by their UTF-8 key name (see app/services/input_events.py)
+INPUT_EVENT = struct.Struct('<BBHH')
+INPUT_MOVE, INPUT_BUTTON_DOWN, INPUT_BUTTON_UP, INPUT_SCROLL, INPUT_KEY_DOWN, INPUT_KEY_UP = range(1, 7)
+INPUT_BUTTONS = {1: 'left', 2: 'middle', 3: 'right'}
+INPUT_COORDINATE_MAX = 65535  # Positions are scaled to this across the captured area
+INPUT_REORDER_TIMEOUT = 0.1  # Seconds a batch that overtook an earlier one waits for it
+CURSOR_FPS = 60  # Pointer polls per second while streaming; updates are only sent on change
+AGENT_STATE_DIR = os.path.join(os.path.expanduser('~'), '.remote_agent')  # Manifests of unfinished uploads
+TRANSFER_CHECKPOINT_INTERVAL = 5  # Seconds between upload manifest checkpoints
+CHUNK_LOG_SUFFIX = '.chunks'  # Next to an upload's temporary file: offset, length and hash of each chunk on disk
+DELTA_SEGMENT_SIZE = 1024 * 1024  # Bytes read at a time when checksumming or rebuilding a file for delta sync
+
+class ParallelFrameEncoder:
+    """
+    Encodes regions of a frame concurrently on a thread pool.
+    
+    Pillow releases the GIL while encoding, so bands of a large frame and the
+    dirty tiles of a delta frame are compressed on several cores at once.
+    
+    With the mixed codec every tile is classified by its colour count: UI and
+    text tiles with few colours are sent as lossless palette PNG, which keeps
+    text crisp and is small for flat content, and photographic tiles as JPEG.
+    Each tile then carries its own 'codec'.
+    """
+    
+    def __init__(self, workers=None, codec=STREAM_DEFAULT_CODEC):
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        self.codec = codec
+        self.mixed = codec == STREAM_MIXED_CODEC
+    
+    def encode_tiles(self, image, boxes, quality):
+        """Encode the given (left, top, right, bottom) boxes of an image as tiles, in order."""
+        if self.mixed:
+            regions = self.classify_regions(image, boxes)
+        else:
+            regions = [(box, self.codec) for box in boxes]
+        
+        def encode(region):
+            box, codec = region
+            return STREAM_CODECS[codec](image.crop(box), quality)
+        
+        if self.pool is None or len(regions) < 2:
+            encoded = [encode(region) for region in regions]
+        else:
+            encoded = list(self.pool.map(encode, regions))
+        
+        tiles = []
+        for (box, codec), data in zip(regions, encoded):
+            tile = {'x': box[0], 'y': box[1], 'w': box[2] - box[0], 'h': box[3] - box[1], 'data': data}
+            if self.mixed:
+                tile['codec'] = codec
+            tiles.append(tile)
+        return tiles
+    
+    def classify_regions(self, image, boxes):
+        """
+        Split boxes into tile-sized cells and pick lossless or lossy for each.
+        
+        Horizontally adjacent cells of the same kind are merged back together,
+        so a row of text still goes out as a single tile.
+        """
+        size = STREAM_TILE_SIZE
+        regions = []
+        for left, box_top, right, box_bottom in boxes:
+            for top in range(box_top, box_bottom, size):
+                bottom = min(top + size, box_bottom)
+                run_start, run_codec = left, None
+                for cell_left in range(left, right, size):
+                    cell = (cell_left, top, min(cell_left + size, right), bottom)
+                    few_colors = image.crop(cell).getcolors(STREAM_PALETTE_MAX_COLORS) is not None
+                    codec = 'png' if few_colors else 'jpeg'
+                    if run_codec is not None and codec != run_codec:
+                        regions.append(((run_start, top, cell_left, bottom), run_codec))
+                        run_start = cell_left
+                    run_codec = codec
+                regions.append(((run_start, top, right, bottom), run_codec))
+        return regions
+    
+    def encode_bands(self, image, quality):
+        """Encode a whole frame as horizontal bands, returned as tiles."""
+        return self.encode_tiles(image, self.band_boxes(image.size), quality)
+    
+    def band_boxes(self, size):
+        """Split a frame into one band per worker, on tile boundaries."""
+        width, height = size
+        band_height = -(-height // self.workers)
+        band_height = -(-band_height // STREAM_TILE_SIZE) * STREAM_TILE_SIZE
+        return [(0, top, width, min(top + band_height, height)) for top in range(0, height, band_height)]
+    
+    def encode_keyframe(self, image, quality):
+        """
+        Encode a keyframe, in parallel bands when the frame is large enough.
+        
+        Banded and mixed-codec keyframes carry 'tiles' covering the whole
+        screen instead of a single 'frame'.
+        """
+        frame = {'type': 'key', 'codec': self.codec, 'width': image.width, 'height': image.height}
+        if self.mixed or (self.pool is not None and image.width * image.height >= STREAM_BAND_MIN_PIXELS):
+            frame['tiles'] = self.encode_bands(image, quality)
+        else:
+            frame['frame'] = STREAM_CODECS[self.codec](image, quality)
+        return frame
+    
+    def shutdown(self):
+        """Stop the worker threads."""
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+
+class ColorReducer:
+    """
+    Reduces the colour depth of frames before encoding, for slow links.
+    
+    'grayscale' keeps luma only, 'rgb565' keeps 16-bit colour and 'palette'
+    maps frames onto 256 colours picked from the screen content. The palette
+    is only rebuilt for keyframes, so delta frames map onto the same palette
+    and unchanged tiles still compare equal. Each mode is a single Pillow
+    operation over the whole frame.
+    """
+    
+    # Keep the top 5, 6 and 5 bits of red, green and blue, repeating the
+    # high bits in the low ones so white stays white
+    RGB565_TABLE = ([(value & 0xF8) | (value >> 5) for value in range(256)]
+                    + [(value & 0xFC) | (value >> 6) for value in range(256)]
+                    + [(value & 0xF8) | (value >> 5) for value in range(256)])
+    
+    def __init__(self, mode=STREAM_DEFAULT_COLOR_MODE):
+        self.mode = mode
+        self.palette = None  # 1x1 image holding the current palette
+    
+    def reduce(self, image, keyframe=False):
+        """Reduce an RGB frame; keyframes get a fresh palette."""
+        if self.mode == 'grayscale':
+            return image.convert('L')
+        if self.mode == 'rgb565':
+            return image.point(self.RGB565_TABLE)
+        if self.mode == 'palette':
+            if keyframe or self.palette is None:
+                reduced = image.quantize(256, method=PIL.Image.Quantize.FASTOCTREE)
+                self.palette = PIL.Image.new('P', (1, 1))
+                self.palette.putpalette(reduced.getpalette())
+                return reduced
+            return image.quantize(palette=self.palette, dither=PIL.Image.Dither.NONE)
+        return image
+
+class TileDeltaEncoder:
+    """Encodes desktop frames as the tiles that changed since the previous frame."""
+    
+    def __init__(self, tile_size=STREAM_TILE_SIZE, keyframe_interval=STREAM_KEYFRAME_INTERVAL,
+                 dirty_ratio=STREAM_KEYFRAME_DIRTY_RATIO, encoder=None, reducer=None):
+        self.encoder = encoder or ParallelFrameEncoder(workers=1)
+        self.reducer = reducer or ColorReducer()
+        self.tile_size = tile_size
+        self.keyframe_interval = keyframe_interval
+        self.dirty_ratio = dirty_ratio
+        self.previous = None
+        self.frames_since_keyframe = 0
+        self.keyframe_requested = True
+    
+    def request_keyframe(self):
+        """Make the next encoded frame a full keyframe."""
+        self.keyframe_requested = True
+    
+    def encode(self, image, quality):
+        """
+        Encode a frame against the previous one.
+        
+        Returns a dict describing a keyframe or a delta frame, or None when
+        nothing changed and there is nothing to send.
+        """
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        keyframe = self._needs_keyframe(image)
+        image = self.reducer.reduce(image, keyframe)
+        if keyframe:
+            return self._encode_keyframe(image, quality)
+        
+        dirty_boxes, dirty_count = self._find_dirty_tiles(image)
+        if not dirty_boxes:
+            return None
+        
+        # When most of the screen changed a single JPEG is cheaper than many tiles
+        total_tiles = self._tile_count(image.size)
+        if dirty_count >= total_tiles * self.dirty_ratio:
+            return self._encode_keyframe(image, quality)
+        
+        tiles = self.encoder.encode_tiles(image, dirty_boxes, quality)
+        
+        self.previous = image
+        self.frames_since_keyframe += 1
+        return {
+            'type': 'delta',
+            'codec': self.encoder.codec,
+            'width': image.width,
+            'height': image.height,
+            'tiles': tiles
+        }
+    
+    def _needs_keyframe(self, image):
+        return (self.keyframe_requested
+                or self.previous is None
+                or self.previous.size != image.size
+                or self.frames_since_keyframe >= self.keyframe_interval)
+    
+    def _encode_keyframe(self, image, quality):
+        self.previous = image
+        self.frames_since_keyframe = 0
+        self.keyframe_requested = False
+        return self.encoder.encode_keyframe(image, quality)
+    
+    def _tile_count(self, size):
+        columns = -(-size[0] // self.tile_size)
+        rows = -(-size[1] // self.tile_size)
+        return columns * rows
+    
+    def _find_dirty_tiles(self, image):
+        """Return merged dirty boxes and the number of dirty tiles."""
+        diff = PIL.ImageChops.difference(image, self.previous)
+        changed = diff.getbbox()
+        if changed is None:
+            return [], 0
+        
+        size = self.tile_size
+        width, height = image.size
+        
+        # Only scan tiles that intersect the changed area
+        first_col, first_row = changed[0] // size, changed[1] // size
+        last_col, last_row = (changed[2] - 1) // size, (changed[3] - 1) // size
+        
+        boxes = []
+        dirty_count = 0
+        for row in range(first_row, last_row + 1):
+            top = row * size
+            bottom = min(top + size, height)
+            run_start = None
+            for col in range(first_col, last_col + 2):
+                dirty = False
+                if col <= last_col:
+                    left = col * size
+                    dirty = diff.crop((left, top, min(left + size, width), bottom)).getbbox() is not None
+                
+                if dirty:
+                    dirty_count += 1
+                    if run_start is None:
+                        run_start = col * size
+                elif run_start is not None:
+                    # Merge horizontally adjacent dirty tiles into one rectangle
+                    boxes.append((run_start, top, min(col * size, width), bottom))
+                    run_start = None
+        
+        return boxes, dirty_count
+
+class ScreenChangeDetector:
+    """
+    Tells whether a capture differs from the previous one.
+    
+    Hashes a box-downsampled copy of the capture, which takes a few
+    milliseconds for a 1080p screen against tens for an encode, and still
+    catches changes as small as a blinking text cursor.
+    """
+    
+    def __init__(self, sample=STREAM_CHANGE_SAMPLE):
+        self.sample = sample
+        self.signature = None
+        self.last_change = time.monotonic()
+    
+    def changed(self, image):
+        """Check a capture and remember it for the next comparison."""
+        sample = image.reduce(self.sample) if min(image.size) >= self.sample else image
+        signature = (image.size, zlib.crc32(sample.tobytes()))
+        if signature == self.signature:
+            return False
+        
+        self.signature = signature
+        self.last_change = time.monotonic()
+        return True
+    
+    def reset(self):
+        """Treat the next capture as changed, e.g. when a keyframe is needed."""
+        self.signature = None
+        self.last_change = time.monotonic()
+    
+    def activity(self):
+        """Note something likely to change the screen soon, such as remote input, ending idle capture."""
+        self.last_change = time.monotonic()
+    
+    def idle_for(self):
+        """Seconds since the screen last changed."""
+        return time.monotonic() - self.last_change
+
+class FrameScaler:
+    """
+    Downscales captured frames for the stream settings and resolution tiers.
+    
+    Target sizes are worked out once per source size and reused, exact
+    integer factors use Image.reduce (box averaging, much cheaper than a
+    filter), and each smaller tier is derived from the next larger one rather
+    than from the full capture.
+    """
+    
+    def __init__(self):
+        self.sizes = {}  # (source size, scale, max_width) -> target size
+    
+    def target_size(self, size, scale=1.0, max_width=None):
+        """Size of a frame scaled by scale, then capped at max_width."""
+        key = (size, scale, max_width)
+        if key not in self.sizes:
+            width, height = size
+            factor = min(scale, 1.0)
+            if max_width and width * factor > max_width:
+                factor = max_width / width
+            self.sizes[key] = (max(1, int(width * factor)), max(1, int(height * factor)))
+        return self.sizes[key]
+    
+    def resize(self, image, size):
+        """Resize an image to size, using the cheapest resampling that applies."""
+        if image.size == size:
+            return image
+        
+        factor = image.width // size[0]
+        if factor > 1 and image.width == size[0] * factor and image.height == size[1] * factor:
+            return image.reduce(factor)
+        return image.resize(size, PIL.Image.BILINEAR, reducing_gap=2.0)
+    
+    def scale_tiers(self, image, scale, tiers):
+        """Yield (tier name, image) for each tier, largest first."""
+        image = self.resize(image, self.target_size(image.size, scale))
+        for tier in tiers:
+            image = self.resize(image, self.target_size(image.size, max_width=tier.get('max_width')))
+            yield tier['name'], image
+
+def encode_jpeg(image, quality):
+    """Encode an image as JPEG bytes."""
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+def encode_webp(image, quality):
+    """Encode an image as lossy WebP bytes, using the fastest method."""
+    buffer = io.BytesIO()
+    image.save(buffer, format='WEBP', quality=quality, method=0)
+    return buffer.getvalue()
+
+def encode_png(image, quality):
+    """
+    Encode an image as PNG bytes; lossless, so quality is ignored.
+    
+    Images with at most 256 colours are stored as palette PNG, which is
+    exact and much smaller than RGB.
+    """
+    colors = image.getcolors(256) if image.mode == 'RGB' else None
+    if colors:
+        image = image.quantize(colors=len(colors))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+def encode_zlib(image, quality):
+    """Compress the raw RGB pixels of an image with zlib; lossless, so quality is ignored."""
+    return zlib.compress(image.tobytes(), 1)
+
+# Frame codecs by the name negotiated with the server
+STREAM_CODECS = {
+    'jpeg': encode_jpeg,
+    'webp': encode_webp,
+    'png': encode_png,
+    'zlib': encode_zlib
+}
+
+def available_codecs():
+    """Codecs this Pillow build can encode."""
+    codecs = [name for name in STREAM_CODECS
+              if name != 'webp' or PIL.features.check('webp')]
+    return codecs + [STREAM_MIXED_CODEC]
+
+def encoded_size(frame):
+    """Bytes of image data in an encoded frame."""
+    if 'frame' in frame:
+        return len(frame['frame'])
+    return sum(len(tile['data']) for tile in frame.get('tiles', []))
+
+def measure_codec_costs(quality=75):
+    """
+    Measure each available codec on a small desktop-like sample.
+    
+    Returns encode time in milliseconds and output size in bytes, both per
+    megapixel, so the server can pick the cheapest codec for a session.
+    """
+    sample = PIL.Image.new('RGB', (512, 256), (32, 40, 56))
+    draw = PIL.ImageDraw.Draw(sample)
+    for x in range(256, 512):
+        draw.line((x, 0, x, 256), fill=(x - 256, 128, 511 - x))
+    draw.rectangle((8, 8, 248, 248), fill=(240, 240, 240))
+    for line in range(11):
+        draw.text((14, 14 + line * 21), f"{line:02d} drwxr-xr-x config.yaml", fill=(20, 20, 20))
+    
+    megapixels = sample.width * sample.height / 1e6
+    costs = {}
+    for name in available_codecs():
+        encoder = ParallelFrameEncoder(workers=1, codec=name)
+        try:
+            # Best of a few runs, so one-off setup costs don't count
+            elapsed = None
+            for _ in range(3):
+                start = time.perf_counter()
+                size = encoded_size(encoder.encode_keyframe(sample, quality))
+                run = time.perf_counter() - start
+                elapsed = run if elapsed is None else min(elapsed, run)
+        except Exception as e:
+            logger.warning(f"Codec {name} not usable: {e}")
+            continue
+        costs[name] = {
+            'encode_ms': round(elapsed * 1000 / megapixels, 2),
+            'bytes': int(size / megapixels)
+        }
+    return costs
+
+def frame_to_base64(frame):
+    """Convert the binary image data of an encoded frame to base64 strings."""
+    for tier_frame in frame.get('tiers', []):
+        frame_to_base64(tier_frame)
+    if 'frame' in frame:
+        frame['frame'] = base64.b64encode(frame['frame']).decode('utf-8')
+    for tile in frame.get('tiles', []):
+        tile['data'] = base64.b64encode(tile['data']).decode('utf-8')
+    return frame
+
+class DropOldestQueue:
+    """Bounded queue between pipeline stages that discards the oldest item when full."""
+    
+    def __init__(self, maxsize=STREAM_QUEUE_SIZE, on_drop=None):
+        self.items = deque()
+        self.maxsize = maxsize
+        self.on_drop = on_drop
+        self.dropped = 0
+        self.closed = False
+        self.condition = threading.Condition()
+    
+    def put(self, item):
+        """Add an item, dropping the oldest one if the queue is full."""
+        dropped = None
+        with self.condition:
+            if len(self.items) >= self.maxsize:
+                dropped = self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+        
+        if dropped is not None and self.on_drop:
+            self.on_drop(dropped)
+    
+    def get(self, timeout=None):
+        """Take the oldest item, or return None on timeout or once closed."""
+        with self.condition:
+            if not self.items and not self.closed:
+                self.condition.wait(timeout)
+            if self.items:
+                return self.items.popleft()
+            return None
+    
+    def close(self):
+        """Wake up any waiting consumer; the queue returns None from now on."""
+        with self.condition:
+            self.closed = True
+            self.items.clear()
+            self.condition.notify_all()
+
+class FrameClock:
+    """Paces frames on a fixed schedule so the frame rate doesn't drift."""
+    
+    def __init__(self, fps):
+        self.interval = 1 / fps
+        self.next_tick = None
+    
+    def set_fps(self, fps):
+        """Change the frame rate from the next tick on."""
+        self.interval = 1 / fps
+    
+    def wait(self):
+        """Sleep until the next tick is due."""
+        now = time.monotonic()
+        if self.next_tick is None:
+            self.next_tick = now
+        
+        delay = self.next_tick - now
+        if delay > 0:
+            time.sleep(delay)
+        
+        # Ticks are scheduled from the previous deadline rather than from when
+        # work finished; after a stall resync instead of bursting to catch up
+        self.next_tick += self.interval
+        if self.next_tick < time.monotonic() - self.interval:
+            self.next_tick = time.monotonic() + self.interval
+
+class StageTimings:
+    """Rolling timing statistics for the stages of the streaming pipeline."""
+    
+    def __init__(self, window=100):
+        self.window = window
+        self.samples = {}
+        self.lock = threading.Lock()
+    
+    def record(self, stage, seconds):
+        """Record how long one run of a stage took."""
+        with self.lock:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.window)
+            self.samples[stage].append(seconds)
+    
+    def snapshot(self):
+        """Average and maximum time per stage in milliseconds."""
+        with self.lock:
+            return {
+                stage: {
+                    'avg_ms': round(sum(samples) / len(samples) * 1000, 2),
+                    'max_ms': round(max(samples) * 1000, 2)
+                }
+                for stage, samples in self.samples.items() if samples
+            }
+
+class CaptureBackend:
+    """
+    Grabs the screen, or a (left, top, right, bottom) region of it, as an RGB image.
+    
+    Grabs never include the mouse pointer; it is sent separately as cursor
+    updates (see CursorSource), so moving it doesn't change the frames.
+    """
+    
+    name = None
+    
+    def grab(self, bbox=None):
+        raise NotImplementedError
+    
+    def monitors(self):
+        """Monitors as {'left', 'top', 'width', 'height'} dicts, primary first."""
+        raise NotImplementedError
+    
+    def close(self):
+        """Release any resources held by the backend."""
+
+class PILCaptureBackend(CaptureBackend):
+    """Portable capture through PIL.ImageGrab; a fresh image and, on X11, an XGetImage round trip per grab."""
+    
+    name = 'pil'
+    
+    def __init__(self):
+        self.size = None
+    
+    def grab(self, bbox=None):
+        image = PIL.ImageGrab.grab(bbox=bbox) if bbox else PIL.ImageGrab.grab()
+        if bbox is None:
+            self.size = image.size
+        return image.convert('RGB') if image.mode != 'RGB' else image
+    
+    def monitors(self):
+        # ImageGrab can't enumerate monitors, so the whole desktop counts as one
+        if self.size is None:
+            self.grab()
+        return [{'left': 0, 'top': 0, 'width': self.size[0], 'height': self.size[1]}]
+
+class _XImage(ctypes.Structure):
+    # Leading fields of Xlib's XImage; the function table that follows isn't needed
+    _fields_ = [
+        ('width', ctypes.c_int),
+        ('height', ctypes.c_int),
+        ('xoffset', ctypes.c_int),
+        ('format', ctypes.c_int),
+        ('data', ctypes.c_void_p),
+        ('byte_order', ctypes.c_int),
+        ('bitmap_unit', ctypes.c_int),
+        ('bitmap_bit_order', ctypes.c_int),
+        ('bitmap_pad', ctypes.c_int),
+        ('depth', ctypes.c_int),
+        ('bytes_per_line', ctypes.c_int),
+        ('bits_per_pixel', ctypes.c_int),
+        ('red_mask', ctypes.c_ulong),
+        ('green_mask', ctypes.c_ulong),
+        ('blue_mask', ctypes.c_ulong)
+    ]
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ('shmseg', ctypes.c_ulong),
+        ('shmid', ctypes.c_int),
+        ('shmaddr', ctypes.c_void_p),
+        ('readOnly', ctypes.c_int)
+    ]
+
+class _XRRMonitorInfo(ctypes.Structure):
+    _fields_ = [
+        ('name', ctypes.c_ulong),
+        ('primary', ctypes.c_int),
+        ('automatic', ctypes.c_int),
+        ('noutput', ctypes.c_int),
+        ('x', ctypes.c_int),
+        ('y', ctypes.c_int),
+        ('width', ctypes.c_int),
+        ('height', ctypes.c_int),
+        ('mwidth', ctypes.c_int),
+        ('mheight', ctypes.c_int),
+        ('outputs', ctypes.c_void_p)
+    ]
+
+@ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+def _x_error_handler(display, event):
+    logger.debug("X error during screen capture")
+    return 0
+
+class XShmCaptureBackend(CaptureBackend):
+    """
+    X11 capture through the MIT-SHM extension.
+    
+    The X server copies pixels straight into a shared memory segment, so a
+    grab costs one short request instead of streaming the whole image over
+    the X connection. Segments are kept per capture size and reused across
+    frames; only the conversion to an RGB image allocates.
+    """
+    
+    name = 'xshm'
+    
+    ZPIXMAP = 2
+    LSB_FIRST = 0
+    IPC_PRIVATE = 0
+    IPC_CREAT = 0o1000
+    IPC_RMID = 0
+    MAX_SEGMENTS = 4  # Capture sizes whose segments are kept around
+    
+    def __init__(self, display=None):
+        self.x11 = ctypes.CDLL(ctypes.util.find_library('X11') or 'libX11.so.6')
+        self.xext = ctypes.CDLL(ctypes.util.find_library('Xext') or 'libXext.so.6')
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._declare_functions()
+        
+        self.x11.XInitThreads()
+        self.display = self.x11.XOpenDisplay(display.encode() if display else None)
+        if not self.display:
+            raise RuntimeError("Cannot open X display")
+        
+        # Xlib's default handler exits the process on any X error
+        self.x11.XSetErrorHandler(_x_error_handler)
+        
+        if not self.xext.XShmQueryExtension(self.display):
+            self.x11.XCloseDisplay(self.display)
+            raise RuntimeError("X server has no MIT-SHM extension")
+        
+        self.root = self.x11.XDefaultRootWindow(self.display)
+        screen = self.x11.XDefaultScreen(self.display)
+        self.visual = self.x11.XDefaultVisual(self.display, screen)
+        self.depth = self.x11.XDefaultDepth(self.display, screen)
+        self.segments = OrderedDict()  # (width, height) -> (XImage pointer, segment info)
+        self.lock = threading.Lock()
+    
+    def _declare_functions(self):
+        x11, xext, libc = self.x11, self.xext, self.libc
+        x11.XOpenDisplay.restype = ctypes.c_void_p
+        x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        x11.XSetErrorHandler.restype = ctypes.c_void_p
+        x11.XDefaultRootWindow.restype = ctypes.c_ulong
+        x11.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        x11.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x11.XDefaultVisual.restype = ctypes.c_void_p
+        x11.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XGetGeometry.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(ctypes.c_ulong),
+                                     ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int),
+                                     ctypes.POINTER(ctypes.c_uint), ctypes.POINTER(ctypes.c_uint),
+                                     ctypes.POINTER(ctypes.c_uint), ctypes.POINTER(ctypes.c_uint)]
+        x11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x11.XDestroyImage.argtypes = [ctypes.POINTER(_XImage)]
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+        xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+                                         ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo),
+                                         ctypes.c_uint, ctypes.c_uint]
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XImage),
+                                      ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+    
+    def screen_size(self):
+        """Size of the root window, which spans all monitors."""
+        root = ctypes.c_ulong()
+        x, y = ctypes.c_int(), ctypes.c_int()
+        width, height, border, depth = ctypes.c_uint(), ctypes.c_uint(), ctypes.c_uint(), ctypes.c_uint()
+        self.x11.XGetGeometry(self.display, self.root, ctypes.byref(root), ctypes.byref(x), ctypes.byref(y),
+                              ctypes.byref(width), ctypes.byref(height), ctypes.byref(border), ctypes.byref(depth))
+        return width.value, height.value
+    
+    def grab(self, bbox=None):
+        with self.lock:
+            if not self.display:
+                raise RuntimeError("Capture backend is closed")
+            screen_width, screen_height = self.screen_size()
+            left, top, right, bottom = bbox or (0, 0, screen_width, screen_height)
+            
+            # Regions partly off screen would fail with BadMatch
+            left, top = max(0, left), max(0, top)
+            right, bottom = min(right, screen_width), min(bottom, screen_height)
+            if right <= left or bottom <= top:
+                raise ValueError(f"Capture region {bbox} is outside the screen")
+            
+            ximage = self._segment(right - left, bottom - top)
+            if not self.xext.XShmGetImage(self.display, self.root, ximage, left, top, ctypes.c_ulong(-1).value):
+                raise RuntimeError("XShmGetImage failed")
+            
+            image = ximage.contents
+            raw_mode = 'BGRX' if image.byte_order == self.LSB_FIRST else 'XRGB'
+            buffer = (ctypes.c_char * (image.bytes_per_line * image.height)).from_address(image.data)
+            # The segment is reused by the next grab, so the pixels are copied out
+            return PIL.Image.frombuffer('RGB', (image.width, image.height), buffer,
+                                        'raw', raw_mode, image.bytes_per_line, 1)
+    
+    def _segment(self, width, height):
+        """Shared memory image for a capture size, created on first use."""
+        key = (width, height)
+        if key in self.segments:
+            self.segments.move_to_end(key)
+            return self.segments[key][0]
+        
+        info = _XShmSegmentInfo()
+        ximage = self.xext.XShmCreateImage(self.display, self.visual, self.depth, self.ZPIXMAP,
+                                           None, ctypes.byref(info), width, height)
+        if not ximage:
+            raise RuntimeError("XShmCreateImage failed")
+        bits_per_pixel = ximage.contents.bits_per_pixel
+        if bits_per_pixel != 32:
+            self.x11.XDestroyImage(ximage)
+            raise RuntimeError(f"Unsupported pixel format: {bits_per_pixel} bits per pixel")
+        
+        size = ximage.contents.bytes_per_line * height
+        info.shmid = self.libc.shmget(self.IPC_PRIVATE, size, self.IPC_CREAT | 0o600)
+        if info.shmid < 0:
+            self.x11.XDestroyImage(ximage)
+            raise OSError(ctypes.get_errno(), "shmget failed")
+        
+        info.shmaddr = self.libc.shmat(info.shmid, None, 0)
+        # Mark the segment for removal now, so it goes away with the process
+        self.libc.shmctl(info.shmid, self.IPC_RMID, None)
+        if info.shmaddr in (None, ctypes.c_void_p(-1).value):
+            self.x11.XDestroyImage(ximage)
+            raise OSError(ctypes.get_errno(), "shmat failed")
+        
+        ximage.contents.data = info.shmaddr
+        info.readOnly = 0
+        if not self.xext.XShmAttach(self.display, ctypes.byref(info)):
+            self.libc.shmdt(info.shmaddr)
+            self.x11.XDestroyImage(ximage)
+            raise RuntimeError("XShmAttach failed")
+        self.x11.XSync(self.display, 0)
+        
+        self.segments[key] = (ximage, info)
+        while len(self.segments) > self.MAX_SEGMENTS:
+            self._release(*self.segments.popitem(last=False)[1])
+        return ximage
+    
+    def _release(self, ximage, info):
+        self.xext.XShmDetach(self.display, ctypes.byref(info))
+        self.x11.XSync(self.display, 0)
+        # The image's destroy hook leaves the shared data alone
+        self.x11.XDestroyImage(ximage)
+        self.libc.shmdt(info.shmaddr)
+    
+    def monitors(self):
+        width, height = self.screen_size()
+        whole = [{'left': 0, 'top': 0, 'width': width, 'height': height}]
+        
+        # XRandR is optional; without it the whole root window is one monitor
+        path = ctypes.util.find_library('Xrandr')
+        if not path:
+            return whole
+        
+        xrandr = ctypes.CDLL(path)
+        xrandr.XRRGetMonitors.restype = ctypes.POINTER(_XRRMonitorInfo)
+        xrandr.XRRGetMonitors.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int,
+                                          ctypes.POINTER(ctypes.c_int)]
+        xrandr.XRRFreeMonitors.argtypes = [ctypes.POINTER(_XRRMonitorInfo)]
+        
+        with self.lock:
+            count = ctypes.c_int()
+            info = xrandr.XRRGetMonitors(self.display, self.root, 1, ctypes.byref(count))
+            if not info:
+                return whole
+            try:
+                monitors = sorted(
+                    (info[i] for i in range(count.value)),
+                    key=lambda monitor: not monitor.primary)
+                return [{'left': monitor.x, 'top': monitor.y, 'width': monitor.width, 'height': monitor.height}
+                        for monitor in monitors] or whole
+            finally:
+                xrandr.XRRFreeMonitors(info)
+    
+    def close(self):
+        with self.lock:
+            while self.segments:
+                self._release(*self.segments.popitem()[1])
+            if self.display:
+                self.x11.XCloseDisplay(self.display)
+                self.display = None
+
+def create_capture_backend(preferred='auto'):
+    """
+    Create the fastest capture backend that works here.
+    
+    'auto' tries MIT-SHM on X11 and falls back to PIL; 'xshm' or 'pil' force
+    a backend.
+    """
+    if preferred in ('auto', 'xshm') and sys.platform.startswith('linux') and os.environ.get('DISPLAY'):
+        backend = None
+        try:
+            backend = XShmCaptureBackend()
+            backend.grab((0, 0, 1, 1))
+            return backend
+        except Exception as e:
+            if backend:
+                backend.close()
+            if preferred == 'xshm':
+                raise
+            logger.info(f"MIT-SHM capture unavailable ({e}), using PIL")
+    elif preferred == 'xshm':
+        raise RuntimeError("MIT-SHM capture needs an X11 display")
+    return PILCaptureBackend()
+
+def decode_input_events(data):
+    """Decode a binary input batch into (type, argument, x, y, key) tuples."""
+    events = []
+    offset = 0
+    while offset + INPUT_EVENT.size <= len(data):
+        kind, argument, x, y = INPUT_EVENT.unpack_from(data, offset)
+        offset += INPUT_EVENT.size
+        key = None
+        if kind in (INPUT_KEY_DOWN, INPUT_KEY_UP):
+            key = data[offset:offset + argument].decode('utf-8')
+            offset += argument
+        events.append((kind, argument, x, y, key))
+    return events
+
+def coalesce_pointer_moves(events):
+    """Drop pointer moves that are followed straight away by another move."""
+    return [event for event, following in zip(events, events[1:] + [None])
+            if not (event[0] == INPUT_MOVE and following is not None and following[0] == INPUT_MOVE)]
+
+class InputDispatcher:
+    """
+    Applies remote mouse and keyboard input on a dedicated thread.
+    
+    Batches are only queued by the socket handler, so input never waits for
+    other work. Whatever has queued up by the time the thread gets to it is
+    applied in one go with consecutive pointer moves coalesced to the last
+    position, so a backlog never replays stale motion. Positions are mapped
+    onto the area returned by area(), the region being streamed.
+    
+    Socket.IO handlers run on threads of their own, so batches can be
+    submitted out of order. They are applied in seq order: a batch that
+    overtook an earlier one is held back until that one arrives or
+    INPUT_REORDER_TIMEOUT passes, and batches older than the last applied
+    are dropped, so a button or key is never released before it is pressed.
+    """
+    
+    def __init__(self, area):
+        self.area = area
+        self.batches = deque()
+        self.condition = threading.Condition()
+        self.applied_seq = 0  # Last batch applied, for input-to-frame latency
+        self.held_back = {}  # seq -> data of batches waiting for an earlier one; only touched by the thread
+        self.held_back_since = None
+        self.held_keys = set()
+        self.held_buttons = set()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def submit(self, seq, data):
+        """Queue a batch received from the server."""
+        with self.condition:
+            self.batches.append((seq, data))
+            self.condition.notify()
+    
+    def release_all(self):
+        """Release any keys and buttons still held, e.g. when the viewer goes away."""
+        self.submit(None, None)
+    
+    def restart(self):
+        """Release everything and expect batches numbered from 1 again, for a new streaming session."""
+        with self.condition:
+            self.applied_seq = 0
+        self.submit(0, None)
+    
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.batches:
+                    if not self.held_back:
+                        self.condition.wait()
+                        continue
+                    remaining = self.held_back_since + INPUT_REORDER_TIMEOUT - time.monotonic()
+                    if remaining <= 0 or not self.condition.wait(remaining):
+                        break
+                batches = list(self.batches)
+                self.batches.clear()
+            
+            batches, last = self._in_order(batches, timed_out=not batches)
+            events = []
+            for seq, data in batches:
+                if data is None:
+                    self._apply_all(coalesce_pointer_moves(events))
+                    events = []
+                    self._release_held()
+                    continue
+                try:
+                    events.extend(decode_input_events(data))
+                except ValueError as e:
+                    logger.warning(f"Ignoring malformed input batch {seq}: {e}")
+            self._apply_all(coalesce_pointer_moves(events))
+            self.applied_seq = last
+    
+    def _in_order(self, batches, timed_out):
+        """
+        Put newly submitted batches in seq order behind those held back;
+        returns the batches to apply now and the seq of the last one.
+        
+        Release markers (data None) flush everything held back first; a
+        marker with seq 0 also restarts the numbering.
+        """
+        last = self.applied_seq
+        ordered = []
+        for seq, data in batches:
+            if data is None:
+                for held in sorted(self.held_back):
+                    ordered.append((held, self.held_back.pop(held)))
+                    last = held
+                ordered.append((seq, data))
+                if seq == 0:
+                    last = 0
+            elif seq is None:
+                ordered.append((seq, data))
+            elif seq > last:
+                self.held_back[seq] = data
+            else:
+                logger.debug(f"Dropping input batch {seq}, batch {last} was already applied")
+        
+        if timed_out and self.held_back:
+            logger.warning(f"Input batch {last + 1} never arrived, skipping to {min(self.held_back)}")
+            last = min(self.held_back) - 1
+        while last + 1 in self.held_back:
+            last += 1
+            ordered.append((last, self.held_back.pop(last)))
+        
+        if self.held_back and (last != self.applied_seq or self.held_back_since is None):
+            self.held_back_since = time.monotonic()
+        elif not self.held_back:
+            self.held_back_since = None
+        return ordered, last
+    
+    def _apply_all(self, events):
+        if not events:
+            return
+        
+        left, top, right, bottom = self.area()
+        for kind, argument, x, y, key in events:
+            try:
+                self._apply(kind, argument, key,
+                            left + x * (right - left - 1) // INPUT_COORDINATE_MAX,
+                            top + y * (bottom - top - 1) // INPUT_COORDINATE_MAX)
+            except Exception as e:
+                logger.error(f"Error applying remote input: {e}")
+    
+    def _apply(self, kind, argument, key, x, y):
+        # _pause=False skips pyautogui's default 0.1s sleep after every call
+        if kind == INPUT_MOVE:
+            pyautogui.moveTo(x, y, _pause=False)
+        elif kind in (INPUT_BUTTON_DOWN, INPUT_BUTTON_UP):
+            button = INPUT_BUTTONS.get(argument, 'left')
+            if kind == INPUT_BUTTON_DOWN:
+                pyautogui.mouseDown(x, y, button=button, _pause=False)
+                self.held_buttons.add(button)
+            else:
+                pyautogui.mouseUp(x, y, button=button, _pause=False)
+                self.held_buttons.discard(button)
+        elif kind == INPUT_SCROLL:
+            pyautogui.scroll(argument - 256 if argument > 127 else argument, x, y, _pause=False)
+        elif kind == INPUT_KEY_DOWN:
+            pyautogui.keyDown(key, _pause=False)
+            self.held_keys.add(key)
+        elif kind == INPUT_KEY_UP:
+            pyautogui.keyUp(key, _pause=False)
+            self.held_keys.discard(key)
+    
+    def _release_held(self):
+        for key in list(self.held_keys):
+            pyautogui.keyUp(key, _pause=False)
+        for button in list(self.held_buttons):
+            pyautogui.mouseUp(button=button, _pause=False)
+        self.held_keys.clear()
+        self.held_buttons.clear()
+
+class _XFixesCursorImage(ctypes.Structure):
+    _fields_ = [
+        ('x', ctypes.c_short),
+        ('y', ctypes.c_short),
+        ('width', ctypes.c_ushort),
+        ('height', ctypes.c_ushort),
+        ('xhot', ctypes.c_ushort),
+        ('yhot', ctypes.c_ushort),
+        ('cursor_serial', ctypes.c_ulong),
+        ('pixels', ctypes.POINTER(ctypes.c_ulong)),
+        ('atom', ctypes.c_ulong),
+        ('name', ctypes.c_char_p)
+    ]
+
+class CursorSource:
+    """Reads the pointer position, and its shape where the platform allows."""
+    
+    name = 'pointer'
+    
+    def read(self):
+        """
+        Return the pointer's desktop position and shape as (x, y, shape).
+        
+        shape is an (RGBA image, hotspot) pair, or None when unknown. The
+        same object is returned for as long as the shape doesn't change.
+        """
+        x, y = pyautogui.position()
+        return x, y, None
+    
+    def close(self):
+        """Release any resources held by the source."""
+
+class XFixesCursorSource(CursorSource):
+    """X11 pointer position and shape through the XFixes extension, both in one request."""
+    
+    name = 'xfixes'
+    
+    def __init__(self, display=None):
+        self.x11 = ctypes.CDLL(ctypes.util.find_library('X11') or 'libX11.so.6')
+        self.xfixes = ctypes.CDLL(ctypes.util.find_library('Xfixes') or 'libXfixes.so.3')
+        self.x11.XOpenDisplay.restype = ctypes.c_void_p
+        self.x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        self.x11.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        self.x11.XFree.argtypes = [ctypes.c_void_p]
+        self.xfixes.XFixesQueryExtension.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_int),
+                                                     ctypes.POINTER(ctypes.c_int)]
+        self.xfixes.XFixesGetCursorImage.restype = ctypes.POINTER(_XFixesCursorImage)
+        self.xfixes.XFixesGetCursorImage.argtypes = [ctypes.c_void_p]
+        
+        # A connection of its own, used only from the cursor thread
+        self.x11.XInitThreads()
+        self.display = self.x11.XOpenDisplay(display.encode() if display else None)
+        if not self.display:
+            raise RuntimeError("Cannot open X display")
+        self.x11.XSetErrorHandler(_x_error_handler)
+        
+        event_base, error_base = ctypes.c_int(), ctypes.c_int()
+        if not self.xfixes.XFixesQueryExtension(self.display, ctypes.byref(event_base), ctypes.byref(error_base)):
+            self.x11.XCloseDisplay(self.display)
+            raise RuntimeError("X server has no XFixes extension")
+        
+        self.serial = None
+        self.shape = None
+    
+    def read(self):
+        cursor = self.xfixes.XFixesGetCursorImage(self.display)
+        if not cursor:
+            raise RuntimeError("Cannot read the cursor image")
+        
+        try:
+            image = cursor.contents
+            # Pixels are only converted when the cursor changes
+            if image.cursor_serial != self.serial:
+                self.serial = image.cursor_serial
+                self.shape = (self._to_image(image), (image.xhot, image.yhot))
+            return image.x, image.y, self.shape
+        finally:
+            self.x11.XFree(cursor)
+    
+    @staticmethod
+    def _to_image(image):
+        # Each pixel is premultiplied ARGB in the low 32 bits of an unsigned long
+        step = ctypes.sizeof(ctypes.c_ulong)
+        raw = ctypes.string_at(image.pixels, image.width * image.height * step)
+        rgba = bytearray(image.width * image.height * 4)
+        rgba[0::4] = raw[2::step]
+        rgba[1::4] = raw[1::step]
+        rgba[2::4] = raw[0::step]
+        rgba[3::4] = raw[3::step]
+        return PIL.Image.frombytes('RGBa', (image.width, image.height), bytes(rgba)).convert('RGBA')
+    
+    def close(self):
+        if self.display:
+            self.x11.XCloseDisplay(self.display)
+            self.display = None
+
+def create_cursor_source():
+    """Create a cursor source that reports the pointer's shape where possible, else only its position."""
+    if sys.platform.startswith('linux') and os.environ.get('DISPLAY'):
+        try:
+            return XFixesCursorSource()
+        except Exception as e:
+            logger.info(f"XFixes cursor shapes unavailable ({e}), sending the position only")
+    return CursorSource()
+
+class RangeSet:
+    """
+    Set of byte ranges, kept as sorted, merged [start, end) pairs
+    (see app/services/file_transfer.py).
+    """
+    
+    def __init__(self, ranges=()):
+        self.starts = []
+        self.ends = []
+        for start, end in ranges:
+            self.add(start, end)
+    
+    def add(self, start, end):
+        """Add [start, end), merging it with any ranges it touches."""
+        if end <= start:
+            return
+        first = bisect.bisect_left(self.ends, start)
+        last = bisect.bisect_right(self.starts, end)
+        if first < last:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last - 1])
+        self.starts[first:last] = [start]
+        self.ends[first:last] = [end]
+    
+    def covers(self, start, end):
+        """Whether [start, end) is entirely in the set."""
+        if end <= start:
+            return True
+        index = bisect.bisect_right(self.starts, start) - 1
+        return index >= 0 and self.ends[index] >= end
+    
+    def total(self):
+        """Number of bytes in the set."""
+        return sum(end - start for start, end in zip(self.starts, self.ends))
+    
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends))
+
+def chunk_hash(data):
+    """Hash identifying the content of a chunk in transfer manifests (see app/services/file_transfer.py)."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def read_chunk_log(path):
+    """The (offset, length, hash) entries of a chunk log, oldest first (see app/services/file_transfer.py)."""
+    with open(path) as f:
+        for line in f:
+            try:
+                offset, length, digest = line.split()
+                yield int(offset), int(length), digest
+            except ValueError:
+                continue
+
+def stale_chunks(f, chunks, chunk_size):
+    """Offsets of the manifest's chunks whose content in the open file f no longer matches."""
+    stale = []
+    for offset, expected in sorted(chunks.items()):
+        f.seek(offset)
+        if chunk_hash(f.read(chunk_size)) != expected:
+            stale.append(offset)
+    return stale
+
+def block_checksums(data, block_size):
+    """rsync rolling checksums of each whole block of data (see app/services/delta_sync.py)."""
+    count = len(data) // block_size
+    rows = np.frombuffer(data, dtype=np.uint8, count=count * block_size).reshape(count, block_size)
+    a = rows.sum(axis=1, dtype=np.int64)
+    b = rows @ np.arange(block_size, 0, -1, dtype=np.int64)
+    weak = b.astype(np.uint32)
+    weak <<= np.uint32(16)
+    weak |= a.astype(np.uint16)
+    return weak
+
+def file_signatures(f, block_size):
+    """The rolling (little-endian uint32) and strong checksums of an open file's whole blocks, for delta sync."""
+    weak = []
+    strong = []
+    segment = max(DELTA_SEGMENT_SIZE // block_size, 1) * block_size
+    while True:
+        data = f.read(segment)
+        weak.append(block_checksums(data, block_size))
+        for offset in range(0, len(data) - block_size + 1, block_size):
+            strong.append(hashlib.blake2b(data[offset:offset + block_size], digest_size=16).digest())
+        if len(data) < segment:
+            break
+    return np.concatenate(weak).astype('<u4').tobytes(), b''.join(strong)
+
 class RemoteClient:
     """Client agent for remote access and management."""
     
-    def __init__(self, server_url, client_id=None, verify_ssl=True):
+    def __init__(self, server_url, client_id=None, verify_ssl=True, encode_workers=None, capture_backend='auto',
+                 state_dir=None):
         self.server_url = server_url
         self.client_id = client_id or str(uuid.uuid4())
         self.verify_ssl = verify_ssl
+        self.encode_workers = encode_workers
+        self.capture_preference = capture_backend
+        self.capture = None
         self.socket = None
         self.connected = False
         self.streaming = False
         self.stream_thread = None
-        self.file_transfers = {}
+        self.stream_encoders = {}  # Tier name -> TileDeltaEncoder
+        self.frame_encoder = None
+        self.frame_scaler = FrameScaler()
+        self.change_detector = ScreenChangeDetector()
+        self.stream_settings = {}
+        self.stream_tiers = STREAM_DEFAULT_TIERS
+        self.stream_region = None  # Capture bbox, or None for the whole desktop
+        self.stream_timings = None
+        self.stream_seq = 0
+        self.stream_frames_sent = 0
+        self.stream_stats_since = 0
+        self.stream_credit = threading.Condition()
+        self.stream_credits = None  # None when the server doesn't use flow control
+        self.thumbnail_thread = None
+        self.thumbnail_stop = threading.Event()
+        self.input = None
+        self.stream_input_seq = 0  # Last input batch a frame was sent for
+        self.cursor = None
+        self.cursor_thread = None
+        self.transfer_dir = os.path.join(state_dir or AGENT_STATE_DIR, 'transfers')
+        self.file_transfers = self._load_upload_manifests()  # Uploads resume after reconnecting
+        self.delta_transfers = {}  # Files being rebuilt from a delta of the copy already here
         self.stopping = False
         
         # Determine capabilities
         self.capabilities = self._detect_capabilities()
+        self.codecs = measure_codec_costs()
         
         # Connect to server
         self._connect()
     
     def _detect_capabilities(self):
         """Detect what capabilities this client supports."""
-        capabilities = ['file_management', 'command_execution', 'system_info']
+        capabilities = ['file_management', 'command_execution', 'system_info', 'binary_frames', 'binary_transfers',
+                        'windowed_uploads', 'resumable_transfers', 'delta_sync']
         
-        # Check if we can capture screenshots
+        # Check if we can capture screenshots, and how
         try:
-            PIL.ImageGrab.grab()
+            self.capture = create_capture_backend(self.capture_preference)
+            self.capture.grab()
             capabilities.append('screen_capture')
+            logger.info(f"Screen capture backend: {self.capture.name}")
+            
+            # Remote control needs the same display as capture
+            self.input = InputDispatcher(self._input_area)
+            capabilities.append('remote_input')
+            
+            self.cursor = create_cursor_source()
+            capabilities.append('cursor_updates')
         except Exception as e:
-            logger.warning("Screen capture not available")
+            logger.warning(f"Screen capture not available: {e}")
+            if self.capture:
+                self.capture.close()
+            self.capture = None
         
         return capabilities
     
@@ -112,18 +1378,36 @@ class RemoteClient:
         # Streaming events
         self.socket.on('start_streaming', self._on_start_streaming)
         self.socket.on('stop_streaming', self._on_stop_streaming)
+        self.socket.on('request_keyframe', self._on_request_keyframe)
+        self.socket.on('stream_credit', self._on_stream_credit)
+        self.socket.on('stream_settings', self._on_stream_settings)
+        self.socket.on('stream_region', self._on_stream_region)
+        self.socket.on('start_thumbnails', self._on_start_thumbnails)
+        self.socket.on('input_events', self._on_input_events)
+        self.socket.on('stop_thumbnails', self._on_stop_thumbnails)
         
-        # File management events
+        # File management events; downloads and commands run for a long
+        # time, so they get their own threads rather than holding up the
+        # delivery of other events such as remote input
         self.socket.on('request_file_list', self._on_request_file_list)
         self.socket.on('file_upload_start', self._on_file_upload_start)
         self.socket.on('file_upload_chunk', self._on_file_upload_chunk)
-        self.socket.on('file_download_request', self._on_file_download_request)
+        self.socket.on('file_upload_error', self._on_file_upload_error)
+        self.socket.on('file_delta_signature_request', self._in_background(self._on_file_delta_signature_request))
+        self.socket.on('file_delta_chunk', self._in_background(self._on_file_delta_chunk))
+        self.socket.on('file_download_request', self._in_background(self._on_file_download_request))
         self.socket.on('file_operation', self._on_file_operation)
         
         # Command execution events
-        self.socket.on('execute_command', self._on_execute_command)
+        self.socket.on('execute_command', self._in_background(self._on_execute_command))
         self.socket.on('request_system_info', self._on_request_system_info)
     
+    def _in_background(self, handler):
+        """Wrap an event handler so it runs on a thread of its own."""
+        def run(*args):
+            threading.Thread(target=handler, args=args, daemon=True).start()
+        return run
+    
     def _on_connect(self):
         """Handle connection to server."""
         logger.info("Socket connected, registering client...")
@@ -136,7 +1420,11 @@ class RemoteClient:
             'platform': platform.system(),
             'username': os.getlogin() if hasattr(os, 'getlogin') else 'N/A',
             'ip_address': self._get_local_ip(),
-            'capabilities': self.capabilities
+            'capabilities': self.capabilities,
+            'codecs': self.codecs,
+            'capture_backend': self.capture.name if self.capture else None,
+            'monitors': self.capture.monitors() if self.capture else [],
+            'color_modes': list(STREAM_COLOR_MODES)
         })
     
     def _on_disconnect(self):
@@ -144,9 +1432,19 @@ class RemoteClient:
         logger.info("Disconnected from server")
         self.connected = False
         self.streaming = False
+        if self.input:
+            self.input.release_all()
+        self.thumbnail_stop.set()  # The server asks again after registration
         if self.stream_thread:
             self.stream_thread.join()
             self.stream_thread = None
+        if self.cursor_thread:
+            self.cursor_thread.join()
+            self.cursor_thread = None
+        
+        # The server sends a delta again from the start once the upload resumes
+        for transfer_id in list(self.delta_transfers):
+            self._discard_delta(transfer_id)
         
         # Attempt to reconnect after a delay
         if not self.stopping:
@@ -175,25 +1473,62 @@ class RemoteClient:
         session_id = data.get('session_id')
         quality = data.get('quality', 75)
         fps = data.get('fps', 10)
+        scale = data.get('scale', 1.0)
+        mode = data.get('mode', 'full')
+        # Servers that don't negotiate a transport expect base64 strings
+        transport = data.get('transport', 'base64')
+        tiers = data.get('tiers') or STREAM_DEFAULT_TIERS
+        codec = data.get('codec', STREAM_DEFAULT_CODEC)
+        color_mode = data.get('color_mode', STREAM_DEFAULT_COLOR_MODE)
         
         if not session_id:
             logger.error("Streaming request missing session ID")
             return
         
-        logger.info(f"Starting screen streaming (quality={quality}, fps={fps})")
+        if codec not in self.codecs:
+            logger.warning(f"Codec {codec} not available, using {STREAM_DEFAULT_CODEC}")
+            codec = STREAM_DEFAULT_CODEC
+        
+        if color_mode not in STREAM_COLOR_MODES:
+            logger.warning(f"Colour mode {color_mode} not available, using {STREAM_DEFAULT_COLOR_MODE}")
+            color_mode = STREAM_DEFAULT_COLOR_MODE
+        
+        logger.info(f"Starting screen streaming (quality={quality}, fps={fps}, scale={scale}, "
+                    f"mode={mode}, codec={codec}, color_mode={color_mode}, transport={transport}, "
+                    f"tiers={[tier['name'] for tier in tiers]})")
         
         # Prevent multiple streams
         if self.streaming:
             logger.warning("Streaming already in progress. Ignoring new request.")
             return
         
+        # Frames are only captured while the server has granted credit for them
+        with self.stream_credit:
+            self.stream_credits = data.get('credit_window')
+        
+        # The server may retune these mid-stream
+        self.stream_settings = {'quality': quality, 'fps': fps, 'scale': scale}
+        self.stream_tiers = tiers
+        self.stream_region = self._resolve_capture_region(data)
+        self.stream_seq = 0
+        self.stream_frames_sent = 0
+        self.stream_stats_since = time.monotonic()
+        self.stream_input_seq = 0
+        if self.input:
+            self.input.restart()  # The server numbers input batches per session
         self.streaming = True
         
         # Start streaming thread
         self.stream_thread = threading.Thread(target=self._stream_desktop, 
-                                             args=(session_id, quality, fps),
+                                             args=(session_id, mode, transport, codec, color_mode),
                                              daemon=True)
         self.stream_thread.start()
+        
+        # The pointer goes separately, at its own rate
+        if self.cursor:
+            self.cursor_thread = threading.Thread(target=self._send_cursor, args=(session_id, transport),
+                                                  daemon=True)
+            self.cursor_thread.start()
     
     def _on_stop_streaming(self, data):
         """Handle request to stop streaming desktop."""
@@ -205,11 +1540,18 @@ class RemoteClient:
         
         logger.info("Stopping screen streaming")
         self.streaming = False
+        if self.input:
+            self.input.release_all()
+        with self.stream_credit:
+            self.stream_credit.notify_all()
         
         if self.stream_thread and self.stream_thread.is_alive():
             self.stream_thread.join() # Ensure thread is stopped
+        if self.cursor_thread and self.cursor_thread.is_alive():
+            self.cursor_thread.join()
         
         self.stream_thread = None
+        self.cursor_thread = None
         
         # Send confirmation
         self.socket.emit('stream_stopped', {
@@ -218,34 +1560,333 @@ class RemoteClient:
             'reason': 'Streaming stopped by server'
         })
     
-    def _stream_desktop(self, session_id, quality, fps):
-        """Stream desktop frames to the server."""
+    def _on_request_keyframe(self, data):
+        """Handle request to send a full keyframe of one tier, or all, on the next tick."""
+        tier = data.get('tier') if data else None
+        for name, encoder in list(self.stream_encoders.items()):
+            if tier is None or tier == name:
+                encoder.request_keyframe()
+        
+        # The screen may be unchanged, but the next capture must get through
+        self.change_detector.reset()
+    
+    def _on_stream_settings(self, data):
+        """Handle new stream settings chosen by the server mid-stream."""
+        settings = dict(self.stream_settings)
+        for key in ('quality', 'fps', 'scale'):
+            if data.get(key) is not None:
+                settings[key] = data[key]
+        
+        logger.info(f"Stream settings changed: {settings}")
+        self.stream_settings = settings
+        self.change_detector.reset()
+    
+    def _on_stream_region(self, data):
+        """Handle a viewer panning or resizing the captured monitor or region mid-stream."""
+        if not self.streaming:
+            return
+        
+        self.stream_region = self._resolve_capture_region(data)
+        logger.info(f"Stream region changed: {self.stream_region or 'whole desktop'}")
+        
+        # A new region of a still screen still has to be sent
+        self.change_detector.reset()
+    
+    def _resolve_capture_region(self, data):
+        """Turn a requested region or monitor index into a capture bbox; None means the whole desktop."""
+        if data.get('region'):
+            left, top, right, bottom = (int(value) for value in data['region'])
+            return (left, top, right, bottom)
+        
+        if data.get('monitor') is not None:
+            monitors = self.capture.monitors()
+            index = int(data['monitor'])
+            if 0 <= index < len(monitors):
+                monitor = monitors[index]
+                return (monitor['left'], monitor['top'],
+                        monitor['left'] + monitor['width'], monitor['top'] + monitor['height'])
+            logger.warning(f"Monitor {index} not found, streaming the whole desktop")
+        return None
+    
+    def _on_stream_credit(self, data):
+        """Handle credit from the server allowing more frames to be sent."""
+        with self.stream_credit:
+            if self.stream_credits is None:
+                return
+            self.stream_credits += data.get('credits', 0)
+            self.stream_credit.notify_all()
+    
+    def _take_stream_credit(self):
+        """
+        Wait until the server has granted credit for another frame and take it.
+        
+        After STREAM_CREDIT_PROBE_INTERVAL without credit a single probe frame
+        is allowed, so lost credit can't stall the stream forever.
+        """
+        deadline = time.monotonic() + STREAM_CREDIT_PROBE_INTERVAL
+        with self.stream_credit:
+            while self.stream_credits is not None and self.stream_credits <= 0:
+                if not (self.connected and self.streaming):
+                    return False
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.debug("No stream credit received, sending probe frame")
+                    return True
+                self.stream_credit.wait(min(remaining, 0.5))
+            
+            if self.stream_credits is not None:
+                self.stream_credits -= 1
+        return True
+    
+    def _refund_stream_credit(self, *args):
+        """Give back the credit of a frame that was captured but never sent."""
+        with self.stream_credit:
+            if self.stream_credits is not None:
+                self.stream_credits += 1
+                self.stream_credit.notify_all()
+    
+    def _drop_encoded_frame(self, frame):
+        """
+        Give back the credit of an encoded frame dropped from the send queue.
+        
+        Its tiers' encoders have already moved past it, so later deltas would
+        leave the viewer's picture corrupt; the next frame of each of them is
+        made a keyframe instead.
+        """
+        self._refund_stream_credit()
+        for tier_frame in frame.get('tiers', [frame]):
+            encoder = self.stream_encoders.get(tier_frame.get('tier'))
+            if encoder:
+                encoder.request_keyframe()
+    
+    def _on_input_events(self, data):
+        """Handle a batch of viewer input relayed by the server; it is applied on the input thread."""
+        if not self.streaming or not self.input:
+            return
+        self.input.submit(data.get('seq'), data.get('events') or b'')
+        self.change_detector.activity()
+    
+    def _input_area(self):
+        """Desktop area remote input positions are mapped onto: the streamed region, or the screen."""
+        if self.stream_region:
+            return self.stream_region
+        width, height = pyautogui.size()
+        return (0, 0, width, height)
+    
+    def _send_cursor(self, session_id, transport):
+        """
+        Send the pointer's position and shape while streaming.
+        
+        The pointer is polled CURSOR_FPS times a second and an update sent
+        whenever it moved or changed shape, so it stays responsive however
+        low the frame rate. Positions are scaled to 0..INPUT_COORDINATE_MAX
+        across the captured area, like remote input. Shapes are identified by
+        a hash and their image is only sent the first time.
+        """
+        clock = FrameClock(CURSOR_FPS)
+        sent_shapes = set()
+        last_shape = shape_hash = last_update = None
+        
+        while self.connected and self.streaming:
+            clock.wait()
+            try:
+                x, y, shape = self.cursor.read()
+                left, top, right, bottom = self._input_area()
+            except Exception as e:
+                logger.error(f"Error reading cursor: {e}")
+                return
+            
+            if shape is not last_shape:
+                last_shape = shape
+                shape_hash = None
+                if shape is not None:
+                    buffer = io.BytesIO()
+                    shape[0].save(buffer, format='PNG', compress_level=1)
+                    shape_image = buffer.getvalue()
+                    shape_hash = hashlib.sha1(shape_image).hexdigest()[:16]
+            
+            visible = left <= x < right and top <= y < bottom
+            update = (
+                min(INPUT_COORDINATE_MAX, max(0, (x - left) * INPUT_COORDINATE_MAX // max(1, right - left - 1))),
+                min(INPUT_COORDINATE_MAX, max(0, (y - top) * INPUT_COORDINATE_MAX // max(1, bottom - top - 1))),
+                visible,
+                shape_hash
+            )
+            if update == last_update:
+                continue
+            last_update = update
+            
+            message = {
+                'client_id': self.client_id,
+                'session_id': session_id,
+                'x': update[0],
+                'y': update[1],
+                'visible': visible,
+                'shape': shape_hash
+            }
+            if shape_hash is not None and shape_hash not in sent_shapes:
+                message.update({
+                    'image': shape_image if transport == 'binary' else base64.b64encode(shape_image).decode('utf-8'),
+                    'hotspot': list(shape[1]),
+                    'width': shape[0].width,
+                    'height': shape[0].height
+                })
+                sent_shapes.add(shape_hash)
+            self.socket.emit('cursor_update', message)
+    
+    def _on_start_thumbnails(self, data):
+        """Handle the server turning on thumbnail mode for its fleet overview."""
+        if 'screen_capture' not in self.capabilities:
+            return
+        
+        self._on_stop_thumbnails()
+        self.thumbnail_stop = threading.Event()
+        self.thumbnail_thread = threading.Thread(
+            target=self._send_thumbnails,
+            args=(self.thumbnail_stop,
+                  data.get('interval', THUMBNAIL_DEFAULT_INTERVAL),
+                  data.get('max_width', THUMBNAIL_DEFAULT_WIDTH),
+                  data.get('quality', THUMBNAIL_DEFAULT_QUALITY),
+                  data.get('offset', 0)),
+            daemon=True
+        )
+        self.thumbnail_thread.start()
+    
+    def _on_stop_thumbnails(self, data=None):
+        """Handle the server turning off thumbnail mode."""
+        self.thumbnail_stop.set()
+        if self.thumbnail_thread and self.thumbnail_thread is not threading.current_thread():
+            self.thumbnail_thread.join()
+        self.thumbnail_thread = None
+    
+    def _send_thumbnails(self, stop, interval, max_width, quality, offset):
+        """
+        Send a small desktop snapshot every interval seconds until stopped.
+        
+        The first one waits for offset seconds, the slot the server gave this
+        client so the fleet's snapshots don't arrive at once. A snapshot that
+        looks the same as the last one sent is skipped.
+        """
+        logger.info(f"Sending {max_width}px thumbnails every {interval}s")
+        scaler = FrameScaler()
+        last_signature = None
+        
+        if stop.wait(offset):
+            return
+        while self.connected:
+            try:
+                captured_at = time.time()
+                screenshot = self.capture.grab()
+                thumbnail = scaler.resize(screenshot, scaler.target_size(screenshot.size, max_width=max_width))
+                thumbnail = thumbnail.convert('RGB')
+                
+                signature = zlib.crc32(thumbnail.tobytes())
+                if signature != last_signature:
+                    self.socket.emit('screen_thumbnail', {
+                        'client_id': self.client_id,
+                        'image': encode_jpeg(thumbnail, quality),
+                        'width': thumbnail.width,
+                        'height': thumbnail.height,
+                        'captured_at': captured_at
+                    })
+                    last_signature = signature
+            except Exception as e:
+                logger.error(f"Error sending thumbnail: {e}")
+            
+            if stop.wait(interval):
+                return
+    
+    def _stream_desktop(self, session_id, mode='full', transport='base64', codec=STREAM_DEFAULT_CODEC,
+                        color_mode=STREAM_DEFAULT_COLOR_MODE):
+        """
+        Stream desktop frames to the server.
+        
+        Capture, encode and send run as separate stages on their own threads,
+        connected by drop-oldest queues, so a slow stage costs frames rather
+        than stretching the frame interval. This thread runs the capture stage.
+        
+        Captures identical to the previous one are not encoded; the server
+        gets a periodic keepalive instead, and once the screen has been still
+        for STREAM_IDLE_AFTER seconds capturing slows to STREAM_IDLE_FPS.
+        """
         try:
             logger.info("Starting streaming thread")
             
+            # Delta mode sends changed tiles; full mode sends every frame as a keyframe
+            self.frame_encoder = ParallelFrameEncoder(self.encode_workers, codec)
+            self.stream_encoders = {tier['name']: TileDeltaEncoder(encoder=self.frame_encoder,
+                                                                   reducer=ColorReducer(color_mode))
+                                    for tier in self.stream_tiers}
+            self.stream_timings = StageTimings()
+            capture_queue = DropOldestQueue(on_drop=self._refund_stream_credit)
+            send_queue = DropOldestQueue(on_drop=self._drop_encoded_frame)
+            
+            stages = [
+                threading.Thread(target=self._run_stream_stage,
+                                 args=(self._encode_stage, capture_queue, send_queue, mode),
+                                 daemon=True),
+                threading.Thread(target=self._run_stream_stage,
+                                 args=(self._send_stage, send_queue, session_id, transport),
+                                 daemon=True)
+            ]
+            for stage in stages:
+                stage.start()
+            
+            clock = FrameClock(self.stream_settings['fps'])
+            last_stats = last_keepalive = time.monotonic()
+            unchanged = 0
+            self.change_detector.reset()
+            
             while self.connected and self.streaming:
+                idle = self.change_detector.idle_for() >= STREAM_IDLE_AFTER
+                if idle:
+                    clock.set_fps(min(STREAM_IDLE_FPS, self.stream_settings['fps']))
+                else:
+                    clock.set_fps(self.stream_settings['fps'])
+                clock.wait()
+                
+                # Capture only when the frame can be sent straight away, so
+                # slow viewers never cause stale frames to queue up
+                if not self._take_stream_credit():
+                    continue
+                
                 # Capture screenshot
                 try:
-                    screenshot = PIL.ImageGrab.grab()
-                    
-                    # Encode image
-                    buffer = io.BytesIO()
-                    screenshot.save(buffer, format='JPEG', quality=quality)
-                    frame_data = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                    
-                    # Send frame to server
-                    self.socket.emit('screen_frame', {
-                        'client_id': self.client_id,
-                        'session_id': session_id,
-                        'frame': frame_data
-                    })
+                    # Input applied by now shows in this capture
+                    input_seq = self.input.applied_seq if self.input else 0
+                    captured_at = time.time()
+                    capture_start = time.perf_counter()
+                    region = self.stream_region
+                    screenshot = self.capture.grab(region)
+                    changed = self.change_detector.changed(screenshot)
+                    capture_time = time.perf_counter() - capture_start
+                    self.stream_timings.record('capture', capture_time)
                 except Exception as e:
-                    logger.error(f"Error capturing/encoding screenshot: {e}")
+                    logger.error(f"Error capturing screenshot: {e}")
                     self.streaming = False
                     break # Break out of loop
                 
-                # Wait for next frame
-                time.sleep(1 / fps)
+                if changed:
+                    # Only the first frame after an input batch reports it, for input-to-frame latency
+                    new_input = input_seq if input_seq > self.stream_input_seq else None
+                    self.stream_input_seq = max(self.stream_input_seq, input_seq)
+                    capture_queue.put((screenshot, region, captured_at, capture_time, new_input))
+                else:
+                    self._refund_stream_credit()
+                    unchanged += 1
+                    if time.monotonic() - last_keepalive >= STREAM_KEEPALIVE_INTERVAL:
+                        self._send_stream_keepalive(session_id, unchanged, idle)
+                        last_keepalive = time.monotonic()
+                        unchanged = 0
+                
+                if time.monotonic() - last_stats >= STREAM_STATS_INTERVAL:
+                    self._send_stream_stats(session_id, capture_queue, send_queue)
+                    last_stats = time.monotonic()
+            
+            capture_queue.close()
+            send_queue.close()
+            for stage in stages:
+                stage.join()
             
             logger.info("Streaming thread stopped")
         except Exception as e:
@@ -254,6 +1895,10 @@ class RemoteClient:
             # Ensure streaming flag is reset and thread is cleaned up
             self.streaming = False
             self.stream_thread = None
+            self.stream_encoders = {}
+            if self.frame_encoder:
+                self.frame_encoder.shutdown()
+                self.frame_encoder = None
             
             # Notify server if streaming stopped unexpectedly
             if self.connected:
@@ -263,6 +1908,112 @@ class RemoteClient:
                     'reason': 'Streaming stopped unexpectedly'
                 })
     
+    def _run_stream_stage(self, stage, queue, *args):
+        """Feed items from a queue to a pipeline stage until streaming stops."""
+        while self.connected and self.streaming:
+            item = queue.get(timeout=0.5)
+            if item is None:
+                continue
+            
+            try:
+                stage(item, *args)
+            except Exception as e:
+                logger.error(f"Error in streaming pipeline stage {stage.__name__}: {e}")
+                self.streaming = False
+    
+    def _encode_stage(self, capture, send_queue, mode):
+        """
+        Scale and encode a captured frame.
+        
+        With several resolution tiers the frames of all tiers that changed are
+        bundled under 'tiers' and sent as one message, using a single credit.
+        Frames of a region carry its desktop coordinates as 'region'. The
+        capture's wall clock time and duration travel with the frame for the
+        server's latency telemetry, as does the first input batch it shows.
+        """
+        screenshot, region, captured_at, capture_time, input_seq = capture
+        settings = self.stream_settings
+        encode_start = time.perf_counter()
+        
+        tier_frames = []
+        for tier, image in self.frame_scaler.scale_tiers(screenshot, settings['scale'], self.stream_tiers):
+            if mode == 'delta':
+                tier_frame = self.stream_encoders[tier].encode(image, settings['quality'])
+            else:
+                image = self.stream_encoders[tier].reducer.reduce(image.convert('RGB'), keyframe=True)
+                tier_frame = self.frame_encoder.encode_keyframe(image, settings['quality'])
+            if tier_frame is not None:
+                tier_frame['tier'] = tier
+                if region:
+                    tier_frame['region'] = list(region)
+                tier_frames.append(tier_frame)
+        
+        encode_time = time.perf_counter() - encode_start
+        self.stream_timings.record('encode', encode_time)
+        
+        # Nothing changed, so the frame's credit goes back unused
+        if not tier_frames:
+            self._refund_stream_credit()
+            return
+        
+        if len(self.stream_tiers) > 1:
+            frame = {'tiers': tier_frames}
+        else:
+            frame = tier_frames[0]
+        
+        frame['captured_at'] = captured_at
+        frame['capture_ms'] = round(capture_time * 1000, 2)
+        if input_seq is not None:
+            frame['input_seq'] = input_seq
+        frame['encode_ms'] = round(encode_time * 1000, 2)
+        send_queue.put(frame)
+    
+    def _send_stage(self, frame, session_id, transport):
+        """Send an encoded frame to the server."""
+        send_start = time.perf_counter()
+        
+        if transport == 'base64':
+            frame = frame_to_base64(frame)
+        
+        # Raw bytes go out as Socket.IO binary attachments
+        self.stream_seq += 1
+        frame.update({
+            'client_id': self.client_id,
+            'session_id': session_id,
+            'seq': self.stream_seq,
+            'sent_at': time.time()
+        })
+        self.socket.emit('screen_frame', frame)
+        
+        self.stream_timings.record('send', time.perf_counter() - send_start)
+        self.stream_frames_sent += 1
+    
+    def _send_stream_keepalive(self, session_id, unchanged, idle):
+        """Tell the server the stream is alive and how many captures were skipped since the last keepalive."""
+        self.socket.emit('screen_keepalive', {
+            'client_id': self.client_id,
+            'session_id': session_id,
+            'seq': self.stream_seq,
+            'unchanged': unchanged,
+            'idle': idle
+        })
+    
+    def _send_stream_stats(self, session_id, capture_queue, send_queue):
+        """Report per-stage timings and the achieved frame rate to the server."""
+        now = time.monotonic()
+        elapsed = now - self.stream_stats_since
+        
+        self.socket.emit('stream_stats', {
+            'client_id': self.client_id,
+            'session_id': session_id,
+            'timings': self.stream_timings.snapshot(),
+            'fps': round(self.stream_frames_sent / elapsed, 2) if elapsed > 0 else 0,
+            'dropped': capture_queue.dropped + send_queue.dropped
+        })
+        
+        self.stream_frames_sent = 0
+        self.stream_stats_since = now
+    
     def _on_request_file_list(self, data):
         """Handle request for file listing."""
         request_id = data.get('request_id')
@@ -319,31 +2070,148 @@ class RemoteClient:
         
         logger.info(f"Received file upload start request: {filename} -> {dest_path}")
         
-        # Create a temporary file to store the incoming data
-        temp_file = tempfile.NamedTemporaryFile(delete=False)
-        
-        # Store transfer information
-        self.file_transfers[transfer_id] = {
-            'filename': filename,
-            'dest_path': dest_path,
-            'file_size': file_size,
-            'chunk_size': chunk_size,
-            'temp_file_path': temp_file.name,
-            'temp_file': temp_file,
-            'bytes_received': 0,
-            'start_time': datetime.now()
-        }
+        # A resumed upload carries on writing into its temporary file
+        transfer = self.file_transfers.get(transfer_id)
+        if (data.get('resume') and transfer
+                and transfer['file_size'] == file_size and transfer['chunk_size'] == chunk_size):
+            logger.info(f"Resuming file upload with {transfer['bytes_received']} bytes already received")
+            transfer['windowed'] = data.get('windowed', False)
+            self._checkpoint_upload(transfer_id, force=True)
+        else:
+            if transfer:
+                self._discard_upload(transfer_id)
+            
+            # Create a temporary file to store the incoming data
+            os.makedirs(self.transfer_dir, exist_ok=True)
+            temp_file = tempfile.NamedTemporaryFile(delete=False, dir=self.transfer_dir, suffix='.part')
+            chunk_log = temp_file.name + CHUNK_LOG_SUFFIX
+            open(chunk_log, 'w').close()
+            
+            # Store transfer information
+            transfer = self.file_transfers[transfer_id] = {
+                'filename': filename,
+                'dest_path': dest_path,
+                'file_size': file_size,
+                'chunk_size': chunk_size,
+                'temp_file_path': temp_file.name,
+                'temp_file': temp_file,
+                'bytes_received': 0,
+                'received': RangeSet(),  # Chunks may arrive out of order, or twice when resent
+                'chunk_log': chunk_log,  # Hashes of the chunks on disk, for resuming
+                'unlogged': [],  # (offset, length, hash) of the chunks written since the last checkpoint
+                'windowed': data.get('windowed', False),  # Server sends a window of chunks; ack each by offset
+                'checkpointed_at': 0,
+                'start_time': datetime.now()
+            }
+            self._checkpoint_upload(transfer_id, force=True)
         
-        # Send acknowledgment
+        # Send acknowledgment, which asks for the first chunk; the server
+        # skips the chunks already received whose hashes still match
         self.socket.emit('file_upload_ack', {
             'client_id': self.client_id,
-            'transfer_id': transfer_id
+            'transfer_id': transfer_id,
+            'offset': 0,
+            'chunks': {offset: digest for offset, _, digest in read_chunk_log(transfer['chunk_log'])}
         })
     
+    def _checkpoint_upload(self, transfer_id, force=False):
+        """
+        Save an upload's manifest, at most every TRANSFER_CHECKPOINT_INTERVAL
+        seconds unless forced.
+        
+        The temporary file is synced first and the hashes of the chunks
+        written since then appended to the chunk log after, so the log never
+        lists chunks that a crash could lose and only those hashes are held
+        in memory.
+        """
+        transfer = self.file_transfers[transfer_id]
+        now = time.monotonic()
+        if not force and now - transfer['checkpointed_at'] < TRANSFER_CHECKPOINT_INTERVAL:
+            return
+        
+        transfer['temp_file'].flush()
+        os.fsync(transfer['temp_file'].fileno())
+        if transfer['unlogged']:
+            with open(transfer['chunk_log'], 'a') as f:
+                f.writelines(f"{offset} {length} {digest}\n" for offset, length, digest in transfer['unlogged'])
+                f.flush()
+                os.fsync(f.fileno())
+            transfer['unlogged'] = []
+        manifest = {
+            'transfer_id': transfer_id,
+            'filename': transfer['filename'],
+            'dest_path': transfer['dest_path'],
+            'file_size': transfer['file_size'],
+            'chunk_size': transfer['chunk_size'],
+            'temp_file_path': transfer['temp_file_path'],
+            'windowed': transfer['windowed'],
+            'ranges': list(transfer['received']),
+            'chunk_log': transfer['chunk_log']
+        }
+        
+        path = os.path.join(self.transfer_dir, f"{transfer_id}.json")
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+        transfer['checkpointed_at'] = now
+    
+    def _load_upload_manifests(self):
+        """Reopen the uploads a previous run left unfinished, so the server can resume them."""
+        transfers = {}
+        if not os.path.isdir(self.transfer_dir):
+            return transfers
+        
+        for name in os.listdir(self.transfer_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.transfer_dir, name)
+            try:
+                with open(path) as f:
+                    manifest = json.load(f)
+                received = RangeSet((offset, offset + length)
+                                    for offset, length, _ in read_chunk_log(manifest['chunk_log']))
+                transfers[manifest['transfer_id']] = {
+                    'filename': manifest['filename'],
+                    'dest_path': manifest['dest_path'],
+                    'file_size': manifest['file_size'],
+                    'chunk_size': manifest['chunk_size'],
+                    'temp_file_path': manifest['temp_file_path'],
+                    'temp_file': open(manifest['temp_file_path'], 'r+b'),
+                    'bytes_received': received.total(),
+                    'received': received,
+                    'chunk_log': manifest['chunk_log'],
+                    'unlogged': [],
+                    'windowed': manifest['windowed'],
+                    'checkpointed_at': 0,
+                    'start_time': datetime.now()
+                }
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Dropping unusable upload manifest {name}: {e}")
+                os.remove(path)
+        
+        if transfers:
+            logger.info(f"Found {len(transfers)} unfinished uploads to resume")
+        return transfers
+    
+    def _discard_upload(self, transfer_id):
+        """Forget an upload, deleting its temporary file and manifest."""
+        transfer = self.file_transfers.pop(transfer_id, None)
+        if transfer is None:
+            return
+        for path in (transfer['temp_file_path'], transfer['chunk_log'],
+                     os.path.join(self.transfer_dir, f"{transfer_id}.json")):
+            try:
+                if path == transfer['temp_file_path']:
+                    transfer['temp_file'].close()
+                os.remove(path)
+            except OSError:
+                pass
+    
     def _on_file_upload_chunk(self, data):
         """Handle incoming file chunk from server."""
         transfer_id = data.get('transfer_id')
         chunk = data.get('chunk')
+        offset = data.get('offset', 0)
         
         if not transfer_id or not chunk:
             logger.error("File upload chunk missing transfer ID or chunk data")
@@ -355,14 +2223,26 @@ class RemoteClient:
         
         try:
             transfer = self.file_transfers[transfer_id]
-            chunk_data = base64.b64decode(chunk)
             
-            # Write chunk to temporary file
+            # Chunks arrive as binary attachments, or base64 from older servers
+            chunk_data = base64.b64decode(chunk) if isinstance(chunk, str) else chunk
+            
+            # Write chunk to temporary file at its offset
+            transfer['temp_file'].seek(offset)
             transfer['temp_file'].write(chunk_data)
-            transfer['bytes_received'] += len(chunk_data)
+            transfer['received'].add(offset, offset + len(chunk_data))
+            transfer['unlogged'].append((offset, len(chunk_data), chunk_hash(chunk_data)))
+            transfer['bytes_received'] = transfer['received'].total()
+            
+            if transfer['windowed']:
+                self.socket.emit('file_upload_chunk_ack', {
+                    'client_id': self.client_id,
+                    'transfer_id': transfer_id,
+                    'offset': offset
+                })
             
             # Check if this is the last chunk
-            if transfer['bytes_received'] >= transfer['file_size']:
+            if transfer['received'].covers(0, transfer['file_size']):
                 # Rename temporary file to final destination
                 transfer['temp_file'].close()
                 shutil.move(transfer['temp_file_path'], transfer['dest_path'])
@@ -379,6 +2259,20 @@ class RemoteClient:
                 
                 # Clean up transfer
                 del self.file_transfers[transfer_id]
+                for path in (transfer['chunk_log'], os.path.join(self.transfer_dir, f"{transfer_id}.json")):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            else:
+                self._checkpoint_upload(transfer_id)
+                if not transfer['windowed']:
+                    # Ask for the next chunk
+                    self.socket.emit('file_upload_chunk', {
+                        'client_id': self.client_id,
+                        'transfer_id': transfer_id,
+                        'offset': offset + len(chunk_data)
+                    })
             
         except Exception as e:
             logger.error(f"Error handling file upload chunk: {e}")
@@ -389,13 +2283,161 @@ class RemoteClient:
             })
             
             # Clean up transfer
-            if transfer_id in self.file_transfers:
+            self._discard_upload(transfer_id)
+    
+    def _on_file_upload_error(self, data):
+        """Handle the server abandoning an upload; the partial file is deleted."""
+        if data.get('transfer_id') not in self.file_transfers and data.get('transfer_id') not in self.delta_transfers:
+            return
+        
+        logger.error(f"File upload {data.get('transfer_id')} failed on server: {data.get('error')}")
+        self._discard_upload(data.get('transfer_id'))
+        self._discard_delta(data.get('transfer_id'))
+    
+    def _on_file_delta_signature_request(self, data):
+        """
+        Handle the server asking for the block checksums of the file an
+        upload will replace, so that it sends only what changed.
+        
+        Without a file to update the server sends the upload in full.
+        """
+        transfer_id = data.get('transfer_id')
+        path = data.get('path')
+        block_size = data.get('block_size')
+        
+        try:
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"No existing file at {path}")
+            
+            with open(path, 'rb') as f:
+                weak, strong = file_signatures(f, block_size)
+            logger.info(f"Sending checksums of {len(weak) // 4} blocks of {path} for delta sync")
+            self.socket.emit('file_delta_signatures', {
+                'client_id': self.client_id,
+                'transfer_id': transfer_id,
+                'block_size': block_size,
+                'weak': weak,
+                'strong': strong
+            })
+        except Exception as e:
+            self.socket.emit('file_delta_signatures', {
+                'client_id': self.client_id,
+                'transfer_id': transfer_id,
+                'error': str(e)
+            })
+    
+    def _on_file_delta_chunk(self, data):
+        """
+        Handle a message of an upload's delta: literal bytes, and references to
+        blocks of the existing file.
+        
+        The file is rebuilt into a temporary file next to it, which replaces
+        it once its checksum matches the server's.
+        """
+        transfer_id = data.get('transfer_id')
+        
+        try:
+            if data.get('seq') == 0:
+                dest_path = data.get('dest_path')
+                self._remove_stale_delta_files(dest_path)
+                self.delta_transfers[transfer_id] = {
+                    'dest_path': dest_path,
+                    'file_size': data.get('file_size'),
+                    'block_size': data.get('block_size'),
+                    'basis': open(dest_path, 'rb'),
+                    'temp_file': tempfile.NamedTemporaryFile(delete=False, dir=os.path.dirname(dest_path) or '.',
+                                                             prefix=f".{os.path.basename(dest_path)}.",
+                                                             suffix='.part'),
+                    'digest': hashlib.blake2b(digest_size=16),
+                    'bytes_written': 0,
+                    'seq': 0
+                }
+            
+            transfer = self.delta_transfers.get(transfer_id)
+            if transfer is None or data.get('seq') != transfer['seq']:
+                raise ValueError(f"Unexpected delta message {data.get('seq')}")
+            transfer['seq'] += 1
+            
+            for op in data.get('ops', []):
+                if 'data' in op:
+                    self._write_delta(transfer, op['data'])
+                    continue
+                
+                transfer['basis'].seek(op['copy'] * transfer['block_size'])
+                remaining = op['count'] * transfer['block_size']
+                while remaining:
+                    block = transfer['basis'].read(min(remaining, DELTA_SEGMENT_SIZE))
+                    if not block:
+                        raise ValueError("Delta refers past the end of the existing file")
+                    self._write_delta(transfer, block)
+                    remaining -= len(block)
+            
+            complete = data.get('is_last', False)
+            if complete:
+                if (transfer['bytes_written'] != transfer['file_size']
+                        or transfer['digest'].hexdigest() != data.get('file_hash')):
+                    raise ValueError("Rebuilt file does not match, the existing file may have changed")
+                
+                temp_file = transfer['temp_file']
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+                temp_file.close()
+                transfer['basis'].close()
+                shutil.copymode(transfer['dest_path'], temp_file.name)
+                os.replace(temp_file.name, transfer['dest_path'])
+                del self.delta_transfers[transfer_id]
+                logger.info(f"File updated from delta: {transfer['dest_path']}")
+            
+            self.socket.emit('file_delta_ack', {
+                'client_id': self.client_id,
+                'transfer_id': transfer_id,
+                'seq': data.get('seq'),
+                'complete': complete
+            })
+        
+        except Exception as e:
+            logger.error(f"Error applying file delta: {e}")
+            self._discard_delta(transfer_id)
+            self.socket.emit('file_delta_error', {
+                'client_id': self.client_id,
+                'transfer_id': transfer_id,
+                'error': str(e)
+            })
+    
+    def _write_delta(self, transfer, data):
+        transfer['temp_file'].write(data)
+        transfer['digest'].update(data)
+        transfer['bytes_written'] += len(data)
+    
+    def _remove_stale_delta_files(self, dest_path):
+        """Delete files partly rebuilt for dest_path by deltas that were never finished, e.g. before a crash."""
+        directory = os.path.dirname(dest_path) or '.'
+        prefix = f".{os.path.basename(dest_path)}."
+        in_use = {os.path.abspath(transfer['temp_file'].name) for transfer in self.delta_transfers.values()}
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.abspath(os.path.join(directory, name))
+            if name.startswith(prefix) and name.endswith('.part') and path not in in_use:
                 try:
-                    transfer['temp_file'].close()
-                    os.remove(transfer['temp_file_path'])
-                except:
+                    os.remove(path)
+                    logger.info(f"Removed partly rebuilt file {path}")
+                except OSError:
                     pass
-                del self.file_transfers[transfer_id]
+    
+    def _discard_delta(self, transfer_id):
+        """Forget a delta being applied, deleting the partly rebuilt file."""
+        transfer = self.delta_transfers.pop(transfer_id, None)
+        if transfer is None:
+            return
+        try:
+            transfer['basis'].close()
+            transfer['temp_file'].close()
+            os.remove(transfer['temp_file'].name)
+        except OSError:
+            pass
     
     def _on_file_download_request(self, data):
         """Handle request to download a file from client."""
@@ -418,36 +2460,48 @@ class RemoteClient:
         
         file_size = os.path.getsize(path)
         
-        logger.info(f"Starting file download: {path} (size={file_size})")
+        # A resumed download lists the ranges the server is missing and the
+        # hashes of the chunks it has; chunks that changed are sent again
+        ranges = data.get('ranges')
+        if ranges is not None and data.get('file_size') != file_size:
+            self.socket.emit('file_download_error', {
+                'client_id': self.client_id,
+                'transfer_id': transfer_id,
+                'error': 'File changed since the download started'
+            })
+            return
+        
+        logger.info(f"{'Resuming' if ranges is not None else 'Starting'} file download: {path} (size={file_size})")
         
         try:
             with open(path, 'rb') as f:
-                offset = 0
-                while True:
+                if ranges is None:
+                    offsets = range(0, file_size, chunk_size)
+                else:
+                    chunks = {int(offset): digest for offset, digest in (data.get('chunks') or {}).items()}
+                    offsets = {offset for start, end in ranges for offset in range(start, end, chunk_size)}
+                    offsets = sorted(offsets.union(stale_chunks(f, chunks, chunk_size)))
+                
+                for offset in offsets:
+                    f.seek(offset)
                     chunk = f.read(chunk_size)
-                    if not chunk:
-                        break
                     
-                    chunk_b64 = base64.b64encode(chunk).decode('utf-8')
-                    
-                    # Send chunk to server
+                    # Send chunk to server as a binary attachment
                     self.socket.emit('file_download_chunk', {
                         'client_id': self.client_id,
                         'transfer_id': transfer_id,
                         'offset': offset,
-                        'chunk': chunk_b64,
+                        'chunk': chunk,
                         'is_last': False, # Will be updated later
                         'file_size': file_size # Send file size with the first chunk
                     })
-                    
-                    offset += len(chunk)
             
             # Send last chunk
             self.socket.emit('file_download_chunk', {
                 'client_id': self.client_id,
                 'transfer_id': transfer_id,
-                'offset': offset,
-                'chunk': '',
+                'offset': file_size,
+                'chunk': b'',
                 'is_last': True,
                 'file_size': file_size
             })
@@ -630,8 +2684,13 @@ class RemoteClient:
     def stop(self):
         """Stop the client agent."""
         self.stopping = True
+        self._on_stop_thumbnails()
         if self.connected:
             self.socket.disconnect()
+        if self.capture:
+            self.capture.close()
+        if self.cursor:
+            self.cursor.close()
         
         logger.info("Client agent stopped")
 
@@ -640,6 +2699,10 @@ def main():
     parser.add_argument('server', help='Server URL (e.g., http://localhost:5000)')
     parser.add_argument('--client-id', help='Client ID (optional, will generate if not provided)')
     parser.add_argument('--no-verify-ssl', action='store_false', dest='verify_ssl', help='Disable SSL verification (unsafe, use for testing only)')
+    parser.add_argument('--encode-workers', type=int, help='Threads used to encode screen frames (default: up to 4, one per core)')
+    parser.add_argument('--capture-backend', choices=['auto', 'xshm', 'pil'], default='auto',
+                        help='Screen capture backend (default: MIT-SHM on X11 when available, else PIL)')
+    parser.add_argument('--state-dir', help=f'Directory for resumable transfer state (default: {AGENT_STATE_DIR})')
     parser.set_defaults(verify_ssl=True)
     args = parser.parse_args()
     
@@ -647,7 +2710,10 @@ def main():
     client = RemoteClient(
         server_url=args.server,
         client_id=args.client_id,
-        verify_ssl=args.verify_ssl
+        verify_ssl=args.verify_ssl,
+        encode_workers=args.encode_workers,
+        capture_backend=args.capture_backend,
+        state_dir=args.state_dir
     )
     
     # Keep the main thread alive
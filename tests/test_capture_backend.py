@@ -0,0 +1,65 @@
+import os
+import pytest
+
+client_agent = pytest.importorskip('client_agent')
+
+# Run under a virtual X server, e.g. xvfb-run -s '-screen 0 1280x720x24' pytest tests/test_capture_backend.py
+needs_display = pytest.mark.skipif(not os.environ.get('DISPLAY'), reason='needs an X display')
+
+@pytest.fixture
+def xshm():
+    backend = client_agent.XShmCaptureBackend()
+    yield backend
+    backend.close()
+
+@needs_display
+def test_auto_prefers_xshm():
+    backend = client_agent.create_capture_backend('auto')
+    try:
+        assert backend.name == 'xshm'
+    finally:
+        backend.close()
+
+@needs_display
+def test_full_screen_grab(xshm):
+    image = xshm.grab()
+    assert image.mode == 'RGB'
+    assert image.size == xshm.screen_size()
+
+@needs_display
+def test_region_matches_pil(xshm):
+    region = (10, 20, 110, 70)
+    image = xshm.grab(region)
+    assert image.size == (100, 50)
+    assert image.tobytes() == client_agent.PILCaptureBackend().grab(region).tobytes()
+
+@needs_display
+def test_segments_reused(xshm):
+    xshm.grab((0, 0, 64, 64))
+    segment = xshm.segments[(64, 64)]
+    xshm.grab((32, 32, 96, 96))
+    assert xshm.segments[(64, 64)] is segment
+    assert len(xshm.segments) == 1
+
+@needs_display
+def test_region_clamped_to_screen(xshm):
+    width, height = xshm.screen_size()
+    assert xshm.grab((width - 10, height - 10, width + 50, height + 50)).size == (10, 10)
+    with pytest.raises(ValueError):
+        xshm.grab((width + 1, 0, width + 10, 10))
+
+@needs_display
+def test_monitors(xshm):
+    monitors = xshm.monitors()
+    assert monitors and all(monitor['width'] > 0 for monitor in monitors)
+
+@needs_display
+def test_xfixes_cursor_shape_cached_until_it_changes():
+    cursor = client_agent.XFixesCursorSource()
+    try:
+        x, y, shape = cursor.read()
+        image, hotspot = shape
+        assert image.mode == 'RGBA' and image.width > 0
+        assert cursor.read()[2] is shape
+    finally:
+        cursor.close()
@@ -0,0 +1,73 @@
+import io
+import os
+import threading
+import numpy as np
+import pytest
+from app.services.delta_sync import (block_checksums, rolling_checksums, file_signatures, compute_delta, delta_size,
+                                     delta_messages, apply_delta, delta_block_size, DELTA_MIN_BLOCK_SIZE)
+
+BLOCK = 1024
+
+def rebuild(old, new):
+    weak, strong = file_signatures(io.BytesIO(old), BLOCK)
+    ops = compute_delta(io.BytesIO(new), len(new), weak, strong, BLOCK)
+    out = io.BytesIO()
+    messages = (message for message, _ in delta_messages(io.BytesIO(new), ops, BLOCK, 4096))
+    apply_delta(io.BytesIO(old), messages, BLOCK, out)
+    return ops, out.getvalue()
+
+def test_rolling_checksums_match_block_checksums():
+    data = os.urandom(10 * BLOCK + 100)
+    assert np.array_equal(rolling_checksums(data, BLOCK)[::BLOCK], block_checksums(data, BLOCK))
+
+def test_edited_file_sends_only_changes():
+    old = os.urandom(200 * BLOCK)
+    new = old[:5000] + b'inserted' + old[5000:100000] + old[120000:] + b'appended'
+    ops, rebuilt = rebuild(old, new)
+    assert rebuilt == new
+    assert delta_size(ops) < 4 * BLOCK
+
+def test_unrelated_file_delta_not_smaller():
+    new = os.urandom(50 * BLOCK)
+    ops, rebuilt = rebuild(os.urandom(50 * BLOCK), new)
+    assert rebuilt == new
+    assert delta_size(ops) >= len(new)
+
+def test_empty_and_short_files():
+    assert rebuild(b'', b'abc')[1] == b'abc'
+    assert rebuild(b'abc', b'')[1] == b''
+
+def test_block_size_grows_with_file():
+    assert delta_block_size(1000) == DELTA_MIN_BLOCK_SIZE
+    assert delta_block_size(500 * 1024 * 1024) > delta_block_size(10 * 1024 * 1024)
+
+def test_agent_signatures_match_server():
+    client_agent = pytest.importorskip('client_agent')
+    data = os.urandom(20 * BLOCK + 7)
+    assert client_agent.file_signatures(io.BytesIO(data), BLOCK) == file_signatures(io.BytesIO(data), BLOCK)
+
+def test_agent_discards_delta_on_disconnect(tmp_path):
+    client_agent = pytest.importorskip('client_agent')
+    dest = tmp_path / 'file.bin'
+    dest.write_bytes(os.urandom(4 * BLOCK))
+    stale = tmp_path / '.file.bin.old.part'
+    stale.write_bytes(b'left over from a crash')
+    
+    agent = client_agent.RemoteClient.__new__(client_agent.RemoteClient)
+    agent.client_id = 'c1'
+    agent.socket = type('Socket', (), {'emit': lambda self, *args: None})()
+    agent.delta_transfers = {}
+    agent._on_file_delta_chunk({'transfer_id': 't1', 'seq': 0, 'dest_path': str(dest), 'file_size': 4 * BLOCK,
+                                'block_size': BLOCK, 'ops': [{'copy': 0, 'count': 2}]})
+    assert not stale.exists()
+    part = agent.delta_transfers['t1']['temp_file'].name
+    assert os.path.exists(part)
+    
+    agent.connected = agent.streaming = True
+    agent.input = agent.stream_thread = agent.cursor_thread = None
+    agent.thumbnail_stop = threading.Event()
+    agent.stopping = True
+    agent._on_disconnect()
+    assert not agent.delta_transfers
+    assert not os.path.exists(part)
+    assert [path.name for path in tmp_path.iterdir()] == ['file.bin']
@@ -0,0 +1,160 @@
+import io
+import pytest
+from app.services.file_transfer import (RangeSet, ChunkedFileWriter, UploadWindow, TransferManifestStore,
+                                       chunk_hash, chunk_ranges, stale_chunks)
+
+def test_ranges_merge():
+    ranges = RangeSet()
+    ranges.add(0, 10)
+    ranges.add(20, 30)
+    ranges.add(10, 20)
+    assert list(ranges) == [(0, 30)]
+    ranges.add(40, 50)
+    ranges.add(35, 45)
+    assert list(ranges) == [(0, 30), (35, 50)]
+    assert ranges.total() == 45
+
+def test_missing_and_covered_ranges():
+    ranges = RangeSet([(10, 20), (30, 40)])
+    assert ranges.missing(50) == [(0, 10), (20, 30), (40, 50)]
+    assert ranges.covers(12, 18)
+    assert not ranges.covers(15, 35)
+
+def test_in_order_chunks_keep_one_range():
+    ranges = RangeSet()
+    for offset in range(0, 1000000, 1000):
+        ranges.add(offset, offset + 1000)
+    assert len(ranges) == 1
+
+def test_out_of_order_chunks_written_at_offset(tmp_path):
+    path = str(tmp_path / 'out' / 'file.bin')
+    writer = ChunkedFileWriter(path, 12)
+    writer.write(8, b'cccc')
+    writer.write(0, b'aaaa')
+    assert not writer.is_complete()
+    with pytest.raises(ValueError):
+        writer.finish()
+    writer.write(4, b'bbbb')
+    assert writer.bytes_received == 12
+    writer.finish()
+    assert open(path, 'rb').read() == b'aaaabbbbcccc'
+    assert not (tmp_path / 'out' / 'file.bin.part').exists()
+
+def test_chunk_outside_file_rejected(tmp_path):
+    writer = ChunkedFileWriter(str(tmp_path / 'file.bin'), 4)
+    with pytest.raises(ValueError):
+        writer.write(2, b'xxx')
+    writer.abort()
+    assert not list(tmp_path.iterdir())
+
+def test_window_limits_chunks_in_flight():
+    window = UploadWindow(file_size=10 * 100, chunk_size=100, window=4)
+    assert window.to_send(0) == [0, 100, 200, 300]
+    assert window.to_send(0) == []
+    assert window.ack(100, 0.05)
+    assert window.to_send(0.05) == [400]
+
+def test_window_grows_while_round_trips_stay_minimal():
+    window = UploadWindow(file_size=1000 * 100, chunk_size=100, window=4)
+    now = 0
+    for _ in range(3):
+        for offset in window.to_send(now):
+            window.ack(offset, now + 0.05)
+        now += 0.05
+    assert window.window > 4
+
+def test_window_shrinks_when_queueing_delay_builds():
+    window = UploadWindow(file_size=1000 * 100, chunk_size=100, window=16)
+    now = 0
+    for rtt in (0.05, 0.3, 0.3, 0.3, 0.3, 0.3):
+        for offset in window.to_send(now):
+            window.ack(offset, now + rtt)
+        now += rtt
+    assert window.window < 16
+
+def test_unacked_chunks_resent_and_completion():
+    window = UploadWindow(file_size=250, chunk_size=100, window=8)
+    assert window.to_send(0) == [0, 100, 200]
+    window.ack(0, 0.1)
+    window.ack(200, 0.1)
+    assert window.to_send(10) == [100]
+    assert not window.ack(300, 10)
+    window.ack(100, 10.1)
+    assert window.is_complete()
+    assert window.bytes_acked == 250
+
+def test_timeout_follows_round_trips_and_backs_off():
+    window = UploadWindow(file_size=1000 * 100, chunk_size=100, window=2)
+    assert window.to_send(0) == [0, 100]
+    assert window.next_timeout() == 3
+    window.ack(0, 0.5)
+    window.ack(100, 0.5)
+    assert window.timeout == 1.25  # srtt 0.5 plus 4 times rttvar 0.1875
+    
+    assert window.to_send(1) == [200, 300]
+    assert window.to_send(2.5) == [200, 300]
+    assert window.timeout == 2.5
+    # Acknowledgements of resent chunks give no round trip time
+    window.ack(200, 10)
+    assert window.srtt == 0.5 and window.timeout == 2.5
+    
+def test_writer_resumes_from_checkpoint(tmp_path):
+    path = tmp_path / 'out.bin'
+    writer = ChunkedFileWriter(str(path), 10)
+    writer.write(0, b'0123')
+    writer.checkpoint()
+    assert not writer.unlogged
+    writer.write(4, b'4567')  # Never checkpointed, so not claimed on resume
+    writer.close()
+    
+    writer = ChunkedFileWriter(str(path), 10, resume=True)
+    assert writer.missing() == [(4, 10)]
+    assert writer.chunk_hashes() == {0: chunk_hash(b'0123')}
+    writer.write(4, b'4567')
+    writer.write(8, b'89')
+    writer.finish()
+    assert path.read_bytes() == b'0123456789'
+    assert [p.name for p in tmp_path.iterdir()] == ['out.bin']
+
+def test_agent_upload_resumes_from_chunk_log(tmp_path):
+    client_agent = pytest.importorskip('client_agent')
+    emitted = []
+    agent = client_agent.RemoteClient.__new__(client_agent.RemoteClient)
+    agent.client_id = 'c1'
+    agent.socket = type('Socket', (), {'emit': lambda self, event, data: emitted.append((event, data))})()
+    agent.transfer_dir = str(tmp_path / 'transfers')
+    agent.file_transfers = {}
+    start = {'transfer_id': 't1', 'filename': 'file.bin', 'dest_path': str(tmp_path / 'file.bin'),
+             'file_size': 10, 'chunk_size': 4, 'windowed': True}
+    agent._on_file_upload_start(start)
+    agent._on_file_upload_chunk({'transfer_id': 't1', 'offset': 4, 'chunk': b'4567'})
+    agent._checkpoint_upload('t1', force=True)
+    assert agent.file_transfers['t1']['unlogged'] == []
+    agent.file_transfers['t1']['temp_file'].close()
+    
+    # A new run reads the chunk log back and reports its hashes on resume
+    agent.file_transfers = agent._load_upload_manifests()
+    assert list(agent.file_transfers['t1']['received']) == [(4, 8)]
+    agent._on_file_upload_start(dict(start, resume=True))
+    assert emitted[-1] == ('file_upload_ack', {'client_id': 'c1', 'transfer_id': 't1', 'offset': 0,
+                                               'chunks': {4: chunk_hash(b'4567')}})
+    agent._on_file_upload_chunk({'transfer_id': 't1', 'offset': 0, 'chunk': b'0123'})
+    agent._on_file_upload_chunk({'transfer_id': 't1', 'offset': 8, 'chunk': b'89'})
+    assert (tmp_path / 'file.bin').read_bytes() == b'0123456789'
+    assert not list((tmp_path / 'transfers').iterdir())
+
+def test_stale_chunks_detects_changed_source():
+    chunks = {0: chunk_hash(b'0123'), 4: chunk_hash(b'4567')}
+    assert stale_chunks(io.BytesIO(b'0123456789'), chunks, 4) == []
+    assert stale_chunks(io.BytesIO(b'0123xx6789'), chunks, 4) == [4]
+
+def test_window_skips_acked_ranges():
+    window = UploadWindow(file_size=500, chunk_size=100, window=8, acked=chunk_ranges([0, 200], 100, 500))
+    assert window.to_send(0) == [100, 300, 400]
+
+def test_manifest_store_round_trip(tmp_path):
+    store = TransferManifestStore(str(tmp_path / 'transfers'))
+    store.save('t1', {'transfer_id': 't1', 'chunk_log': 'file.bin.part.chunks'})
+    assert store.load_all() == {'t1': {'transfer_id': 't1', 'chunk_log': 'file.bin.part.chunks'}}
+    store.remove('t1')
+    assert store.load_all() == {}
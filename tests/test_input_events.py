@@ -0,0 +1,69 @@
+import time
+import pytest
+from app.services.input_events import pack_input_events, unpack_input_events, INPUT_EVENT
+
+EVENTS = [
+    {'type': 'move', 'x': 100, 'y': 200},
+    {'type': 'button_down', 'button': 'right', 'x': 100, 'y': 200},
+    {'type': 'button_up', 'button': 'right', 'x': 100, 'y': 200},
+    {'type': 'scroll', 'clicks': -3, 'x': 5, 'y': 6},
+    {'type': 'key_down', 'key': 'shift'},
+    {'type': 'key_up', 'key': 'é'}
+]
+
+def test_round_trip():
+    assert unpack_input_events(pack_input_events(EVENTS)) == EVENTS
+
+def test_pointer_move_is_compact():
+    assert len(pack_input_events(EVENTS[:1])) == INPUT_EVENT.size == 6
+
+def test_truncated_batch_rejected():
+    data = pack_input_events(EVENTS)
+    with pytest.raises(ValueError):
+        unpack_input_events(data[:-1])
+
+def test_unknown_event_type_rejected():
+    with pytest.raises(ValueError):
+        unpack_input_events(INPUT_EVENT.pack(99, 0, 0, 0))
+
+def test_oversized_batch_rejected():
+    with pytest.raises(ValueError):
+        unpack_input_events(pack_input_events(EVENTS[:1] * 1000))
+
+def test_agent_decodes_and_coalesces_batches():
+    client_agent = pytest.importorskip('client_agent')
+    moves = [{'type': 'move', 'x': x, 'y': x} for x in range(5)]
+    events = client_agent.decode_input_events(pack_input_events(moves + EVENTS[1:]))
+    coalesced = client_agent.coalesce_pointer_moves(events)
+    assert coalesced[0] == (client_agent.INPUT_MOVE, 0, 4, 4, None)
+    assert len(coalesced) == len(EVENTS)
+
+def test_agent_applies_batches_in_seq_order(monkeypatch):
+    client_agent = pytest.importorskip('client_agent')
+    applied = []
+    monkeypatch.setattr(client_agent.InputDispatcher, '_apply',
+                        lambda self, kind, argument, key, x, y: applied.append((kind, argument)))
+    dispatcher = client_agent.InputDispatcher(lambda: (0, 0, 100, 100))
+    
+    def wait_for(seq):
+        deadline = time.monotonic() + 2
+        while dispatcher.applied_seq != seq and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert dispatcher.applied_seq == seq
+    
+    # The button_up overtakes its button_down
+    dispatcher.submit(2, pack_input_events([EVENTS[2]]))
+    dispatcher.submit(1, pack_input_events([EVENTS[1]]))
+    wait_for(2)
+    assert applied == [(client_agent.INPUT_BUTTON_DOWN, 3), (client_agent.INPUT_BUTTON_UP, 3)]
+    
+    # A late duplicate is dropped, and a batch that never arrives is given up on
+    dispatcher.submit(1, pack_input_events([EVENTS[1]]))
+    dispatcher.submit(4, pack_input_events([EVENTS[3]]))
+    wait_for(4)
+    assert applied[2:] == [(client_agent.INPUT_SCROLL, 253)]
+    
+    dispatcher.restart()
+    dispatcher.submit(1, pack_input_events([EVENTS[4]]))
+    wait_for(1)
+    assert applied[3:] == [(client_agent.INPUT_KEY_DOWN, len('shift'))]
@@ -0,0 +1,212 @@
+import threading
+import pytest
+from flask import Flask
+from flask_login import LoginManager, UserMixin
+from app import socketio
+from app.services.remote_management import remote_manager
+from app.services.file_transfer import TransferManifestStore, chunk_hash
+
+class FakeUser(UserMixin):
+    def __init__(self, id, is_admin):
+        self.id = id
+        self.is_admin = is_admin
+
+USERS = {'1': FakeUser(1, True), '2': FakeUser(2, True), '3': FakeUser(3, False)}
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config.update(TESTING=True, SECRET_KEY='test')
+    login_manager = LoginManager()
+    login_manager.init_app(app)
+    login_manager.user_loader(USERS.get)
+    socketio.init_app(app)
+    yield app
+    with app.app_context():
+        for client_id in list(remote_manager.streaming_sessions):
+            remote_manager.stop_streaming(client_id)
+        remote_manager.active_clients.clear()
+
+@pytest.fixture
+def connect(app):
+    def connect(user_id=None):
+        flask_client = app.test_client()
+        if user_id:
+            with flask_client.session_transaction() as session:
+                session['_user_id'] = user_id
+        return socketio.test_client(app, flask_test_client=flask_client)
+    return connect
+
+@pytest.fixture
+def agent(connect):
+    agent = connect()
+    agent.emit('client_register', {'client_id': 'c1', 'capabilities': ['screen_capture', 'remote_input']})
+    assert remote_manager.active_clients['c1']['status'] == 'online'
+    return agent
+
+@pytest.fixture
+def stream(agent):
+    success, message = remote_manager.start_streaming('c1')
+    assert success, message
+    return remote_manager.streaming_sessions['c1']
+
+def result(socket, name):
+    events = [event['args'][0] for event in socket.get_received() if event['name'] == name]
+    return events[-1] if events else None
+
+def test_only_admins_join_streams(connect, stream):
+    for user_id in (None, '3'):
+        socket = connect(user_id)
+        socket.emit('join_stream', {'client_id': 'c1', 'user_id': 1})
+        assert result(socket, 'join_stream_result')['success'] is False
+    assert not stream['viewers']
+    
+    admin = connect('1')
+    admin.emit('join_stream', {'client_id': 'c1', 'user_id': 2})
+    assert result(admin, 'join_stream_result')['success']
+    assert stream['viewers'] == {1}
+
+def test_leave_stream_ignores_payload_user(connect, stream):
+    admin = connect('1')
+    admin.emit('join_stream', {'client_id': 'c1'})
+    for user_id in (None, '2'):
+        connect(user_id).emit('leave_stream', {'client_id': 'c1', 'user_id': 1})
+    assert stream['viewers'] == {1}
+
+def test_frame_acks_only_from_viewer_socket(connect, stream):
+    admin = connect('1')
+    admin.emit('join_stream', {'client_id': 'c1'})
+    outstanding = stream['viewer_state'][1]['outstanding']
+    outstanding[5] = 0
+    
+    for socket in (connect(), connect('2'), connect('1')):
+        socket.emit('screen_frame_ack', {'client_id': 'c1', 'user_id': 1, 'seq': 5})
+    assert 5 in outstanding
+    admin.emit('screen_frame_ack', {'client_id': 'c1', 'seq': 5})
+    assert not outstanding
+
+def test_tier_changed_only_by_viewer_socket(connect, agent):
+    remote_manager.start_streaming('c1', simulcast=True)
+    stream = remote_manager.streaming_sessions['c1']
+    admin = connect('1')
+    admin.emit('join_stream', {'client_id': 'c1', 'tier': 'full'})
+    
+    other = connect('2')
+    other.emit('select_stream_tier', {'client_id': 'c1', 'user_id': 1, 'tier': 'low'})
+    assert result(other, 'stream_tier_selected')['success'] is False
+    assert stream['viewer_state'][1]['tier'] == 'full'
+    
+    admin.emit('select_stream_tier', {'client_id': 'c1', 'tier': 'low'})
+    assert result(admin, 'stream_tier_selected')['tier'] == 'low'
+
+def test_region_changed_only_by_viewer_socket(connect, stream):
+    admin = connect('1')
+    admin.emit('join_stream', {'client_id': 'c1'})
+    
+    for socket in (connect(), connect('2')):
+        socket.emit('set_stream_region', {'client_id': 'c1', 'user_id': 1, 'region': [0, 0, 100, 100]})
+        assert result(socket, 'stream_region_result')['success'] is False
+    assert stream['capture_area']['region'] is None
+    
+    admin.emit('set_stream_region', {'client_id': 'c1', 'region': [0, 0, 100, 100]})
+    assert result(admin, 'stream_region_result')['success']
+
+def test_input_relayed_only_from_viewer_socket(connect, agent, stream):
+    from app.services.input_events import pack_input_events
+    admin = connect('1')
+    admin.emit('join_stream', {'client_id': 'c1'})
+    agent.get_received()
+    events = pack_input_events([{'type': 'move', 'x': 1, 'y': 2}])
+    
+    for socket in (connect(), connect('3')):
+        socket.emit('join_stream', {'client_id': 'c1', 'user_id': 1})
+        socket.emit('input_events', {'client_id': 'c1', 'user_id': 1, 'events': events})
+    # The viewer's user, but not the socket it joined from
+    connect('1').emit('input_events', {'client_id': 'c1', 'events': events})
+    assert result(agent, 'input_events') is None
+    
+    admin.emit('input_events', {'client_id': 'c1', 'events': events})
+    assert result(agent, 'input_events')['events'] == events
+
+def test_dropped_agent_socket_interrupts_transfers(agent, tmp_path, monkeypatch):
+    monkeypatch.setattr(remote_manager, 'transfer_manifests', TransferManifestStore(str(tmp_path / 'transfers')))
+    monkeypatch.setattr(threading, 'Timer', lambda *args: type('Timer', (), {'start': lambda self: None})())
+    source = tmp_path / 'source.bin'
+    source.write_bytes(b'x' * 1000)
+    success, transfer_id = remote_manager.start_file_upload('c1', str(source), '/tmp/dest.bin')
+    assert success
+    
+    # The connection drops without the agent sending client_disconnect
+    agent.disconnect()
+    assert remote_manager.active_clients['c1']['status'] == 'offline'
+    assert remote_manager.file_transfer_sessions.pop(transfer_id)['status'] == 'interrupted'
+    assert transfer_id in remote_manager.transfer_manifests.load_all()
+
+def test_lost_upload_window_resent_without_acks(connect, tmp_path, monkeypatch):
+    monkeypatch.setattr(remote_manager, 'transfer_manifests', TransferManifestStore(str(tmp_path / 'transfers')))
+    timers = []
+    
+    class Timer:
+        def __init__(self, interval, function):
+            self.interval = interval
+            self.function = function
+            timers.append(self)
+        
+        def start(self):
+            pass
+        
+        def cancel(self):
+            pass
+    
+    monkeypatch.setattr(threading, 'Timer', Timer)
+    agent = connect()
+    agent.emit('client_register', {'client_id': 'c1', 'capabilities': ['windowed_uploads']})
+    source = tmp_path / 'source.bin'
+    source.write_bytes(b'x' * 1000)
+    success, transfer_id = remote_manager.start_file_upload('c1', str(source), '/tmp/dest.bin')
+    assert success
+    agent.emit('file_upload_ack', {'transfer_id': transfer_id})
+    assert [event['args'][0]['offset'] for event in agent.get_received() if event['name'] == 'file_upload_chunk'] == [0]
+    
+    # The chunk is lost, so no acknowledgement comes; the timer resends it once it times out
+    window = remote_manager.file_transfer_sessions[transfer_id]['window']
+    window.in_flight[0] -= timers[-1].interval
+    timers[-1].function()
+    assert [event['args'][0]['offset'] for event in agent.get_received() if event['name'] == 'file_upload_chunk'] == [0]
+    assert timers[-1].interval > timers[0].interval
+    remote_manager.file_transfer_sessions.pop(transfer_id)
+
+def test_interrupted_download_resumes_from_chunk_log(agent, connect, tmp_path, monkeypatch):
+    monkeypatch.setattr(remote_manager, 'transfer_manifests', TransferManifestStore(str(tmp_path / 'transfers')))
+    monkeypatch.setattr(threading, 'Timer', lambda *args: type('Timer', (), {'start': lambda self: None})())
+    local_path = tmp_path / 'download.bin'
+    success, transfer_id = remote_manager.request_file_download('c1', '/remote/file.bin', str(local_path))
+    assert success
+    agent.emit('file_download_chunk', {'transfer_id': transfer_id, 'offset': 0, 'chunk': b'x' * 100,
+                                       'file_size': 3 * 1024 * 1024})
+    
+    agent.disconnect()
+    manifest = remote_manager.transfer_manifests.load_all()[transfer_id]
+    assert 'chunks' not in manifest and manifest['ranges'] == [[0, 100]]
+    
+    agent = connect()
+    agent.emit('client_register', {'client_id': 'c1', 'capabilities': ['resumable_transfers']})
+    request = result(agent, 'file_download_request')
+    assert request['chunks'] == {'0': chunk_hash(b'x' * 100)}
+    assert request['ranges'][0] == [100, 3 * 1024 * 1024]
+    remote_manager._fail_download(transfer_id, 'test over')
+    remote_manager.file_transfer_sessions.pop(transfer_id)
+
+def test_rgb565_rejected_with_lossy_codec(agent):
+    remote_manager.active_clients['c1']['color_modes'] = ['full', 'rgb565']
+    success, message = remote_manager.start_streaming('c1', codec='jpeg', color_mode='rgb565')
+    assert not success and 'jpeg' in message
+    assert 'c1' not in remote_manager.streaming_sessions
+
+def test_thumbnail_settings_limited(agent):
+    for settings in ({'interval': 0.001}, {'interval': float('nan')}, {'max_width': 0}, {'max_width': 100000}):
+        success, message = remote_manager.start_thumbnails(**settings)
+        assert not success, settings
+    assert remote_manager.thumbnail_settings is None
+    assert remote_manager.start_thumbnails(interval=10, max_width=640)[0]
+    remote_manager.stop_thumbnails()
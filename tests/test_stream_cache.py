@@ -0,0 +1,57 @@
+import pytest
+from app.services.stream_cache import StreamFrameCache
+
+@pytest.fixture
+def cache():
+    return StreamFrameCache(max_deltas=3, max_stream_bytes=1000)
+
+def keyframe(seq):
+    return {'type': 'key', 'seq': seq, 'frame': b'k'}
+
+def delta(seq):
+    return {'type': 'delta', 'seq': seq, 'tiles': []}
+
+def test_keyframe_and_deltas_replayed_in_order(cache):
+    cache.add_frame('s1', keyframe(1), 500)
+    cache.add_frame('s1', delta(2), 10)
+    cache.add_frame('s1', delta(3), 10)
+    assert [frame['seq'] for frame in cache.get_frames('s1')] == [1, 2, 3]
+
+def test_new_keyframe_replaces_deltas(cache):
+    cache.add_frame('s1', keyframe(1), 500)
+    cache.add_frame('s1', delta(2), 10)
+    cache.add_frame('s1', keyframe(3), 400)
+    assert [frame['seq'] for frame in cache.get_frames('s1')] == [3]
+    assert cache.memory_usage()['total_bytes'] == 400
+
+def test_delta_without_keyframe_not_cached(cache):
+    assert not cache.add_frame('s1', delta(1), 10)
+    assert cache.get_frames('s1') == []
+
+def test_overflow_drops_stream(cache):
+    cache.add_frame('s1', keyframe(1), 500)
+    for seq in range(2, 5):
+        assert cache.add_frame('s1', delta(seq), 10)
+    assert not cache.add_frame('s1', delta(5), 10)
+    assert cache.get_frames('s1') == []
+
+def test_byte_limit_drops_stream(cache):
+    cache.add_frame('s1', keyframe(1), 900)
+    assert not cache.add_frame('s1', delta(2), 200)
+    assert cache.memory_usage()['total_bytes'] == 0
+
+def test_evict(cache):
+    cache.add_frame('s1', keyframe(1), 500)
+    cache.add_frame('s2', keyframe(1), 300)
+    cache.evict('s1')
+    assert cache.memory_usage() == {'total_bytes': 300, 'streams': {'s2': 300}}
+
+def test_tiers_cached_separately(cache):
+    cache.add_frame('s1', keyframe(1), 500)
+    cache.add_frame('s1', keyframe(1), 100, tier='low')
+    cache.add_frame('s1', delta(2), 10, tier='low')
+    assert [frame['seq'] for frame in cache.get_frames('s1')] == [1]
+    assert [frame['seq'] for frame in cache.get_frames('s1', 'low')] == [1, 2]
+    assert cache.memory_usage() == {'total_bytes': 610, 'streams': {'s1': 610}}
+    cache.evict('s1')
+    assert cache.get_frames('s1', 'low') == []
@@ -0,0 +1,92 @@
+import pytest
+from app.services.stream_codecs import choose_stream_codec, choose_color_mode, DEFAULT_STREAM_CODEC
+
+ADVERTISED = {
+    'jpeg': {'encode_ms': 6, 'bytes': 110000},
+    'webp': {'encode_ms': 33, 'bytes': 68000},
+    'png': {'encode_ms': 27, 'bytes': 58000},
+    'zlib': {'encode_ms': 10, 'bytes': 67000}
+}
+
+def test_default_codec_without_workload():
+    assert choose_stream_codec(ADVERTISED) == (DEFAULT_STREAM_CODEC, None)
+
+def test_legacy_client_gets_default_codec():
+    assert choose_stream_codec({}, workload='text') == (DEFAULT_STREAM_CODEC, None)
+    assert choose_stream_codec({}, codec='jpeg') == ('jpeg', None)
+
+def test_explicit_codec_must_be_supported():
+    assert choose_stream_codec(ADVERTISED, codec='png') == ('png', None)
+    codec, error = choose_stream_codec({'jpeg': ADVERTISED['jpeg']}, codec='webp')
+    assert codec is None and 'webp' in error
+
+def test_workload_picks_cheapest_matching_codec():
+    assert choose_stream_codec(ADVERTISED, workload='text') == ('zlib', None)
+    assert choose_stream_codec(ADVERTISED, workload='video') == ('webp', None)
+
+def test_mixed_codec_suits_text_and_video():
+    advertised = dict(ADVERTISED, mixed={'encode_ms': 30, 'bytes': 30000})
+    assert choose_stream_codec(advertised, workload='text') == ('mixed', None)
+    assert choose_stream_codec(advertised, workload='video') == ('mixed', None)
+
+def test_link_rate_changes_choice():
+    # On a fast link encode time dominates, on a slow one frame size does
+    assert choose_stream_codec(ADVERTISED, workload='auto', link_rate=1e9) == ('jpeg', None)
+    assert choose_stream_codec(ADVERTISED, workload='auto', link_rate=1e5) == ('png', None)
+
+def test_unknown_workload():
+    codec, error = choose_stream_codec(ADVERTISED, workload='games')
+    assert codec is None and error
+
+def test_full_colour_keeps_codec_choice():
+    assert choose_color_mode([], None, 'zlib') == ('full', 'zlib', None)
+
+def test_colour_mode_must_be_advertised():
+    mode, codec, error = choose_color_mode([], 'grayscale')
+    assert mode is None and 'grayscale' in error
+
+def test_colour_mode_restricts_codec():
+    modes = ['full', 'grayscale', 'rgb565', 'palette']
+    assert choose_color_mode(modes, 'palette') == ('palette', 'png', None)
+    assert choose_color_mode(modes, 'rgb565', 'zlib') == ('rgb565', 'zlib', None)
+    mode, codec, error = choose_color_mode(modes, 'grayscale', 'zlib')
+    assert mode is None and error
+    mode, codec, error = choose_color_mode(modes, 'rgb565', 'jpeg')
+    assert mode is None and 'jpeg' in error
+
+def test_agent_palette_reused_between_keyframes():
+    client_agent = pytest.importorskip('client_agent')
+    from PIL import Image
+    reducer = client_agent.ColorReducer('palette')
+    frame = Image.new('RGB', (64, 64), (200, 30, 30))
+    keyframe = reducer.reduce(frame, keyframe=True)
+    delta = reducer.reduce(Image.new('RGB', (64, 64), (30, 200, 30)))
+    assert keyframe.mode == delta.mode == 'P'
+    assert delta.getpalette() == keyframe.getpalette()
+    white = Image.new('RGB', (1, 1), (255, 255, 255))
+    assert client_agent.ColorReducer('rgb565').reduce(white).getpixel((0, 0)) == (255, 255, 255)
+
+def test_agent_dropped_delta_forces_keyframe():
+    client_agent = pytest.importorskip('client_agent')
+    import threading
+    from PIL import Image
+    encoder = client_agent.TileDeltaEncoder()
+    frame = Image.new('RGB', (256, 256))
+    assert encoder.encode(frame, 75)['type'] == 'key'
+    frame = frame.copy()
+    frame.paste((255, 0, 0), (0, 0, 8, 8))
+    delta = encoder.encode(frame, 75)
+    assert delta['type'] == 'delta'
+    delta['tier'] = 'full'
+    
+    agent = client_agent.RemoteClient.__new__(client_agent.RemoteClient)
+    agent.stream_credit = threading.Condition()
+    agent.stream_credits = 0
+    agent.stream_encoders = {'full': encoder}
+    queue = client_agent.DropOldestQueue(maxsize=1, on_drop=agent._drop_encoded_frame)
+    queue.put(delta)
+    queue.put({'tiers': []})
+    assert agent.stream_credits == 1
+    frame = frame.copy()
+    frame.paste((0, 255, 0), (0, 0, 8, 8))
+    assert encoder.encode(frame, 75)['type'] == 'key'
@@ -0,0 +1,53 @@
+import pytest
+from app.services.stream_control import AdaptiveStreamController
+
+@pytest.fixture
+def controller():
+    return AdaptiveStreamController(quality=75, fps=10)
+
+def feed_frames(controller, count, size=50000, encode_ms=10, start_seq=1):
+    for seq in range(start_seq, start_seq + count):
+        controller.record_frame(seq, size, encode_ms)
+
+def test_initial_settings_clamped_to_bounds():
+    controller = AdaptiveStreamController(quality=100, fps=60, scale=2.0)
+    assert controller.settings == {'quality': 85, 'fps': 20, 'scale': 1.0}
+
+def test_no_update_before_interval(controller):
+    feed_frames(controller, 5)
+    assert controller.update(now=controller.last_update + 0.1) is None
+
+def test_slow_encoding_lowers_scale(controller):
+    feed_frames(controller, 10, encode_ms=150)
+    settings = controller.update(now=controller.last_update + 2)
+    assert settings['scale'] < 1.0
+    assert settings['quality'] == 75
+
+def test_dropped_frames_lower_quality(controller):
+    feed_frames(controller, 10)
+    controller.record_drop()
+    settings = controller.update(now=controller.last_update + 2)
+    assert settings['quality'] < 75
+    assert settings['fps'] == 10
+
+def test_rising_round_trips_lower_quality(controller):
+    feed_frames(controller, 10)
+    controller.record_ack(1, 0.02, now=1.0)
+    for seq in range(2, 10):
+        controller.record_ack(seq, 0.5, now=1.0 + seq * 0.1)
+    settings = controller.update(now=controller.last_update + 2)
+    assert settings['quality'] < 75
+
+def test_headroom_raises_fps(controller):
+    feed_frames(controller, 10, size=1000)
+    for seq in range(1, 10):
+        controller.record_ack(seq, 0.02, now=1.0 + seq * 0.1)
+    settings = controller.update(now=controller.last_update + 2)
+    assert settings['fps'] == 11
+
+def test_settings_stay_within_bounds():
+    controller = AdaptiveStreamController(quality=30, fps=2, scale=0.25)
+    feed_frames(controller, 10, encode_ms=1000)
+    controller.record_drop()
+    assert controller.update(now=controller.last_update + 2) is None
+    assert controller.settings == {'quality': 30, 'fps': 2, 'scale': 0.25}
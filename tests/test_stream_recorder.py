@@ -0,0 +1,99 @@
+import time
+import threading
+import pytest
+from app.services.stream_recorder import StreamRecorder
+
+@pytest.fixture
+def recorder(tmp_path):
+    return StreamRecorder(str(tmp_path), segment_max_bytes=100)
+
+def keyframe(seq):
+    return {'type': 'key', 'seq': seq, 'width': 4, 'height': 4, 'frame': b'K' * 60, 'encoding': 'binary'}
+
+def delta(seq):
+    tiles = [{'x': 0, 'y': 0, 'w': 2, 'h': 2, 'data': b'a' * 5}, {'x': 2, 'y': 2, 'w': 2, 'h': 2, 'data': b'b' * 3}]
+    return {'type': 'delta', 'seq': seq, 'width': 4, 'height': 4, 'tiles': tiles, 'encoding': 'binary'}
+
+def record(recorder, frames):
+    recorder.start('s1', {'client_id': 'c1'})
+    for frame in frames:
+        recorder.write('s1', frame)
+    recorder.stop('s1')
+    recorder.flush()
+
+def test_frames_read_back(recorder):
+    record(recorder, [keyframe(1), delta(2)])
+    frames = recorder.read_frames('s1')
+    assert [frame['seq'] for frame in frames] == [1, 2]
+    assert frames[0]['frame'] == b'K' * 60
+    assert [tile['data'] for tile in frames[1]['tiles']] == [b'a' * 5, b'b' * 3]
+    assert frames[1]['tiles'][1]['x'] == 2
+
+def test_waits_for_first_keyframe(recorder):
+    recorder.start('s1')
+    assert not recorder.write('s1', delta(1))
+    assert recorder.write('s1', keyframe(2))
+    recorder.stop('s1')
+    recorder.flush()
+    assert [frame['seq'] for frame in recorder.read_frames('s1')] == [2]
+
+def test_segments_start_at_keyframes(recorder):
+    record(recorder, [keyframe(1), delta(2), keyframe(3), delta(4), delta(5), keyframe(6)])
+    manifest = recorder.read_manifest('s1')
+    assert manifest['frames'] == 6
+    assert manifest['segments'] == 3
+    assert [frame['seq'] for frame in recorder.read_frames('s1')] == [1, 2, 3, 4, 5, 6]
+
+def test_seek_starts_at_previous_keyframe(recorder, monkeypatch):
+    clock = iter(range(100, 200))
+    monkeypatch.setattr('app.services.stream_recorder.time.time', lambda: next(clock))
+    # Recording starts at 100, frames are stamped 101 to 106
+    record(recorder, [keyframe(1), delta(2), keyframe(3), delta(4), delta(5), keyframe(6)])
+    frames = recorder.read_frames('s1', start=4.5, duration=1)
+    assert [frame['seq'] for frame in frames] == [3, 4, 5]
+    assert frames[0]['time'] == 3
+
+def test_full_queue_drops_until_keyframe(tmp_path):
+    recorder = StreamRecorder(str(tmp_path), queue_size=1)
+    # Hold the writer up on the start message so the queue fills
+    gate = threading.Event()
+    open_recording = recorder._open_recording
+    recorder._open_recording = lambda *args: gate.wait() and open_recording(*args)
+    recorder.start('s1')
+    while not recorder.queue.empty():
+        time.sleep(0.01)
+    
+    assert recorder.write('s1', keyframe(1))
+    assert not recorder.write('s1', delta(2))
+    gate.set()
+    recorder.flush()
+    assert not recorder.write('s1', delta(3))
+    assert recorder.write('s1', keyframe(4))
+    recorder.stop('s1')
+    recorder.flush()
+    assert [frame['seq'] for frame in recorder.read_frames('s1')] == [1, 4]
+
+def test_control_messages_never_wait_for_room(tmp_path):
+    recorder = StreamRecorder(str(tmp_path), queue_size=1)
+    recorder.start('s1')
+    recorder.flush()
+    # Hold the writer up on a frame and fill the queue behind it
+    gate = threading.Event()
+    write_frame = recorder._write_frame
+    recorder._write_frame = lambda *args: gate.wait() and write_frame(*args)
+    assert recorder.write('s1', keyframe(1))
+    while not recorder.queue.empty():
+        time.sleep(0.01)
+    assert recorder.write('s1', keyframe(2))
+    
+    control = threading.Thread(target=lambda: (recorder.start('s2'), recorder.stop('s1')), daemon=True)
+    control.start()
+    control.join(timeout=1)
+    assert not control.is_alive()
+    gate.set()
+    recorder.flush()
+    assert [frame['seq'] for frame in recorder.read_frames('s1')] == [1, 2]
+    assert recorder.is_recording('s2')
+
+def test_unknown_recording(recorder):
+    assert recorder.read_frames('missing') is None
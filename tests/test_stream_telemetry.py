@@ -0,0 +1,74 @@
+import pytest
+from app.services.stream_telemetry import LatencyHistogram, RateWindow, StreamTelemetry
+
+@pytest.fixture
+def telemetry():
+    return StreamTelemetry(window=10)
+
+def test_histogram_percentiles_stay_within_buckets():
+    histogram = LatencyHistogram()
+    for value in range(1, 101):
+        histogram.record(value)
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == 100
+    assert snapshot['mean_ms'] == 50.5
+    assert 20 <= snapshot['p50_ms'] <= 50
+    assert 50 < snapshot['p99_ms'] <= 100
+    assert snapshot['max_ms'] == 100
+
+def test_histogram_ignores_missing_samples():
+    histogram = LatencyHistogram()
+    histogram.record(None)
+    assert histogram.snapshot()['count'] == 0
+    assert histogram.percentile(50) is None
+
+def test_rate_window_fills_quiet_seconds():
+    rates = RateWindow(seconds=5)
+    rates.add(100.2, frames=1, size=1000)
+    rates.add(100.7, frames=1, size=1000)
+    rates.add(102.5, frames=1, size=500, dropped=1)
+    summary = rates.snapshot(103.1)
+    assert summary['fps']['series'] == [2, 0, 1]
+    assert summary['bytes_per_second']['max'] == 2000
+    assert summary['dropped_per_second']['mean'] == 0.33
+
+def test_frame_latency_broken_down_by_stage(telemetry):
+    telemetry.record_frame(1, 5000, captured_at=10.0, sent_at=10.05, received_at=10.08,
+                           capture_ms=10, encode_ms=30, relay_ms=2, now=10.08)
+    telemetry.record_ack(1, 0.05, decode_ms=4, render_ms=6)
+    latency = telemetry.snapshot(now=11)['latency']
+    assert latency['agent_queue']['max_ms'] == pytest.approx(10)
+    assert latency['uplink']['max_ms'] == pytest.approx(30)
+    assert latency['downlink']['max_ms'] == pytest.approx(20)
+    # 50 ms at the client, 30 ms uplink, 2 ms relay, 20 ms downlink, 10 ms in the viewer
+    assert latency['end_to_end']['max_ms'] == pytest.approx(112)
+
+def test_end_to_end_counted_once_per_frame(telemetry):
+    telemetry.record_frame(1, 5000, captured_at=10.0, sent_at=10.05, received_at=10.08, now=10.08)
+    telemetry.record_ack(1, 0.05)
+    telemetry.record_ack(1, 0.07)
+    latency = telemetry.snapshot(now=11)['latency']
+    assert latency['downlink']['count'] == 2
+    assert latency['end_to_end']['count'] == 1
+
+def test_uplink_clamped_for_skewed_clocks(telemetry):
+    telemetry.record_frame(1, 5000, captured_at=10.0, sent_at=10.05, received_at=9.9, now=10)
+    assert telemetry.snapshot(now=11)['latency']['uplink']['max_ms'] == 0
+
+def test_drops_counted(telemetry):
+    telemetry.record_drop(now=10)
+    telemetry.set_agent_dropped(3)
+    snapshot = telemetry.snapshot(now=11)
+    assert snapshot['dropped'] == 1
+    assert snapshot['agent_dropped'] == 3
+    assert snapshot['rates']['dropped_per_second']['series'] == [1]
+
+def test_input_to_frame_measured_from_first_frame_showing_it(telemetry):
+    telemetry.record_input(1, now=10.0)
+    telemetry.record_input(2, now=10.01)
+    telemetry.record_frame(1, 5000, received_at=10.09, input_seq=2, now=10.09)
+    telemetry.record_frame(2, 5000, received_at=10.2, now=10.2)
+    latency = telemetry.snapshot(now=11)['latency']['input_to_frame']
+    assert latency['count'] == 1
+    assert latency['max_ms'] == pytest.approx(80)
+    assert not telemetry.pending_input
@@ -0,0 +1,38 @@
+from app.services.thumbnail_cache import ThumbnailCache
+
+def test_etag_follows_content():
+    cache = ThumbnailCache()
+    first = cache.put('a', b'image-1', 320, 180)
+    assert cache.put('a', b'image-1', 320, 180) == first
+    assert cache.put('a', b'image-2', 320, 180) != first
+    assert cache.get('a')['image'] == b'image-2'
+
+def test_unchanged_image_keeps_update_time():
+    cache = ThumbnailCache()
+    cache.put('a', b'image', 320, 180)
+    updated_at = cache.get('a')['updated_at']
+    cache.put('a', b'image', 320, 180, captured_at=123)
+    assert cache.get('a')['updated_at'] == updated_at
+    assert cache.get('a')['captured_at'] == 123
+
+def test_least_recently_used_evicted_by_count():
+    cache = ThumbnailCache(max_entries=2)
+    cache.put('a', b'1', 1, 1)
+    cache.put('b', b'2', 1, 1)
+    cache.get('a')
+    cache.put('c', b'3', 1, 1)
+    assert set(cache.get_many()) == {'a', 'c'}
+
+def test_evicted_by_total_size():
+    cache = ThumbnailCache(max_bytes=10)
+    cache.put('a', b'x' * 6, 1, 1)
+    cache.put('b', b'x' * 6, 1, 1)
+    assert cache.get('a') is None
+    assert cache.memory_usage() == {'thumbnails': 1, 'total_bytes': 6}
+
+def test_get_many_skips_unknown_clients():
+    cache = ThumbnailCache()
+    cache.put('a', b'1', 1, 1)
+    assert list(cache.get_many(['a', 'missing'])) == ['a']
+    cache.remove('a')
+    assert cache.memory_usage()['total_bytes'] == 0